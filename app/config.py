@@ -9,6 +9,39 @@ class Settings(BaseSettings):
     OPENAI_API_KEY:str 
     GOOGLE_API_KEY:str
 
+    # vision-анализ фотографий
+    OPENAI_VISION_MODEL:str = "gpt-4o"
+    LLM_CONCURRENCY:int = 5
+    LLM_TIMEOUT:float = 60.0
+    ANALYSIS_CACHE_TTL_DAYS:int = 30
+    ANALYSIS_CACHE_MAX_ENTRIES:int = 10000
+
+    # очередь сборок книг
+    JOB_WORKERS:int = 2
+    JOB_STAGE_RETRIES:int = 2
+    JOB_RETRY_DELAY:float = 5.0
+    JOB_DRAIN_TIMEOUT:float = 60.0
+
+    # датасет Apify читается страницами
+    APIFY_PAGE_SIZE:int = 100
+    # повторный /start-scrape того же профиля в пределах TTL берет готовый прогон
+    SCRAPE_CACHE_TTL_HOURS:float = 12.0
+    SCRAPE_INFLIGHT_MINUTES:float = 15.0   # запущенный, но еще не собранный скрапинг профиля
+    # повторный скрапинг профиля качает и анализирует только новые посты
+    INCREMENTAL_SCRAPE:bool = True
+
+    # загрузка изображений
+    DOWNLOAD_DEADLINE:float = 120.0
+    DOWNLOAD_WAIT_TIMEOUT:float = 180.0
+    DOWNLOAD_CONCURRENCY:int = 8
+    DOWNLOAD_PER_HOST:int = 4
+    DOWNLOAD_MAX_CONNECTIONS:int = 20
+    DOWNLOAD_HTTP2:bool = True
+
+    # книги: True — фото встраиваются в book.html как data URI
+    BOOK_EMBED_IMAGES:bool = False
+    IMAGE_WORKERS:int = 0         # 0 — по числу ядер
+
     class Config:
         env_file=".env"
 
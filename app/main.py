@@ -1,26 +1,72 @@
 # app/main.py
-from fastapi import FastAPI, Request, BackgroundTasks, HTTPException
-from fastapi.responses import FileResponse, HTMLResponse
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import AnyUrl
 from pathlib import Path
-import json, logging, anyio
+import asyncio, logging
 
 from app.config import settings
-from app.services.apify_client import run_actor, fetch_run, fetch_items
-from app.services.downloader import download_photos
+from app.services import delivery, derivatives, downloader, job_queue, pipeline, posts, progress, registry, run_status, singleflight, templates
+from app.services.apify_client import fetch_run, run_actor
+from app.services.book_builder import export_single_file
 
 log = logging.getLogger("api")
-app = FastAPI(title="Романтическая Летопись Любви", description="Создает красивые романтические книги на основе Instagram профилей для ваших любимых")
+
+# запуск актора закончился без датасета
+ACTOR_FAILED_EVENTS = ("ACTOR.RUN.FAILED", "ACTOR.RUN.ABORTED", "ACTOR.RUN.TIMED_OUT")
+ACTOR_FAILED_STATUSES = ("FAILED", "ABORTED", "TIMED-OUT")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # очередь сборок: задачи переживают рестарт, воркеров не больше JOB_WORKERS
+    job_queue.register("scrape", pipeline.SCRAPE_STAGES, on_failed=pipeline.job_failed)
+    job_queue.register("book", pipeline.BOOK_STAGES, on_failed=pipeline.job_failed)
+    templates.warm()
+    # реестр прогонов сверяем с data/ (перечитываются только измененные прогоны)
+    await asyncio.to_thread(registry.rebuild)
+    await downloader.open_pool()
+    await job_queue.start()
+    yield
+    await job_queue.stop()
+    await downloader.close_pool()
+    derivatives.shutdown_pool()
+
+
+app = FastAPI(title="Романтическая Летопись Любви", description="Создает красивые романтические книги на основе Instagram профилей для ваших любимых", lifespan=lifespan)
 
 # Подключаем статические файлы
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # ───────────── /start-scrape ────────────────────────────────
 @app.get("/start-scrape")
-async def start_scrape(url: AnyUrl):
+async def start_scrape(url: AnyUrl, fresh: bool = False):
     clean_url = str(url).rstrip("/")        # без закрывающего «/»
 
+    # профиль недавно собирали (или собирают прямо сейчас) — берем его прогон вместо нового запуска актора
+    cached = None if fresh else registry.cached_scrape(clean_url, settings.SCRAPE_CACHE_TTL_HOURS * 3600,
+                                                       inflight=settings.SCRAPE_INFLIGHT_MINUTES * 60)
+    if cached and cached["fetchedAt"] is None:
+        if await _scrape_alive(cached["runId"]):
+            log.info("Scrape of %s already running: runId=%s", clean_url, cached["runId"])
+            return {"runId": cached["runId"], "cached": True, "inflight": True,
+                    "message": "Этот профиль уже собирается — книга будет готова вместе с ним! ❤️"}
+        # актор упал, а webhook о сбое не дошел — закрываем его прогон и запускаем заново
+        registry.scrape_failed(cached["runId"])
+        pipeline.job_failed({"run_id": cached["runId"]}, "scrape: actor run did not succeed")
+        cached = None
+    if cached and posts.exists(Path("data") / cached["runId"]):
+        run_id = cached["runId"]
+        status_info = run_status.read(Path("data") / run_id) or {}
+        job_id = None
+        if not status_info.get("stages", {}).get("book_generated"):
+            job_id = job_queue.enqueue("book", {"run_id": run_id}, dedup=True)
+        log.info("Scrape cache hit for %s: runId=%s", clean_url, run_id)
+        return {"runId": run_id, "jobId": job_id, "cached": True, "fetchedAt": cached["fetchedAt"],
+                "message": "Профиль уже собран — создаем книгу по сохраненным данным! ❤️"}
+
     run_input = {
         "directUrls":     [clean_url],
         "resultsType":    "details",
@@ -28,24 +74,44 @@ async def start_scrape(url: AnyUrl):
         
         "resultsLimit":   200,
     }
+    # одновременные запросы одного профиля ждут один запуск актора
+    run = await singleflight.do(("scrape", registry.normalize_url(clean_url)),
+                                lambda: _launch_scrape(clean_url, run_input))
+    return {"runId": run["id"], "cached": False, "message": "Создание романтической книги началось! ❤️"}
+
 
+async def _scrape_alive(run_id: str) -> bool:
+    """Запуск актора еще идет (или успел завершиться успешно)."""
+    try:
+        run = await fetch_run(run_id)
+    except Exception as e:
+        # Apify недоступен — новый запуск тоже не выйдет, ждем текущий
+        log.warning("cannot check Apify run %s: %s", run_id, e)
+        return True
+    return bool(run) and run.get("status") not in ACTOR_FAILED_STATUSES
+
+
+async def _launch_scrape(clean_url: str, run_input: dict) -> dict:
+    """Запускает актор Apify; о завершении (успешном или нет) сообщит webhook."""
     webhook = {
-        "eventTypes": ["ACTOR.RUN.SUCCEEDED"],
+        "eventTypes": ["ACTOR.RUN.SUCCEEDED", *ACTOR_FAILED_EVENTS],
         "requestUrl": f"{settings.BACKEND_BASE}/webhook/apify",
         "payloadTemplate": (
             '{"runId":"{{runId}}",'
-            '"datasetId":"{{defaultDatasetId}}"}'
+            '"datasetId":"{{defaultDatasetId}}",'
+            '"eventType":"{{eventType}}"}'
         ),
     }
 
     run = await run_actor(run_input, webhooks=[webhook])
     log.info("Actor started runId=%s", run["id"])
-    return {"runId": run["id"], "message": "Создание романтической книги началось! ❤️"}
+    registry.started(run["id"], clean_url)
+    return run
 
 
 # ───────────── /webhook/apify ───────────────────────────────
 @app.post("/webhook/apify")
-async def apify_webhook(request: Request, background: BackgroundTasks):
+async def apify_webhook(request: Request):
     try:
         payload = await request.json()
     except Exception:
@@ -56,119 +122,91 @@ async def apify_webhook(request: Request, background: BackgroundTasks):
     if not run_id:
         raise HTTPException(400, "runId missing")
 
-    dataset_id = payload.get("datasetId")
-    if not dataset_id:
-        run = await fetch_run(run_id)
-        dataset_id = run.get("defaultDatasetId")          # fallback
-
-    if not dataset_id:
-        raise HTTPException(500, "datasetId unresolved")
-
-    # --- сохраняем JSON -----------------------------------------------------------------
-    items = await fetch_items(dataset_id)
-    run_dir = Path("data") / run_id
-    run_dir.mkdir(parents=True, exist_ok=True)
-    (run_dir / "posts.json").write_text(json.dumps(items, ensure_ascii=False, indent=2))
+    # актор упал — собирать нечего: снимаем прогон с кэша и сообщаем странице
+    event_type = payload.get("eventType")
+    if event_type in ACTOR_FAILED_EVENTS:
+        log.warning("Actor run %s ended with %s", run_id, event_type)
+        registry.scrape_failed(run_id)
+        pipeline.job_failed({"run_id": run_id}, f"scrape: {event_type}")
+        return {"status": "failed", "runId": run_id}
 
-    # --- качаем картинки ---------------------------------------------------------------
-    images_dir = run_dir / "images"
-    background.add_task(download_photos, items, images_dir)
+    # датасет, картинки и книга собираются в очереди (см. pipeline.SCRAPE_STAGES)
+    # повторная доставка webhook не создает вторую задачу
+    job_id = job_queue.enqueue("scrape", {"run_id": run_id, "dataset_id": payload.get("datasetId")}, dedup=True)
 
-    # --- строим романтическую книгу (markdown + html) ---------------------------------
-    async def _build():
-        import asyncio
-        from app.services.image_processor import process_folder
-        from app.services.text_collector import collect_texts
-        from app.services.book_builder import build_romantic_book
+    return {"status": "processing", "runId": run_id, "jobId": job_id, "message": "Создание романтической книги началось! 💕"}
 
-        # Ждем несколько секунд для завершения загрузки изображений
-        print("💕 Ожидаем завершения загрузки изображений...")
-        await asyncio.sleep(5)
-        
-        # Проверяем загрузку изображений несколько раз
-        for attempt in range(10):
-            if images_dir.exists() and any(images_dir.glob("*")):
-                print(f"📸 Найдены изображения в папке {images_dir}")
-                break
-            print(f"⏳ Попытка {attempt + 1}/10: ждем загрузки изображений...")
-            await asyncio.sleep(2)
 
-        imgs      = await process_folder(images_dir)
-        comments  = collect_texts(run_dir / "posts.json")
-        build_romantic_book(run_id, imgs, comments)
+# ───────────── /jobs/{job_id} ──────────────────────────────
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Задача не найдена")
+    return job
 
-    background.add_task(lambda: anyio.run(_build))
 
-    return {"status": "processing", "runId": run_id, "message": "Создание романтической книги началось! 💕"}
+# ───────────── /runs ───────────────────────────────────────
+@app.get("/runs")
+def list_runs(username: str | None = None, before: float | None = None, limit: int = 50):
+    """Прогоны из реестра, от новых к старым; before — createdAt последнего на прошлой странице"""
+    return {"runs": registry.list_runs(username, before, max(1, min(limit, 200)))}
 
 
 # ───────────── /status/{run_id} ────────────────────────────
 @app.get("/status/{run_id}")
 def status(run_id: str):
+    if not registry.is_run_id(run_id):
+        raise HTTPException(404, "Прогон не найден")
     run_dir = Path("data") / run_id
-    posts_json = run_dir / "posts.json"
-    images_dir = run_dir / "images"
-    pdf_file = run_dir / "book.pdf"
-    html_file = run_dir / "book.html"
-    
-    # Проверяем этапы создания
-    status_info = {
-        "runId": run_id,
-        "stages": {
-            "data_collected": posts_json.exists(),
-            "images_downloaded": images_dir.exists() and any(images_dir.glob("*")),
-            "book_generated": pdf_file.exists()
-        },
-        "files": {}
-    }
     
-    # Добавляем информацию о файлах
-    if pdf_file.exists():
-        status_info["files"]["pdf"] = f"/download/{run_id}/book.pdf"
-    if html_file.exists():
-        status_info["files"]["html"] = f"/view/{run_id}/book.html"
-    
-    # Добавляем информацию о профиле если есть
-    if posts_json.exists():
-        try:
-            posts_data = json.loads(posts_json.read_text(encoding="utf-8"))
-            if posts_data:
-                profile = posts_data[0]
-                status_info["profile"] = {
-                    "username": profile.get("username"),
-                    "fullName": profile.get("fullName"),
-                    "followers": profile.get("followersCount"),
-                    "posts": len(profile.get("latestPosts", []))
-                }
-        except:
-            pass
+    # status.json пишет пайплайн на каждом этапе; читаем его из памяти, пока он не изменился
+    status_info = run_status.read(run_dir)
+    if status_info is None:
+        if not run_dir.is_dir() or not run_status.looks_like_run(run_dir):
+            return {
+                "runId": run_id,
+                "stages": {"data_collected": False, "images_downloaded": False, "book_generated": False},
+                "files": {}
+            }
+        # прогон собран до появления status.json — строим его один раз по файлам
+        status_info = run_status.rebuild(run_dir)
     
     return status_info
 
 
+# ───────────── /events/{run_id} ────────────────────────────
+@app.get("/events/{run_id}")
+async def events(run_id: str, request: Request):
+    """Прогресс прогона потоком Server-Sent Events: status, download, cards, book, failed."""
+    snapshot = run_status.read(Path("data") / run_id)
+    return StreamingResponse(
+        progress.stream(run_id, request.headers.get("last-event-id"), snapshot),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # ───────────── /download/{run_id}/{filename} ─────────────
 @app.get("/download/{run_id}/{filename}")
-def download_file(run_id: str, filename: str):
+def download_file(run_id: str, filename: str, request: Request):
     """Скачивание готовых файлов (PDF, HTML)"""
     run_dir = Path("data") / run_id
     file_path = run_dir / filename
     
-    if not file_path.exists():
+    if not file_path.is_file():
         raise HTTPException(404, f"Файл {filename} не найден")
     
-    # Определяем MIME тип
-    media_type = "application/pdf" if filename.endswith(".pdf") else "text/html"
+    # Определяем MIME тип; PDF уже сжат — отдаем как есть, с поддержкой Range
+    is_pdf = filename.endswith(".pdf")
+    media_type = "application/pdf" if is_pdf else "text/html"
     
-    return FileResponse(
-        path=file_path,
-        media_type=media_type,
-        filename=filename
-    )
+    return delivery.file_response(request, file_path, media_type, compressible=not is_pdf, filename=filename)
 
 
 # ───────────── /view/{run_id}/book.html ─────────────────
 @app.get("/view/{run_id}/book.html")
-def view_book_html(run_id: str):
+def view_book_html(run_id: str, request: Request):
     """Просмотр HTML версии книги в браузере"""
     run_dir = Path("data") / run_id
     html_file = run_dir / "book.html"
@@ -176,8 +214,46 @@ def view_book_html(run_id: str):
     if not html_file.exists():
         raise HTTPException(404, "HTML версия книги не найдена")
     
-    html_content = html_file.read_text(encoding="utf-8")
-    return HTMLResponse(content=html_content)
+    # отдаем файл потоком (сжатую копию, если есть); повторный просмотр — 304
+    return delivery.file_response(request, html_file, "text/html; charset=utf-8",
+                                  headers={"Cache-Control": "no-cache"})
+
+
+# ───────────── /view/{run_id}/derived/{name} ───────────
+@app.get("/view/{run_id}/derived/{name}")
+def view_book_image(run_id: str, name: str):
+    """Фото книги; имя содержит хэш содержимого, поэтому кэшируем навсегда"""
+    image_file = Path("data") / run_id / derivatives.DERIVED_DIR / name
+    if Path(name).name != name or not image_file.is_file():
+        raise HTTPException(404, "Изображение не найдено")
+    return FileResponse(
+        path=image_file,
+        media_type="image/jpeg",
+        headers={"Cache-Control": "public, max-age=31536000, immutable"},
+    )
+
+
+# ───────────── /view/{run_id}/assets/{name} ────────────
+@app.get("/view/{run_id}/assets/{name}")
+def view_book_stylesheet(run_id: str, name: str):
+    """CSS макета книги; имя содержит хэш содержимого, поэтому кэшируем навсегда"""
+    css_file = Path("data") / run_id / templates.ASSETS_DIR / name
+    if Path(name).name != name or not css_file.is_file():
+        raise HTTPException(404, "Файл стилей не найден")
+    return FileResponse(
+        path=css_file,
+        media_type="text/css",
+        headers={"Cache-Control": "public, max-age=31536000, immutable"},
+    )
+
+
+# ───────────── /export/{run_id}/book.html ───────────────
+@app.get("/export/{run_id}/book.html")
+def export_book_html(run_id: str, request: Request):
+    """Книга одним файлом со встроенными фото — для чтения офлайн"""
+    if not (Path("data") / run_id / "book.html").exists():
+        raise HTTPException(404, "HTML версия книги не найдена")
+    return delivery.file_response(request, export_single_file(run_id), "text/html", filename="book.html")
 
 
 # ───────────── / (главная страница) ─────────────────────
@@ -659,82 +735,103 @@ def status_page(runId: str):
         const resultContainer = document.getElementById('resultContainer');
         const downloadButtons = document.getElementById('downloadButtons');
         
-        const stages = [
-            {{ text: 'Собираем фотографии...', progress: 20 }},
-            {{ text: 'Обрабатываем изображения...', progress: 40 }},
-            {{ text: 'Создаем романтические тексты...', progress: 60 }},
-            {{ text: 'Оформляем книгу...', progress: 80 }},
-            {{ text: 'Финальные штрихи...', progress: 95 }}
-        ];
-        
-        let currentStage = 0;
-        
-        function updateProgress() {{
-            if (currentStage < stages.length) {{
-                const stage = stages[currentStage];
-                progressFill.style.width = stage.progress + '%';
-                progressText.textContent = stage.text;
-                currentStage++;
-                setTimeout(updateProgress, 2000);
+        let finished = false;
+        
+        function setProgress(percent, text) {{
+            progressFill.style.width = percent + '%';
+            progressText.textContent = text;
+        }}
+        
+        function showStatus(status) {{
+            const stages = status.stages || {{}};
+            if (stages.book_generated) {{
+                showResult(status.files || {{}});
+            }} else if (stages.images_downloaded) {{
+                setProgress(50, 'Создаем романтические тексты...');
+            }} else if (stages.data_collected) {{
+                setProgress(20, 'Собираем фотографии...');
             }}
         }}
         
-        async function checkStatus() {{
-            try {{
-                const response = await fetch(`/status/${{runId}}`);
-                const status = await response.json();
+        function showResult(files) {{
+            if (finished) return;
+            finished = true;
+            if (source) source.close();
+            setProgress(100, 'Готово! ✨');
+            
+            setTimeout(() => {{
+                document.querySelector('.progress-container').style.display = 'none';
+                document.querySelector('.heart-loading').style.display = 'none';
+                document.querySelector('.status-message').textContent = 'Романтическая книга создана с любовью! 💝';
+                resultContainer.style.display = 'block';
                 
-                if (status.stages.book_generated) {{
-                    progressFill.style.width = '100%';
-                    progressText.textContent = 'Готово! ✨';
-                    
-                    setTimeout(() => {{
-                        document.querySelector('.progress-container').style.display = 'none';
-                        document.querySelector('.heart-loading').style.display = 'none';
-                        document.querySelector('.status-message').textContent = 'Романтическая книга создана с любовью! 💝';
-                        resultContainer.style.display = 'block';
-                        
-                        if (status.files.html) {{
-                            const viewBtn = document.createElement('a');
-                            viewBtn.href = status.files.html;
-                            viewBtn.className = 'download-btn btn-view';
-                            viewBtn.textContent = 'Просмотреть книгу 👀';
-                            viewBtn.target = '_blank';
-                            downloadButtons.appendChild(viewBtn);
-                        }}
-                        
-                        if (status.files.pdf) {{
-                            const downloadBtn = document.createElement('a');
-                            downloadBtn.href = status.files.pdf;
-                            downloadBtn.className = 'download-btn btn-download';
-                            downloadBtn.textContent = 'Скачать PDF 💕';
-                            downloadBtn.download = 'romantic_book.pdf';
-                            downloadButtons.appendChild(downloadBtn);
-                        }}
-                    }}, 1000);
-                }} else {{
-                    setTimeout(checkStatus, 3000);
+                if (files.html) {{
+                    const viewBtn = document.createElement('a');
+                    viewBtn.href = files.html;
+                    viewBtn.className = 'download-btn btn-view';
+                    viewBtn.textContent = 'Просмотреть книгу 👀';
+                    viewBtn.target = '_blank';
+                    downloadButtons.appendChild(viewBtn);
                 }}
-            }} catch (error) {{
-                setTimeout(checkStatus, 5000);
-            }}
+                
+                if (files.pdf) {{
+                    const downloadBtn = document.createElement('a');
+                    downloadBtn.href = files.pdf;
+                    downloadBtn.className = 'download-btn btn-download';
+                    downloadBtn.textContent = 'Скачать PDF 💕';
+                    downloadBtn.download = 'romantic_book.pdf';
+                    downloadButtons.appendChild(downloadBtn);
+                }}
+            }}, 1000);
         }}
         
-        // Запускаем обновление прогресса и проверку статуса
-        updateProgress();
-        setTimeout(checkStatus, 5000);
+        function showError(error) {{
+            finished = true;
+            if (source) source.close();
+            document.querySelector('.heart-loading').style.display = 'none';
+            progressText.textContent = 'Не получилось создать книгу 💔 ' + (error || '');
+        }}
+        
+        // Прогресс приходит событиями с сервера (/events), без опроса /status.
+        // EventSource сам переподключается и присылает Last-Event-ID — пропущенное досылается.
+        let source = null;
+        if (window.EventSource) {{
+            source = new EventSource(`/events/${{runId}}`);
+            source.addEventListener('status', (e) => showStatus(JSON.parse(e.data)));
+            source.addEventListener('download', (e) => {{
+                const p = JSON.parse(e.data);
+                setProgress(20 + Math.round(30 * p.done / p.total), `Собираем фотографии... ${{p.done}} из ${{p.total}}`);
+            }});
+            source.addEventListener('cards', (e) => {{
+                const p = JSON.parse(e.data);
+                setProgress(50 + Math.round(40 * p.done / p.total), `Пишем истории к кадрам... ${{p.done}} из ${{p.total}}`);
+            }});
+            source.addEventListener('book', (e) => showResult(JSON.parse(e.data).files));
+            source.addEventListener('failed', (e) => showError(JSON.parse(e.data).error));
+        }} else {{
+            // старые браузеры — опрашиваем /status
+            async function checkStatus() {{
+                try {{
+                    const response = await fetch(`/status/${{runId}}`);
+                    showStatus(await response.json());
+                }} catch (error) {{}}
+                if (!finished) setTimeout(checkStatus, 3000);
+            }}
+            checkStatus();
+        }}
     </script>
 </body>
 </html>
     """)
 
 @app.post("/create-book")
-async def create_book(request: Request, background: BackgroundTasks):
+async def create_book(request: Request):
     """Создает романтическую книгу на основе данных профиля"""
     try:
         body = await request.json()
         run_id = body.get("runId")
         book_format = body.get("format", "classic")  # "classic" или "zine"
+        embed_images = body.get("embedImages")      # True — книга одним файлом
         
         if not run_id:
             raise HTTPException(400, "runId обязателен")
@@ -746,21 +843,10 @@ async def create_book(request: Request, background: BackgroundTasks):
     except Exception as e:
         raise HTTPException(400, f"Ошибка в параметрах запроса: {e}")
 
-    async def _build():
-        # Ждем завершения загрузки изображений
-        images_dir = run_dir / "images"
-        for attempt in range(10):  # Максимум 20 секунд ожидания
-            if images_dir.exists() and any(images_dir.glob("*")):
-                print(f"📸 Найдены изображения в папке {images_dir}")
-                break
-            print(f"⏳ Попытка {attempt + 1}/10: ждем загрузки изображений...")
-            await asyncio.sleep(2)
-
-        imgs      = await process_folder(images_dir)
-        comments  = collect_texts(run_dir / "posts.json")
-        build_romantic_book(run_id, imgs, comments, book_format)
-
-    background.add_task(lambda: anyio.run(_build))
+    job_id = job_queue.enqueue("book", {"run_id": run_id, "format": book_format, "embed_images": embed_images},
+                               dedup=True)
+    # прежняя книга (например, в другом формате) — не готовность новой: /status и /events ждут сборку
+    await asyncio.to_thread(run_status.update, run_dir, stages={"book_generated": False}, error=None)
 
     format_name = "классическую книгу" if book_format == "classic" else "мозаичный зин"
-    return {"status": "processing", "runId": run_id, "format": book_format, "message": f"Создание {format_name} началось! 💕"}
+    return {"status": "processing", "runId": run_id, "jobId": job_id, "format": book_format, "message": f"Создание {format_name} началось! 💕"}
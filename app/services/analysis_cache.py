@@ -0,0 +1,88 @@
+import hashlib, json, logging, threading, time
+from pathlib import Path
+from typing import Optional
+
+from app.config import settings
+from app.services.db import connect
+
+log = logging.getLogger("analysis_cache")
+
+DB_PATH = Path("data") / "cache" / "analysis.sqlite3"
+PRUNE_EVERY = 50          # чистим устаревшие записи раз в N вставок
+
+_conn = None
+_lock = threading.Lock()
+_puts = 0
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = connect(DB_PATH)
+        _conn.execute(
+            """CREATE TABLE IF NOT EXISTS cards (
+                   key         TEXT PRIMARY KEY,
+                   content     TEXT NOT NULL,
+                   created_at  REAL NOT NULL,
+                   accessed_at REAL NOT NULL
+               )"""
+        )
+        _conn.execute("CREATE INDEX IF NOT EXISTS cards_accessed ON cards(accessed_at)")
+        _prune(_conn)
+    return _conn
+
+
+def _prune(conn):
+    """TTL + LRU: удаляем просроченные и самые давно прочитанные записи."""
+    expired_before = time.time() - settings.ANALYSIS_CACHE_TTL_DAYS * 86400
+    conn.execute("DELETE FROM cards WHERE created_at < ?", (expired_before,))
+    conn.execute(
+        """DELETE FROM cards WHERE key IN (
+               SELECT key FROM cards ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+           )""",
+        (settings.ANALYSIS_CACHE_MAX_ENTRIES,),
+    )
+
+
+def key_for(image_bytes: bytes, card_type: str, context: str, model: str) -> str:
+    """Ключ карточки: хэш содержимого фото + тип карточки + контекст + модель."""
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    raw = json.dumps([image_hash, card_type, context, model], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def get(key: str) -> Optional[str]:
+    """Возвращает закэшированную карточку или None."""
+    try:
+        with _lock:
+            conn = _db()
+            row = conn.execute("SELECT content, created_at FROM cards WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if row["created_at"] < now - settings.ANALYSIS_CACHE_TTL_DAYS * 86400:
+                conn.execute("DELETE FROM cards WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE cards SET accessed_at = ? WHERE key = ?", (now, key))
+            return row["content"]
+    except Exception as e:
+        log.warning("analysis cache read failed: %s", e)
+        return None
+
+
+def put(key: str, content: str):
+    """Сохраняет карточку в кэш."""
+    global _puts
+    try:
+        with _lock:
+            conn = _db()
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO cards (key, content, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, content, now, now),
+            )
+            _puts += 1
+            if _puts % PRUNE_EVERY == 0:
+                _prune(conn)
+    except Exception as e:
+        log.warning("analysis cache write failed: %s", e)
@@ -1,11 +1,13 @@
 from __future__ import annotations
 import anyio, logging
-from apify_client import ApifyClient
+from typing import AsyncIterator
+from apify_client import ApifyClientAsync
 from apify_client._errors import ApifyApiError
 from app.config import settings
 
 log = logging.getLogger("apify")
-_client = ApifyClient(settings.APIFY_TOKEN)
+# нативный async-клиент: запросы идут на event loop, потоки не занимаются
+_client = ApifyClientAsync(settings.APIFY_TOKEN)
 
 
 # helper: camelCase → snake_case
@@ -24,28 +26,23 @@ def _normalize_webhooks(webhooks: list[dict]) -> list[dict]:
 
 
 async def run_actor(run_input: dict, webhooks: list[dict] | None = None) -> dict:
-    """Запускаем Actor без блокировки event-loop."""
-    def _sync():
-        act = _client.actor(settings.ACTOR_ID)
-        return act.call(
-            run_input=run_input,
-            webhooks=_normalize_webhooks(webhooks) if webhooks else None,
-        )
-    return await anyio.to_thread.run_sync(_sync)
+    """Запускаем Actor и сразу возвращаем Run — о завершении сообщит webhook."""
+    return await _client.actor(settings.ACTOR_ID).start(
+        run_input=run_input,
+        webhooks=_normalize_webhooks(webhooks) if webhooks else None,
+    )
 
 
 async def fetch_run(run_id: str) -> dict:
-    """Получаем объект Run по runId (блокирующий SDK в пуле потоков)."""
-    return await anyio.to_thread.run_sync(lambda: _client.run(run_id).get())
+    """Получаем объект Run по runId."""
+    return await _client.run(run_id).get()
 
 
-async def fetch_items(dataset_id: str, retries: int = 10, delay: float = 2.0) -> list[dict]:
-    """Скачиваем все items; повторяем, пока датасет не станет доступен."""
+async def _list_page(dataset_id: str, offset: int, limit: int, retries: int, delay: float):
+    """Одна страница датасета; повторяем, пока датасет не станет доступен."""
     for attempt in range(1, retries + 1):
         try:
-            return await anyio.to_thread.run_sync(
-                lambda: _client.dataset(dataset_id).list_items().items
-            )
+            return await _client.dataset(dataset_id).list_items(offset=offset, limit=limit)
         except ApifyApiError as err:
             if getattr(err, "status_code", None) != 404:
                 log.error("Apify error: %s", err)
@@ -55,4 +52,27 @@ async def fetch_items(dataset_id: str, retries: int = 10, delay: float = 2.0) ->
             await anyio.sleep(delay)
             delay *= 1.5
     log.error("Dataset %s not found after %s retries", dataset_id, retries)
-    return []
+    return None
+
+
+async def iter_items(dataset_id: str, page_size: int | None = None,
+                     retries: int = 10, delay: float = 2.0) -> AsyncIterator[list[dict]]:
+    """Отдаем датасет страницами по offset/limit — в памяти только текущая страница."""
+    limit = page_size or settings.APIFY_PAGE_SIZE
+    offset = 0
+    while True:
+        page = await _list_page(dataset_id, offset, limit, retries, delay)
+        if page is None or not page.items:
+            return
+        yield page.items
+        offset += len(page.items)
+        if offset >= page.total or len(page.items) < limit:
+            return
+
+
+async def fetch_items(dataset_id: str, retries: int = 10, delay: float = 2.0) -> list[dict]:
+    """Скачиваем все items одним списком."""
+    items = []
+    async for page in iter_items(dataset_id, retries=retries, delay=delay):
+        items.extend(page)
+    return items
@@ -0,0 +1,120 @@
+import hashlib, logging, os, shutil, threading, time
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from app.services.db import connect
+
+log = logging.getLogger("blobs")
+
+BLOBS_DIR = Path("data") / "blobs"
+DB_PATH = BLOBS_DIR / "index.sqlite3"
+CHUNK_SIZE = 64 * 1024
+
+_conn = None
+_lock = threading.Lock()
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = connect(DB_PATH)
+        # ключ (пост или ссылка без подписи) → блоб; один блоб — много ключей
+        _conn.execute(
+            """CREATE TABLE IF NOT EXISTS blob_keys (
+                   key        TEXT PRIMARY KEY,
+                   sha256     TEXT NOT NULL,
+                   ext        TEXT NOT NULL,
+                   created_at REAL NOT NULL
+               )"""
+        )
+    return _conn
+
+
+def keys_for(post_key: str, url: str) -> List[str]:
+    """Ключи фото: пост (shortCode/id стабильны) и ссылка CDN без query — подпись в ней меняется."""
+    keys = [] if post_key.startswith("#") else [f"post:{post_key}"]
+    parts = urlsplit(url)
+    keys.append(f"url:{parts.netloc}{parts.path}")
+    return keys
+
+
+def path_for(sha256: str, ext: str) -> Path:
+    """data/blobs/ab/abcdef….jpg"""
+    return BLOBS_DIR / sha256[:2] / f"{sha256}{ext}"
+
+
+def find(keys: Iterable[str]) -> Optional[Path]:
+    """Блоб по любому из ключей, если он есть на диске."""
+    keys = list(keys)
+    if not keys:
+        return None
+    try:
+        with _lock:
+            marks = ",".join("?" * len(keys))
+            rows = _db().execute(f"SELECT sha256, ext FROM blob_keys WHERE key IN ({marks})", keys).fetchall()
+    except Exception as e:
+        log.warning("blob index read failed: %s", e)
+        return None
+    for row in rows:
+        blob = path_for(row["sha256"], row["ext"])
+        if blob.exists():
+            return blob
+    return None
+
+
+def link(blob: Path, target: Path):
+    """Кладет блоб в папку прогона жесткой ссылкой (копией — если ссылки не поддерживаются)."""
+    tmp = target.with_name(f".{target.name}.part")
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(blob, tmp)
+    except OSError:
+        shutil.copy2(blob, tmp)
+    os.replace(tmp, target)
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def adopt(path: Path, keys: Iterable[str]) -> Path:
+    """Переносит скачанный файл в хранилище и оставляет в прогоне ссылку на блоб.
+
+    Если такой же контент уже есть, файл прогона заменяется ссылкой на него —
+    на диске остается одна копия.
+    """
+    sha256 = _sha256(path)
+    blob = path_for(sha256, path.suffix)
+    blob.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(path, blob)
+    except FileExistsError:
+        if not os.path.samefile(path, blob):
+            link(blob, path)
+    except OSError:
+        if not blob.exists():
+            shutil.copy2(path, blob)
+    now = time.time()
+    with _lock:
+        _db().executemany(
+            "INSERT OR REPLACE INTO blob_keys (key, sha256, ext, created_at) VALUES (?, ?, ?, ?)",
+            [(key, sha256, path.suffix, now) for key in keys],
+        )
+    return blob
+
+
+def adopt_all(files: Iterable[Tuple[Path, List[str]]]) -> int:
+    """adopt для пачки скачанных файлов; ошибки хранилища загрузку не ломают."""
+    adopted = 0
+    for path, keys in files:
+        try:
+            adopt(path, keys)
+            adopted += 1
+        except Exception as e:
+            log.warning("cannot store %s as blob: %s", path, e)
+    return adopted
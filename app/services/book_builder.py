@@ -1,8 +1,15 @@
-import json
+import os
+import time
+import uuid
+import asyncio
 import base64
+import zlib
 from io import BytesIO
 from pathlib import Path
-from PIL import Image, ImageFilter, ImageEnhance, ImageDraw, ImageFont
+from PIL import Image, ImageFilter, ImageDraw, ImageFont
+from app.config import settings
+from app.services import cards, delivery, derivatives, posts, progress, run_status, templates
+from app.services.derivatives import get_derivative, image_src, inline_images, to_data_uri
 from app.services.llm_client import generate_text, analyze_photo, analyze_photo_for_card, generate_scene_chapter, strip_cliches, generate_unique_chapter
 import markdown
 import pdfkit
@@ -10,9 +17,14 @@ import qrcode
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
-from typing import List, Tuple
+from typing import Iterable, Iterator, List, Tuple
 import random
 
+# Производные фото для каждого макета: (размер, стиль, качество JPEG)
+CLASSIC_IMAGE_SPEC = ((800, 600), "classic", 88)
+ZINE_IMAGE_SPEC = ((300, 300), "zine", 85)
+LITERARY_IMAGE_SPEC = ((700, 500), "literary", 92)
+
 def analyze_profile_data(posts_data: list) -> dict:
     """Анализирует данные профиля для создания контекста книги"""
     if not posts_data:
@@ -206,26 +218,31 @@ def create_markdown_from_content(content: dict, analysis: dict, images: list[Pat
     
     return markdown_content
 
-def build_romantic_book(run_id: str, images: list[Path], texts: str, book_format: str = "classic"):
-    """Создание HTML книги (с выбором формата: classic или zine)"""
+async def build_romantic_book(run_id: str, images: list[Path], texts: str, book_format: str = "classic",
+                              embed_images: bool = None):
+    """Создание HTML книги (с выбором формата: classic или zine).
+
+    По умолчанию фото (derived/) и CSS (assets/) лежат рядом и подключаются ссылками;
+    embed_images=True собирает книгу одним файлом с data URI и <style>.
+    """
+    if embed_images is None:
+        embed_images = settings.BOOK_EMBED_IMAGES
+    started = time.monotonic()
     try:
         # Загружаем данные профиля
         run_dir = Path("data") / run_id
-        posts_json = run_dir / "posts.json"
         images_dir = run_dir / "images"
         
-        if posts_json.exists():
-            posts_data = json.loads(posts_json.read_text(encoding="utf-8"))
-        else:
-            posts_data = []
+        # для анализа нужен только первый элемент датасета — профиль
+        profile = posts.first(run_dir)
+        posts_data = [profile] if profile else []
         
-        # Ждем загрузки изображений и собираем их
+        # Берем переданные изображения (по манифесту загрузки), иначе — всю папку
         actual_images = []
-        if images_dir.exists():
-            # Собираем все изображения из папки
-            for img_file in sorted(images_dir.glob("*")):
-                if img_file.suffix.lower() in ['.jpg', '.jpeg', '.png', '.webp']:
-                    actual_images.append(img_file)
+        candidates = images or (sorted(images_dir.glob("*")) if images_dir.exists() else [])
+        for img_file in candidates:
+            if img_file.suffix.lower() in ['.jpg', '.jpeg', '.png', '.webp']:
+                actual_images.append(img_file)
         
         print(f"💕 Создаем {book_format} книгу для профиля")
         print(f"📸 Найдено {len(actual_images)} фотографий в {images_dir}")
@@ -233,27 +250,47 @@ def build_romantic_book(run_id: str, images: list[Path], texts: str, book_format
         # Анализируем профиль
         analysis = analyze_profile_data(posts_data)
         
+        # Заранее считаем производные фото в пуле процессов — сборщик HTML их только читает
+        if book_format == "zine":
+            await derivatives.prepare(actual_images[:15], *ZINE_IMAGE_SPEC)
+        else:
+            await derivatives.prepare(actual_images[:5], *LITERARY_IMAGE_SPEC)
+        
         # Генерируем контент в зависимости от формата
         if book_format == "zine":
             # Мозаичный зин - короткий контент
-            content = generate_zine_content(analysis, actual_images)
-            html = create_zine_html(content, analysis, actual_images)
+            content = await generate_zine_content(
+                analysis, actual_images,
+                on_progress=lambda done, total: progress.publish(run_id, "cards", {"done": done, "total": total}))
+            chunks = create_zine_html(content, analysis, actual_images, embed_images)
         else:
             # Литературная Instagram-книга от первого лица
             content = {"format": "literary"}  # Передаем минимум данных
-            html = create_literary_instagram_book_html(content, analysis, actual_images)
+            chunks = create_literary_instagram_book_html(content, analysis, actual_images, embed_images)
         
         # Сохраняем только HTML файл
         out = Path("data") / run_id
         out.mkdir(parents=True, exist_ok=True)
         
-        # Сохраняем HTML файл
-        html_file = out / "book.html"
-        html_file.write_text(html, encoding="utf-8")
+        # Стили макетов — рядом с книгой, если она их подключает ссылкой
+        if not embed_images:
+            templates.publish_assets(out)
+        
+        # Рендерим прямо в файл кусками — книга целиком в памяти не собирается
+        # (рендер и Pillow блокируют — уводим их с event loop в поток)
+        await asyncio.to_thread(write_book, out / "book.html", chunks)
+        # сжатые копии для /view и /download
+        await asyncio.to_thread(delivery.precompress, out / "book.html")
         
         print(f"✅ {book_format.title()} книга создана!")
         print(f"📖 HTML версия: {out / 'book.html'}")
         
+        # Отмечаем книгу в status.json — /status читает только его
+        files = run_status.book_files(run_id, out)
+        run_status.update(out, stages={"book_generated": True}, files=files, error=None,
+                          timings={"build": round(time.monotonic() - started, 2)})
+        progress.publish(run_id, "book", {"files": files})
+        
     except Exception as e:
         print(f"❌ Ошибка при создании книги: {e}")
         # Создаем базовую версию при ошибке
@@ -286,9 +323,81 @@ def build_romantic_book(run_id: str, images: list[Path], texts: str, book_format
             
         except Exception as final_error:
             print(f"❌ Критическая ошибка: {final_error}")
-
-def apply_dream_pastel_effect(img: Image.Image) -> Image.Image:
-    """Применяет эффект Dream-Pastel к изображению"""
+        
+        # страница с ошибкой — не книга: этап не отмечаем, даже если book.html есть
+        run_status.update(Path("data") / run_id, stages={"book_generated": False}, error=f"build: {e}")
+        # ошибку отдаем очереди: она повторит этап, а после последней попытки отправит failed
+        raise
+
+def write_book(path: Path, chunks: Iterable[str]):
+    """Пишет книгу по кускам во временный файл и атомарно подменяет path."""
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+def export_single_file(run_id: str) -> Path:
+    """Версия книги одним файлом (фото и стили внутри) для скачивания и чтения офлайн."""
+    run_dir = Path("data") / run_id
+    html_file = run_dir / "book.html"
+    offline_file = run_dir / "book.offline.html"
+    if not offline_file.exists() or offline_file.stat().st_mtime < html_file.stat().st_mtime:
+        # построчно: ссылки на фото и стили в шаблонах не переносятся между строками
+        with open(html_file, encoding="utf-8") as f:
+            write_book(offline_file, (templates.inline_stylesheets(inline_images(line, run_dir), run_dir) for line in f))
+        delivery.precompress(offline_file)
+    return offline_file
+
+# Dream-Pastel: константы для расчета в одном проходе по массиву
+PASTEL_BLUR = 1.2
+PASTEL_SATURATION = 1.15
+PASTEL_OVERLAY = np.array([255, 220, 210], dtype=np.float32)  # peach #ffdcd2
+PASTEL_OVERLAY_ALPHA = 25 / 255
+PASTEL_GRAIN = 15                                              # зерно 0..14
+PASTEL_BRIGHTNESS = 1.05
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)      # как в Image.convert('L')
+
+# Банк текстур зерна: создается один раз на процесс, дальше только раскладывается по кадру
+GRAIN_TILE = 256
+GRAIN_TILES = 8
+GRAIN_BANK_SEED = 1207
+_grain_bank = None
+
+def grain_bank() -> np.ndarray:
+    """GRAIN_TILES тайлов (GRAIN_TILE, GRAIN_TILE, 3) float32, уже умноженных на яркость"""
+    global _grain_bank
+    if _grain_bank is None:
+        rng = np.random.default_rng(GRAIN_BANK_SEED)
+        bank = rng.integers(0, PASTEL_GRAIN, (GRAIN_TILES, GRAIN_TILE, GRAIN_TILE, 3), dtype=np.uint8)
+        _grain_bank = bank.astype(np.float32) * np.float32(PASTEL_BRIGHTNESS)
+    return _grain_bank
+
+def add_grain(arr: np.ndarray, seed=None):
+    """Прибавляет зерно к float32-массиву (h, w, 3) на месте.
+
+    Кадр покрывается тайлами из банка; какой тайл куда ляжет, решает seed —
+    один и тот же seed (например, run_id) всегда дает одно и то же зерно.
+    """
+    bank = grain_bank()
+    h, w = arr.shape[:2]
+    rows, cols = -(-h // GRAIN_TILE), -(-w // GRAIN_TILE)
+    rng = np.random.default_rng(None if seed is None else zlib.crc32(str(seed).encode()))
+    picks = rng.integers(0, GRAIN_TILES, (rows, cols))
+    for r in range(rows):
+        for c in range(cols):
+            block = arr[r * GRAIN_TILE:(r + 1) * GRAIN_TILE, c * GRAIN_TILE:(c + 1) * GRAIN_TILE]
+            block += bank[picks[r, c], :block.shape[0], :block.shape[1]]
+
+def apply_dream_pastel_effect(img: Image.Image, seed=None) -> Image.Image:
+    """Применяет эффект Dream-Pastel к изображению.
+
+    Размытие делает Pillow, а насыщенность, персиковый overlay, зерно и яркость
+    считаются одним проходом по float32-массиву. seed фиксирует зерно.
+    """
     try:
         # Проверяем, что изображение валидное
         if img is None or img.size[0] == 0 or img.size[1] == 0:
@@ -300,32 +409,23 @@ def apply_dream_pastel_effect(img: Image.Image) -> Image.Image:
             img = img.convert('RGB')
         
         # Лёгкое размытие
-        img = img.filter(ImageFilter.GaussianBlur(1.2))
+        arr = np.asarray(img.filter(ImageFilter.GaussianBlur(PASTEL_BLUR)), dtype=np.float32)
         
-        # Цветовая коррекция в теплые тона
-        enhancer = ImageEnhance.Color(img)
-        img = enhancer.enhance(1.15)
-        
-        # Создаем теплый overlay
-        overlay = Image.new('RGBA', img.size, (255, 220, 210, 25))  # peach #ffdcd2
-        img = img.convert('RGBA')
-        img = Image.alpha_composite(img, overlay)
-        
-        # Добавляем grain (безопасно)
-        try:
-            noise = np.random.randint(0, 15, (img.size[1], img.size[0], 3), dtype=np.uint8)
-            noise_img = Image.fromarray(noise, 'RGB').convert('RGBA')
-            noise_overlay = Image.new('RGBA', img.size, (0, 0, 0, 0))
-            noise_overlay.paste(noise_img, (0, 0))
-            img = Image.alpha_composite(img, noise_overlay)
-        except Exception as noise_error:
-            print(f"❌ Ошибка при добавлении шума: {noise_error}")
+        # Насыщенность (как ImageEnhance.Color): gray + k·(rgb − gray)
+        gray = (arr @ _LUMA)[..., None]
+        arr -= gray
+        arr *= PASTEL_SATURATION
+        arr += gray
+        np.clip(arr, 0, 255, out=arr)
         
-        # Легкое увеличение яркости
-        enhancer = ImageEnhance.Brightness(img)
-        img = enhancer.enhance(1.05)
+        # Теплый overlay и яркость в одном умножении-сложении:
+        # (rgb·(1−a) + peach·a + grain)·b
+        arr *= (1 - PASTEL_OVERLAY_ALPHA) * PASTEL_BRIGHTNESS
+        arr += PASTEL_OVERLAY * (PASTEL_OVERLAY_ALPHA * PASTEL_BRIGHTNESS)
+        add_grain(arr, seed)
         
-        return img.convert('RGB')
+        np.clip(arr, 0, 255, out=arr)
+        return Image.fromarray(arr.astype(np.uint8), 'RGB')
     except Exception as e:
         print(f"❌ Ошибка при применении Dream-Pastel эффекта: {e}")
         # Возвращаем оригинальное изображение при ошибке
@@ -336,7 +436,7 @@ def apply_dream_pastel_effect(img: Image.Image) -> Image.Image:
             placeholder = Image.new('RGB', (400, 300), (240, 240, 240))
             return placeholder
 
-def create_collage_spread(img1: Image.Image, img2: Image.Image, caption: str) -> str:
+def create_collage_spread(img1: Image.Image, img2: Image.Image, caption: str, seed=None) -> str:
     """Создает коллаж-разворот из двух фотографий"""
     try:
         # Проверяем валидность изображений
@@ -366,8 +466,8 @@ def create_collage_spread(img1: Image.Image, img2: Image.Image, caption: str) ->
             return ""
         
         # Применяем dream-pastel эффект
-        img1 = apply_dream_pastel_effect(img1)
-        img2 = apply_dream_pastel_effect(img2)
+        img1 = apply_dream_pastel_effect(img1, None if seed is None else f"{seed}/1")
+        img2 = apply_dream_pastel_effect(img2, None if seed is None else f"{seed}/2")
         
         # Размещаем изображения с небольшим поворотом
         try:
@@ -556,8 +656,8 @@ def add_english_voiceover(text: str) -> str:
         return f"{text} <em class='voiceover'>{phrase}</em>"
     return text
 
-def generate_zine_content(analysis: dict, images: list[Path]) -> dict:
-    """Генерирует короткий контент для мозаичного зина"""
+async def generate_zine_content(analysis: dict, images: list[Path], on_progress=None) -> dict:
+    """Генерирует короткий контент для мозаичного зина (on_progress — прогресс карточек)"""
     
     # Фиксированные данные
     username = analysis.get('username', 'Неизвестный')
@@ -573,24 +673,23 @@ def generate_zine_content(analysis: dict, images: list[Path]) -> dict:
     valid_images = []
     context = f"Instagram профиль @{username}, {followers} подписчиков, био: {bio}"
     
-    for i, img_path in enumerate(images[:15]):  # Ограничиваем до 15 фото для зина
-        if img_path.exists():
-            try:
-                # Создаем карточки разных типов
-                card_types = ["micro", "trigger", "sms"]
-                card_type = card_types[i % 3]
-                card_content = analyze_photo_for_card(img_path, context, card_type)
-                
-                photo_cards.append({
-                    'type': card_type,
-                    'content': card_content,
-                    'path': img_path
-                })
-                valid_images.append(img_path)
-                
-                print(f"📸 Карточка {i+1}/15 ({card_type}): {card_content[:40]}...")
-            except Exception as e:
-                print(f"❌ Ошибка создания карточки {img_path}: {e}")
+    # Создаем карточки разных типов — все запросы к модели идут параллельно
+    card_types = ["micro", "trigger", "sms"]
+    indexed = [(i, img_path) for i, img_path in enumerate(images[:15]) if img_path.exists()]  # Ограничиваем до 15 фото для зина
+    batch_types = [card_types[i % 3] for i, _ in indexed]
+    # готовые карточки тех же фото (cards.json прогона) переиспользуются
+    batch_types, card_texts = await cards.analyze([img_path for _, img_path in indexed], context, batch_types,
+                                                  on_progress=on_progress)
+    
+    for (i, img_path), card_type, card_content in zip(indexed, batch_types, card_texts):
+        photo_cards.append({
+            'type': card_type,
+            'content': card_content,
+            'path': img_path
+        })
+        valid_images.append(img_path)
+        
+        print(f"📸 Карточка {i+1}/15 ({card_type}): {card_content[:40]}...")
     
     # Если фото меньше 3, создаем минимальный зин
     if len(valid_images) < 3:
@@ -613,7 +712,7 @@ def generate_zine_content(analysis: dict, images: list[Path]) -> dict:
     
     try:
         # 1. ЗАВЯЗКА - дневниковая запись (максимум 3 предложения)
-        hook = generate_scene_chapter("hook", scene_data, valid_images)
+        hook = await asyncio.to_thread(generate_scene_chapter, "hook", scene_data, valid_images)
         content['prologue'] = strip_cliches(hook)
         print(f"✅ Завязка: {hook[:50]}...")
     except Exception as e:
@@ -622,7 +721,7 @@ def generate_zine_content(analysis: dict, images: list[Path]) -> dict:
     
     try:
         # 2. КОНФЛИКТ - SMS-стиль (максимум 4 строки)
-        conflict = generate_scene_chapter("conflict", scene_data, valid_images)
+        conflict = await asyncio.to_thread(generate_scene_chapter, "conflict", scene_data, valid_images)
         content['emotions'] = strip_cliches(conflict)
         print(f"✅ Конфликт: {conflict[:50]}...")
     except Exception as e:
@@ -631,7 +730,7 @@ def generate_zine_content(analysis: dict, images: list[Path]) -> dict:
     
     try:
         # 3. ПОВОРОТ - момент озарения (максимум 3 предложения)
-        turn = generate_scene_chapter("turn", scene_data, valid_images)
+        turn = await asyncio.to_thread(generate_scene_chapter, "turn", scene_data, valid_images)
         content['places'] = strip_cliches(turn)
         print(f"✅ Поворот: {turn[:50]}...")
     except Exception as e:
@@ -640,7 +739,7 @@ def generate_zine_content(analysis: dict, images: list[Path]) -> dict:
     
     try:
         # 4. КУЛЬМИНАЦИЯ - цитаты комментариев
-        climax = generate_scene_chapter("climax", scene_data, valid_images)
+        climax = await asyncio.to_thread(generate_scene_chapter, "climax", scene_data, valid_images)
         content['community'] = strip_cliches(climax)
         print(f"✅ Кульминация: {climax[:50]}...")
     except Exception as e:
@@ -649,7 +748,7 @@ def generate_zine_content(analysis: dict, images: list[Path]) -> dict:
     
     try:
         # 5. ЭПИЛОГ - приглашение (максимум 2 предложения)
-        epilogue = generate_scene_chapter("epilogue", scene_data, valid_images)
+        epilogue = await asyncio.to_thread(generate_scene_chapter, "epilogue", scene_data, valid_images)
         content['legacy'] = strip_cliches(epilogue)
         print(f"✅ Эпилог: {epilogue[:50]}...")
     except Exception as e:
@@ -664,7 +763,7 @@ def generate_zine_content(analysis: dict, images: list[Path]) -> dict:
     
     return content
 
-def generate_classic_book_content(analysis: dict, images: list[Path]) -> dict:
+async def generate_classic_book_content(analysis: dict, images: list[Path]) -> dict:
     """Генерирует полный контент для классической книги"""
     
     # Фиксированные данные для консистентности
@@ -692,16 +791,17 @@ def generate_classic_book_content(analysis: dict, images: list[Path]) -> dict:
     valid_images = []
     context = f"Instagram профиль @{username}, {followers_metaphor}, био: {bio}"
     
-    for i, img_path in enumerate(images):  # Используем все фото для классической книги
-        if img_path.exists():
-            try:
-                # Передаем индекс для вариативности анализа
-                analysis_text = analyze_photo(img_path, context, photo_index=i)
-                photo_analyses.append(analysis_text)
-                valid_images.append(img_path)
-                print(f"📸 Анализ фото {i+1} ({['расшифровка', 'монолог', 'диалог'][i % 3]}): {analysis_text[:60]}...")
-            except Exception as e:
-                print(f"❌ Ошибка анализа фото {img_path}: {e}")
+    # Индекс фото определяет тип анализа, как в analyze_photo
+    card_types = ["micro", "trigger", "sms"]
+    indexed = [(i, img_path) for i, img_path in enumerate(images) if img_path.exists()]  # Используем все фото для классической книги
+    _, analyses = await cards.analyze(
+        [img_path for _, img_path in indexed], context, [card_types[i % 3] for i, _ in indexed]
+    )
+    
+    for (i, img_path), analysis_text in zip(indexed, analyses):
+        photo_analyses.append(analysis_text)
+        valid_images.append(img_path)
+        print(f"📸 Анализ фото {i+1} ({['расшифровка', 'монолог', 'диалог'][i % 3]}): {analysis_text[:60]}...")
     
     # Если фото меньше 3, не создаем книгу
     if len(valid_images) < 3:
@@ -731,7 +831,7 @@ def generate_classic_book_content(analysis: dict, images: list[Path]) -> dict:
     # 1. ВСТРЕЧА - Рассказчик объясняет мотивацию
     print(f"💕 Создаем встречу (любопытство)...")
     try:
-        prologue = generate_unique_chapter("intro", data_for_chapters, generated_texts)
+        prologue = await asyncio.to_thread(generate_unique_chapter, "intro", data_for_chapters, generated_texts)
         content['prologue'] = prologue
         generated_texts.append(prologue[:100])
     except Exception as e:
@@ -741,7 +841,7 @@ def generate_classic_book_content(analysis: dict, images: list[Path]) -> dict:
     # 2. КОНФЛИКТ - Одна конкретная тайна
     print(f"💕 Создаем конфликт (сомнения)...")
     try:
-        emotions_chapter = generate_unique_chapter("emotions", data_for_chapters, generated_texts)
+        emotions_chapter = await asyncio.to_thread(generate_unique_chapter, "emotions", data_for_chapters, generated_texts)
         content['emotions'] = emotions_chapter
         generated_texts.append(emotions_chapter[:100])
     except Exception as e:
@@ -751,7 +851,7 @@ def generate_classic_book_content(analysis: dict, images: list[Path]) -> dict:
     # 3. ПОВОРОТНЫЙ КАДР - Место раскрытия тайны
     print(f"💕 Создаем поворот (осознание)...")
     try:
-        places_chapter = generate_unique_chapter("places", data_for_chapters, generated_texts)
+        places_chapter = await asyncio.to_thread(generate_unique_chapter, "places", data_for_chapters, generated_texts)
         content['places'] = places_chapter
         generated_texts.append(places_chapter[:100])
     except Exception as e:
@@ -761,7 +861,7 @@ def generate_classic_book_content(analysis: dict, images: list[Path]) -> dict:
     # 4. РАЗРЕШЕНИЕ - Реакция подписчиков на тайну
     print(f"💕 Создаем разрешение (принятие)...")
     try:
-        community_chapter = generate_unique_chapter("community", data_for_chapters, generated_texts)
+        community_chapter = await asyncio.to_thread(generate_unique_chapter, "community", data_for_chapters, generated_texts)
         content['community'] = community_chapter
         generated_texts.append(community_chapter[:100])
     except Exception as e:
@@ -771,7 +871,7 @@ def generate_classic_book_content(analysis: dict, images: list[Path]) -> dict:
     # 5. ФИНАЛ - Приглашение в будущее
     print(f"💕 Создаем финал (рост рассказчика)...")
     try:
-        legacy_chapter = generate_unique_chapter("legacy", data_for_chapters, generated_texts)
+        legacy_chapter = await asyncio.to_thread(generate_unique_chapter, "legacy", data_for_chapters, generated_texts)
         content['legacy'] = legacy_chapter
         generated_texts.append(legacy_chapter[:100])
     except Exception as e:
@@ -787,8 +887,8 @@ def generate_classic_book_content(analysis: dict, images: list[Path]) -> dict:
     
     return content
 
-def create_classic_book_html(content: dict, analysis: dict, images: list[Path]) -> str:
-    """Создает HTML книгу в классическом формате с живой речью и без канцеляризмов"""
+def create_classic_book_html(content: dict, analysis: dict, images: list[Path], embed_images: bool = False) -> Iterator[str]:
+    """Создает HTML книгу в классическом формате с живой речью и без канцеляризмов (отдает кусками)"""
     
     # Фиксированные данные (устраняем несостыковки)
     username = analysis.get('username', 'Неизвестный')
@@ -808,23 +908,9 @@ def create_classic_book_html(content: dict, analysis: dict, images: list[Path])
     for i, img_path in enumerate(images):  # Используем все фото
         if img_path.exists():
             try:
-                with Image.open(img_path) as img:
-                    if img.mode != 'RGB':
-                        img = img.convert('RGB')
-                    
-                    # Адаптивный размер для классической книги
-                    max_size = (800, 600)
-                    img.thumbnail(max_size, Image.Resampling.LANCZOS)
-                    
-                    # Минимальная обработка
-                    enhancer = ImageEnhance.Contrast(img)
-                    img = enhancer.enhance(1.05)
-                    
-                    # Конвертируем в base64
-                    buffer = BytesIO()
-                    img.save(buffer, format='JPEG', quality=88)
-                    img_str = base64.b64encode(buffer.getvalue()).decode()
-                    processed_images.append(f"data:image/jpeg;base64,{img_str}")
+                # Адаптивный размер для классической книги, минимальная обработка
+                derived = get_derivative(img_path, *CLASSIC_IMAGE_SPEC)
+                processed_images.append(image_src(derived, embed_images))
             except Exception as e:
                 print(f"❌ Ошибка при обработке изображения {img_path}: {e}")
     
@@ -833,356 +919,44 @@ def create_classic_book_html(content: dict, analysis: dict, images: list[Path])
     locations = analysis.get('locations', ['Неизвестно'])[:3]
     photo_stories = content.get('photo_stories', [])
     
-    # Убираем пустые "Момент X" - используем только реальные фото
-    valid_photo_count = len(processed_images)
-    
-    # HTML с улучшенной структурой
-    html = f"""<!DOCTYPE html>
-<html lang="ru">
-<head>
-    <meta charset="UTF-8">
-    <title>{content.get('title', f'История @{username}')}</title>
-    <link rel="preconnect" href="https://fonts.googleapis.com">
-    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-    <link href="https://fonts.googleapis.com/css2?family=Crimson+Text:ital,wght@0,400;0,600;1,400&family=Playfair+Display:wght@400;500;700&family=Libre+Baskerville:ital,wght@0,400;0,700;1,400&display=swap" rel="stylesheet">
-    
-    <style>
-    :root {{
-        --vanilla-bg: #faf8f3;
-        --cream-bg: #f7f4ed;
-        --soft-beige: #f2ede2;
-        --warm-white: #fefcf8;
-        --text-dark: #2c2a26;
-        --text-medium: #5a5652;
-        --text-light: #8b8680;
-        --accent-warm: #d4af8c;
-        --shadow-soft: rgba(60, 50, 40, 0.08);
-    }}
-    
-    body {{
-        font-family: 'Crimson Text', serif;
-        font-size: 13pt;
-        line-height: 1.6;
-        color: var(--text-dark);
-        background: var(--vanilla-bg);
-        margin: 0;
-        padding: 0;
-        max-width: 800px;
-        margin: 0 auto;
-    }}
-    
-    .page {{
-        min-height: 85vh;
-        padding: 2cm 2.5cm;
-        margin-bottom: 1cm;
-        page-break-after: always;
-        background: var(--warm-white);
-        box-shadow: 0 4px 20px var(--shadow-soft);
-        border-radius: 6px;
-        border: 1px solid rgba(212, 175, 140, 0.1);
-    }}
-    
-    .page:last-child {{
-        page-break-after: auto;
-    }}
-    
-    h1 {{
-        font-family: 'Playfair Display', serif;
-        font-size: 28pt;
-        text-align: center;
-        margin: 2cm 0 1.5cm 0;
-        color: var(--text-dark);
-        font-weight: 500;
-        letter-spacing: 1px;
-    }}
-    
-    h2 {{
-        font-family: 'Playfair Display', serif;
-        font-size: 20pt;
-        color: var(--text-dark);
-        margin: 2cm 0 1cm 0;
-        font-weight: 500;
-        border-bottom: 2px solid var(--accent-warm);
-        padding-bottom: 0.3cm;
-    }}
-    
-    .chapter-number {{
-        font-family: 'Libre Baskerville', serif;
-        font-size: 11pt;
-        color: var(--text-light);
-        text-align: center;
-        margin-bottom: 0.8cm;
-        font-style: italic;
-        text-transform: uppercase;
-        letter-spacing: 2px;
-    }}
-    
-    /* Улучшенная типографика для коротких абзацев */
-    p {{
-        margin: 0 0 1.2em 0;
-        text-align: justify;
-        text-indent: 1.5em;
-        line-height: 1.7;
-    }}
-    
-    .first-paragraph {{
-        text-indent: 0;
-        font-size: 14pt;
-        font-weight: 500;
-    }}
-    
-    /* Стили для метафор вместо сухой статистики */
-    .metaphor-box {{
-        margin: 1.5cm 0;
-        text-align: center;
-        font-family: 'Libre Baskerville', serif;
-        padding: 1.5em;
-        background: var(--cream-bg);
-        border-radius: 12px;
-        border: 1px solid rgba(212, 175, 140, 0.2);
-        font-style: italic;
-        color: var(--text-medium);
-    }}
-    
-    .metaphor-box h3 {{
-        margin-top: 0;
-        color: var(--accent-warm);
-        font-size: 16pt;
-        font-style: normal;
-    }}
-    
-    /* Инфобокс для технической информации (выносной) */
-    .info-sidebar {{
-        position: absolute;
-        right: -200px;
-        top: 2cm;
-        width: 180px;
-        padding: 1em;
-        background: var(--soft-beige);
-        border-radius: 8px;
-        font-size: 10pt;
-        color: var(--text-light);
-        border-left: 3px solid var(--accent-warm);
-    }}
-    
-    /* Стили для живых диалогов */
-    .dialogue {{
-        font-style: italic;
-        color: var(--text-medium);
-        text-indent: 0;
-        margin: 1em 0;
-        padding-left: 2em;
-        border-left: 2px solid var(--accent-warm);
-        padding-left: 1em;
-    }}
-    
-    .dialogue::before {{
-        content: "— ";
-        font-weight: bold;
-        color: var(--accent-warm);
-    }}
-    
-    .inner-thought {{
-        font-style: italic;
-        color: var(--text-medium);
-        text-align: center;
-        margin: 1.5em 0;
-        padding: 1em;
-        background: var(--cream-bg);
-        border-radius: 8px;
-        text-indent: 0;
-    }}
-    
-    .photo-container {{
-        margin: 2cm 0;
-        text-align: center;
-        page-break-inside: avoid;
-    }}
-    
-    .photo-frame {{
-        display: inline-block;
-        padding: 15px;
-        background: var(--warm-white);
-        border-radius: 12px;
-        box-shadow: 0 6px 25px var(--shadow-soft);
-        border: 1px solid rgba(212, 175, 140, 0.15);
-    }}
-    
-    .photo-frame img {{
-        max-width: 100%;
-        max-height: 450px;
-        border-radius: 8px;
-        border: 2px solid var(--warm-white);
-    }}
-    
-    .photo-caption {{
-        font-family: 'Libre Baskerville', serif;
-        font-style: italic;
-        font-size: 11pt;
-        color: var(--text-medium);
-        margin-top: 1cm;
-        text-align: center;
-    }}
-    
-    .photo-story {{
-        margin-top: 0.8cm;
-        padding: 1.2em;
-        background: var(--soft-beige);
-        border-radius: 8px;
-        font-size: 11pt;
-        color: var(--text-medium);
-        border-left: 3px solid var(--accent-warm);
-        text-align: left;
-        white-space: pre-line;
-    }}
-    
-    /* Стили для вариативных подходов к фото */
-    .photo-detective {{
-        border-left-color: #e74c3c;
-    }}
-    
-    .photo-monologue {{
-        border-left-color: #3498db;
-    }}
-    
-    .photo-dialogue {{
-        border-left-color: #2ecc71;
-    }}
-    
-    @media print {{
-        body {{ margin: 0; background: white; }}
-        .page {{ box-shadow: none; border: none; }}
-        .info-sidebar {{ display: none; }}
-    }}
-    </style>
-</head>
-<body>
-
-<!-- ОБЛОЖКА -->
-<div class="page">
-    <h1>{content.get('title', f'История @{username}')}</h1>
-    
-    <div style="text-align: center; margin: 3cm 0; font-style: italic; color: var(--text-medium);">
-        Документальная повесть<br>
-        {valid_photo_count} кадров откровения
-    </div>
-    
-    <div class="metaphor-box">
-        <h3>@{username}</h3>
-        <p style="margin: 0; text-indent: 0;">{followers_metaphor}</p>
-        <p style="margin: 0.5em 0 0 0; text-indent: 0; font-size: 11pt;">{posts_metaphor}</p>
-        {f'<p style="margin: 1em 0 0 0; text-indent: 0; font-size: 10pt; font-style: normal;">«{bio}»</p>' if bio else ''}
-    </div>
-    
-    <!-- Выносной инфобокс с технической информацией -->
-    <div class="info-sidebar">
-        <strong>Техническая справка:</strong><br>
-        Подписчики: {followers:,}<br>
-        Посты: {posts_count}<br>
-        {f'Верификация: {"Да" if verified else "Нет"}<br>' if verified else ''}
-        Анализ: {valid_photo_count} фотографий
-    </div>
-    
-    <div style="position: absolute; bottom: 2cm; left: 50%; transform: translateX(-50%); text-align: center;">
-        <p style="font-size: 10pt; color: var(--text-light); margin: 0;">
-            {full_name if full_name != username else username}
-        </p>
-    </div>
-</div>
-
-<!-- 1. ВСТРЕЧА -->
-<div class="page">
-    <div class="chapter-number">Глава первая</div>
-    <h2>Встреча</h2>
-    
-    <div style="white-space: pre-line; line-height: 1.7;">
-        {content.get('prologue', f'Документирую, чтобы не забыть, как случайно встретил талант.\n\n@{username} попался в ленте случайно.\n\n{followers_metaphor} — но дело не в цифрах.')}
-    </div>
-</div>"""
-    
-    # Добавляем фотографии с ВАРИАТИВНЫМ анализом
-    photo_styles = ['detective', 'monologue', 'dialogue']
-    for i, img_base64 in enumerate(processed_images):
-        caption = real_captions[i] if i < len(real_captions) else f'Кадр {i+1}'
-        photo_analysis = photo_stories[i] if i < len(photo_stories) else "Время замерло в этом кадре."
-        style_class = photo_styles[i % 3]
-        style_name = ['Расшифровка', 'Внутренний монолог', 'Диалог'][i % 3]
-        
-        html += f"""
+    # Фото с ВАРИАТИВНЫМ анализом: стиль чередуется
+    photo_styles = [('detective', 'Расшифровка'), ('monologue', 'Внутренний монолог'), ('dialogue', 'Диалог')]
+    photos = []
+    for i, src in enumerate(processed_images):
+        style_class, style_name = photo_styles[i % 3]
+        photos.append({
+            'src': src,
+            'caption': real_captions[i] if i < len(real_captions) else f'Кадр {i+1}',
+            'story': photo_stories[i] if i < len(photo_stories) else "Время замерло в этом кадре.",
+            'style_class': style_class,
+            'style_name': style_name,
+        })
+    
+    # Главы с четким фокусом
+    chapters = {
+        'prologue': content.get('prologue', f'Документирую, чтобы не забыть, как случайно встретил талант.\n\n@{username} попался в ленте случайно.\n\n{followers_metaphor} — но дело не в цифрах.'),
+        'emotions': content.get('emotions', f'«{real_captions[0] if real_captions else "Все хорошо"}» — написано под фото.\n\nНо глаза говорят другое.\n\nВ уголках рта прячется усталость.'),
+        'places': content.get('places', f'Кадр из {locations[0] if locations else "неизвестного места"} изменил все.\n\nЗдесь пахло дождем и честностью.\n\nВпервые за долгое время — настоящая улыбка.'),
+        'community': content.get('community', f'{followers_metaphor} откликнулись на откровенность.\n\n«Наконец-то ты показал себя настоящего» — пишет подруга.\n\n«Спасибо за честность» — добавляет незнакомец.'),
+        'legacy': content.get('legacy', 'Что останется важного?\n\nНе лайки. Не статистика.\n\nМомент, когда человек решился быть собой.\n\nЯ листаю ленту в поиске нового дикого цветка. А вдруг это будешь ты?'),
+    }
+    
+    yield from templates.stream("classic", {
+        'title': content.get('title', f'История @{username}'),
+        'username': username,
+        'full_name': full_name,
+        'followers': followers,
+        'posts_count': posts_count,
+        'bio': bio,
+        'verified': verified,
+        'followers_metaphor': followers_metaphor,
+        'posts_metaphor': posts_metaphor,
+        'photos': photos,
+        'chapters': chapters,
+    }, embed_images)
 
-<div class="page">
-    <div class="photo-container">
-        <div class="photo-frame">
-            <img src="{img_base64}" alt="Фотография {i+1}">
-        </div>
-        
-        <div class="photo-caption">
-            «{caption}»
-        </div>
-        
-        <div class="photo-story photo-{style_class}">
-            <small style="color: var(--text-light); font-style: normal;">{style_name}:</small>
-            
-            {photo_analysis}
-        </div>
-    </div>
-</div>"""
-    
-    # Остальные главы с четким фокусом
-    html += f"""
-
-<!-- 2. КОНФЛИКТ -->
-<div class="page">
-    <div class="chapter-number">Глава вторая</div>
-    <h2>Тайна</h2>
-    
-    <div style="white-space: pre-line; line-height: 1.7;">
-        {content.get('emotions', f'«{real_captions[0] if real_captions else "Все хорошо"}» — написано под фото.\n\nНо глаза говорят другое.\n\nВ уголках рта прячется усталость.')}
-    </div>
-</div>
-
-<!-- 3. ПОВОРОТ -->
-<div class="page">
-    <div class="chapter-number">Глава третья</div>
-    <h2>Озарение</h2>
-    
-    <div style="white-space: pre-line; line-height: 1.7;">
-        {content.get('places', f'Кадр из {locations[0] if locations else "неизвестного места"} изменил все.\n\nЗдесь пахло дождем и честностью.\n\nВпервые за долгое время — настоящая улыбка.')}
-    </div>
-</div>
-
-<!-- 4. РАЗРЕШЕНИЕ -->
-<div class="page">
-    <div class="chapter-number">Глава четвертая</div>
-    <h2>Отклик</h2>
-    
-    <div style="white-space: pre-line; line-height: 1.7;">
-        {content.get('community', f'{followers_metaphor} откликнулись на откровенность.\n\n«Наконец-то ты показал себя настоящего» — пишет подруга.\n\n«Спасибо за честность» — добавляет незнакомец.')}
-    </div>
-</div>
-
-<!-- 5. ФИНАЛ -->
-<div class="page">
-    <div class="chapter-number">Эпилог</div>
-    <h2>Приглашение</h2>
-    
-    <div style="white-space: pre-line; line-height: 1.7;">
-        {content.get('legacy', f'Что останется важного?\n\nНе лайки. Не статистика.\n\nМомент, когда человек решился быть собой.\n\nЯ листаю ленту в поиске нового дикого цветка. А вдруг это будешь ты?')}
-    </div>
-    
-    <div style="text-align: center; margin-top: 3cm; font-style: italic; color: var(--text-medium);">
-        Конец первой истории.<br>
-        <small>Начало поиска следующей.</small>
-    </div>
-</div>
-
-</body>
-</html>"""
-    
-    return html
-
-def create_zine_html(content: dict, analysis: dict, images: list[Path]) -> str:
-    """Создает мозаичную HTML книгу с коллажами и интерактивными карточками"""
+def create_zine_html(content: dict, analysis: dict, images: list[Path], embed_images: bool = False) -> Iterator[str]:
+    """Создает мозаичную HTML книгу с коллажами и интерактивными карточками (отдает кусками)"""
     
     # Фиксированные данные
     username = analysis.get('username', 'Неизвестный')
@@ -1195,6 +969,9 @@ def create_zine_html(content: dict, analysis: dict, images: list[Path]) -> str:
     # Обрабатываем только первые 15 изображений для коллажа
     processed_images = []
     
+    # Карточки уже созданы в generate_zine_content — не анализируем фото повторно
+    cards_by_path = {card['path']: card for card in content.get('photo_cards', [])}
+    
     # Ограничиваем до 15 фото для оптимальной производительности
     limited_images = images[:15]
     print(f"🎨 Обрабатываем {len(limited_images)} фотографий для мозаичного коллажа")
@@ -1202,37 +979,27 @@ def create_zine_html(content: dict, analysis: dict, images: list[Path]) -> str:
     for i, img_path in enumerate(limited_images):
         if img_path.exists():
             try:
-                with Image.open(img_path) as img:
-                    if img.mode != 'RGB':
-                        img = img.convert('RGB')
-                    
-                    # Для коллажа - меньший размер
-                    max_size = (300, 300)
-                    img.thumbnail(max_size, Image.Resampling.LANCZOS)
-                    
-                    # Минимальная обработка
-                    enhancer = ImageEnhance.Contrast(img)
-                    img = enhancer.enhance(1.03)
-                    
-                    # Конвертируем в base64
-                    buffer = BytesIO()
-                    img.save(buffer, format='JPEG', quality=85)
-                    img_str = base64.b64encode(buffer.getvalue()).decode()
-                    
-                    # Генерируем карточку для этого фото
+                # Для коллажа - меньший размер, минимальная обработка
+                derived = get_derivative(img_path, *ZINE_IMAGE_SPEC)
+                
+                # Берем готовую карточку, генерируем только если ее нет
+                card = cards_by_path.get(img_path)
+                if card:
+                    card_type, card_content = card['type'], card['content']
+                else:
                     card_types = ["micro", "trigger", "sms"]
                     card_type = card_types[i % 3]
                     card_content = analyze_photo_for_card(img_path, f"@{username}", card_type)
-                    
-                    processed_images.append({
-                        'data': f"data:image/jpeg;base64,{img_str}",
-                        'rotation': random.uniform(-3, 3),  # Случайный поворот
-                        'size': random.choice(['small', 'medium', 'large']),
-                        'card_content': card_content,
-                        'card_type': card_type
-                    })
-                    
-                    print(f"✅ Фото {i+1}/15 обработано для коллажа")
+                
+                processed_images.append({
+                    'src': image_src(derived, embed_images),
+                    'rotation': random.uniform(-3, 3),  # Случайный поворот
+                    'size': random.choice(['small', 'medium', 'large']),
+                    'card_content': card_content,
+                    'card_type': card_type
+                })
+                
+                print(f"✅ Фото {i+1}/15 обработано для коллажа")
                     
             except Exception as e:
                 print(f"❌ Ошибка при обработке изображения {img_path}: {e}")
@@ -1245,365 +1012,27 @@ def create_zine_html(content: dict, analysis: dict, images: list[Path]) -> str:
     
     print(f"🎯 Создаем зин с {len(processed_images)} фотографиями")
     
-    # HTML с мозаичным дизайном
-    html = f"""<!DOCTYPE html>
-<html lang="ru">
-<head>
-    <meta charset="UTF-8">
-    <title>{content.get('title', f'Зин @{username}')}</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <link rel="preconnect" href="https://fonts.googleapis.com">
-    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-    <link href="https://fonts.googleapis.com/css2?family=Crimson+Text:ital,wght@0,400;0,600;1,400&family=Playfair+Display:wght@400;500;700&family=JetBrains+Mono:wght@400;500&display=swap" rel="stylesheet">
-    
-    <style>
-    :root {{
-        --paper: #fefcf8;
-        --ink: #2a2a2a;
-        --accent: #d4af8c;
-        --shadow: rgba(0,0,0,0.1);
-        --highlight: #fff9e6;
-    }}
-    
-    * {{ box-sizing: border-box; }}
-    
-    body {{
-        font-family: 'Crimson Text', serif;
-        background: var(--paper);
-        color: var(--ink);
-        margin: 0;
-        padding: 20px;
-        line-height: 1.5;
-        overflow-x: hidden;
-    }}
-    
-    /* Мозаичная сетка для коллажа */
-    .moodboard {{
-        position: relative;
-        display: grid;
-        grid-template-columns: repeat(auto-fill, minmax(180px, 1fr));
-        gap: 15px;
-        margin: 2rem 0;
-        min-height: 400px;
-    }}
-    
-    .tile {{
-        position: relative;
-        width: 100%;
-        height: 180px;
-        object-fit: cover;
-        border-radius: 8px;
-        box-shadow: 0 4px 12px var(--shadow);
-        transition: transform 0.3s ease;
-        cursor: pointer;
-    }}
-    
-    .tile.small {{ height: 140px; }}
-    .tile.medium {{ height: 180px; }}
-    .tile.large {{ height: 220px; grid-row: span 2; }}
-    
-    .tile:hover {{
-        transform: scale(1.05) rotate(0deg) !important;
-        z-index: 10;
-    }}
-    
-    /* Overlay с текстом поверх коллажа */
-    .overlay-quote {{
-        position: absolute;
-        top: 50%;
-        left: 50%;
-        transform: translate(-50%, -50%);
-        background: rgba(254, 252, 248, 0.95);
-        padding: 2rem 3rem;
-        border-radius: 12px;
-        box-shadow: 0 8px 32px var(--shadow);
-        font-family: 'Playfair Display', serif;
-        font-size: 1.4rem;
-        text-align: center;
-        max-width: 500px;
-        border: 2px solid var(--accent);
-        z-index: 5;
-    }}
-    
-    /* Интерактивные карточки */
-    .photo-card {{
-        margin: 2rem 0;
-        border: 1px solid #e0e0e0;
-        border-radius: 12px;
-        overflow: hidden;
-        background: white;
-        box-shadow: 0 4px 20px var(--shadow);
-    }}
-    
-    .card-trigger {{
-        width: 100%;
-        padding: 0;
-        border: none;
-        background: none;
-        cursor: pointer;
-    }}
-    
-    .card-trigger img {{
-        width: 100%;
-        height: 200px;
-        object-fit: cover;
-        display: block;
-    }}
-    
-    .card-content {{
-        padding: 1.5rem;
-        background: var(--highlight);
-        border-top: 3px solid var(--accent);
-    }}
-    
-    .card-type {{
-        font-family: 'JetBrains Mono', monospace;
-        font-size: 0.8rem;
-        color: var(--accent);
-        text-transform: uppercase;
-        margin-bottom: 0.5rem;
-        font-weight: 500;
-    }}
-    
-    .card-text {{
-        font-size: 1.1rem;
-        line-height: 1.6;
-        white-space: pre-line;
-    }}
-    
-    /* SMS стиль для диалогов */
-    .sms-style {{
-        font-family: 'JetBrains Mono', monospace;
-        background: #f0f0f0;
-        padding: 1rem;
-        border-radius: 8px;
-        font-size: 0.95rem;
-    }}
-    
-    /* Сцены книги */
-    .scene {{
-        margin: 3rem 0;
-        padding: 2rem;
-        background: white;
-        border-radius: 12px;
-        box-shadow: 0 6px 24px var(--shadow);
-        border-left: 5px solid var(--accent);
-    }}
-    
-    .scene-title {{
-        font-family: 'Playfair Display', serif;
-        font-size: 1.8rem;
-        margin-bottom: 1rem;
-        color: var(--accent);
-        text-transform: uppercase;
-        letter-spacing: 1px;
-    }}
-    
-    .scene-content {{
-        font-size: 1.2rem;
-        line-height: 1.7;
-        white-space: pre-line;
-    }}
-    
-    /* Заголовки */
-    h1 {{
-        font-family: 'Playfair Display', serif;
-        font-size: 3rem;
-        text-align: center;
-        margin: 2rem 0;
-        color: var(--ink);
-    }}
-    
-    .subtitle {{
-        text-align: center;
-        font-style: italic;
-        color: #666;
-        margin-bottom: 3rem;
-    }}
-    
-    /* Техническая справка */
-    .tech-info {{
-        background: #f8f8f8;
-        padding: 1rem;
-        border-radius: 8px;
-        font-family: 'JetBrains Mono', monospace;
-        font-size: 0.9rem;
-        margin: 2rem 0;
-        border-left: 3px solid var(--accent);
-    }}
-    
-    /* Финальный призыв */
-    .final-call {{
-        text-align: center;
-        padding: 3rem 2rem;
-        background: linear-gradient(135deg, var(--highlight), var(--paper));
-        border-radius: 12px;
-        margin: 3rem 0;
-        border: 2px solid var(--accent);
-    }}
-    
-    .qr-placeholder {{
-        width: 120px;
-        height: 120px;
-        background: var(--accent);
-        margin: 1rem auto;
-        border-radius: 8px;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        color: white;
-        font-weight: bold;
-    }}
-    
-    /* Адаптивность */
-    @media (max-width: 768px) {{
-        .moodboard {{
-            grid-template-columns: repeat(auto-fill, minmax(120px, 1fr));
-            gap: 10px;
-        }}
-        
-        .tile {{ height: 120px; }}
-        .tile.large {{ height: 160px; }}
-        
-        .overlay-quote {{
-            padding: 1rem 1.5rem;
-            font-size: 1.1rem;
-        }}
-        
-        h1 {{ font-size: 2rem; }}
-    }}
-    
-    /* Печать */
-    @media print {{
-        .photo-card {{ page-break-inside: avoid; }}
-        .scene {{ page-break-inside: avoid; }}
-        .moodboard {{ page-break-inside: avoid; }}
-    }}
-    </style>
-</head>
-<body>
-
-<!-- ЗАГОЛОВОК -->
-<h1>Зин @{username}</h1>
-<div class="subtitle">
-    Визуальный дневник • {len(processed_images)} кадров • 5 минут чтения
-</div>
-
-<!-- ТЕХНИЧЕСКАЯ СПРАВКА -->
-<div class="tech-info">
-    <strong>@{username}</strong> • {followers:,} подписчиков • {posts_count} постов
-    {f' • ✓ Верифицирован' if verified else ''}
-    {f'<br>"{bio}"' if bio else ''}
-    <br><small>Отобрано лучших {len(processed_images)} из {len(images)} фотографий</small>
-</div>
-
-<!-- МУДБОРД-КОЛЛАЖ -->
-<div class="moodboard">
-    {chr(10).join([f'''
-    <img src="{img['data']}" 
-         class="tile {img['size']}" 
-         style="transform: rotate({img['rotation']}deg)"
-         alt="Кадр {i+1}"
-         onclick="showCard({i})">
-    ''' for i, img in enumerate(processed_images)])}
-    
-    <div class="overlay-quote">
-        «{content.get('prologue', 'Листаю ленту в поиске дикого цветка. А вдруг это будешь ты?')}»
-    </div>
-</div>
-
-<!-- ИНТЕРАКТИВНЫЕ КАРТОЧКИ (скрытые по умолчанию) -->
-<div id="cards-section" style="display: none;">
-    <h2 style="text-align: center; margin: 3rem 0 2rem 0;">Истории за кадром</h2>
-    
-    {chr(10).join([f'''
-    <div class="photo-card" id="card-{i}">
-        <button class="card-trigger" onclick="toggleCard({i})">
-            <img src="{img['data']}" alt="Кадр {i+1}">
-        </button>
-        <div class="card-content" style="display: none;">
-            <div class="card-type">{img['card_type']}</div>
-            <div class="card-text {'sms-style' if img['card_type'] == 'sms' else ''}">{img['card_content']}</div>
-        </div>
-    </div>
-    ''' for i, img in enumerate(processed_images)])}
-</div>
-
-<!-- ДРАМАТУРГИЧЕСКИЕ СЦЕНЫ -->
-<div class="scene">
-    <div class="scene-title">Завязка</div>
-    <div class="scene-content">{content.get('prologue', 'Наткнулся на этот профиль случайно. Что-то зацепило.')}</div>
-</div>
-
-<div class="scene">
-    <div class="scene-title">Конфликт</div>
-    <div class="scene-content">{content.get('emotions', f'— {real_captions[0] if real_captions else "Все хорошо"}\n— Но глаза говорят другое.')}</div>
-</div>
-
-<div class="scene">
-    <div class="scene-title">Поворот</div>
-    <div class="scene-content">{content.get('places', 'Один кадр изменил все. Здесь пахло честностью.')}</div>
-</div>
-
-<div class="scene">
-    <div class="scene-title">Кульминация</div>
-    <div class="scene-content">{content.get('community', f' откликнулись на откровенность.\n\n«Наконец-то ты показал себя настоящего\n— Спасибо за честность')}</div>
-</div>
-
-<!-- ФИНАЛЬНЫЙ ПРИЗЫВ -->
-<div class="final-call">
-    <div class="scene-title">Эпилог</div>
-    <div class="scene-content">{content.get('legacy', 'Листаю ленту в поиске нового дикого цветка. А вдруг это будешь ты?')}</div>
-    
-    <div class="qr-placeholder">
-        QR → @{username}
-    </div>
-    
-    <p style="margin-top: 2rem; font-style: italic;">
-        Создано с любовью • Каждая история уникальна
-    </p>
-</div>
-
-<script>
-// Показать секцию с карточками
-function showCard(index) {{
-    const cardsSection = document.getElementById('cards-section');
-    cardsSection.style.display = 'block';
-    cardsSection.scrollIntoView({{ behavior: 'smooth' }});
-    
-    // Открыть конкретную карточку
-    setTimeout(() => {{
-        toggleCard(index);
-    }}, 500);
-}}
-
-// Переключить карточку
-function toggleCard(index) {{
-    const card = document.getElementById(`card-${{index}}`);
-    const content = card.querySelector('.card-content');
-    
-    if (content.style.display === 'none') {{
-        content.style.display = 'block';
-        card.scrollIntoView({{ behavior: 'smooth', block: 'center' }});
-    }} else {{
-        content.style.display = 'none';
-    }}
-}}
-
-// Рандомные повороты при загрузке
-document.addEventListener('DOMContentLoaded', function() {{
-    const tiles = document.querySelectorAll('.tile');
-    tiles.forEach((tile, index) => {{
-        const rotation = (Math.random() - 0.5) * 6; // -3 до +3 градусов
-        tile.style.transform = `rotate(${{rotation}}deg)`;
-    }});
-}});
-</script>
-
-</body>
-</html>"""
-    
-    return html
+    # Драматургические сцены
+    scenes = [
+        ('Завязка', content.get('prologue', 'Наткнулся на этот профиль случайно. Что-то зацепило.')),
+        ('Конфликт', content.get('emotions', f'— {real_captions[0] if real_captions else "Все хорошо"}\n— Но глаза говорят другое.')),
+        ('Поворот', content.get('places', 'Один кадр изменил все. Здесь пахло честностью.')),
+        ('Кульминация', content.get('community', ' откликнулись на откровенность.\n\n«Наконец-то ты показал себя настоящего\n— Спасибо за честность')),
+    ]
+    
+    yield from templates.stream("zine", {
+        'title': content.get('title', f'Зин @{username}'),
+        'username': username,
+        'followers': followers,
+        'posts_count': posts_count,
+        'bio': bio,
+        'verified': verified,
+        'photos': processed_images,
+        'total_images': len(images),
+        'quote': content.get('prologue', 'Листаю ленту в поиске дикого цветка. А вдруг это будешь ты?'),
+        'scenes': scenes,
+        'epilogue': content.get('legacy', 'Листаю ленту в поиске нового дикого цветка. А вдруг это будешь ты?'),
+    }, embed_images)
 
 def convert_image_to_base64(image_path: Path, max_size: tuple = (600, 400), style: str = "original") -> str:
     """Конвертирует изображение в base64 с чистой обработкой для EPUB стиля"""
@@ -1612,39 +1041,20 @@ def convert_image_to_base64(image_path: Path, max_size: tuple = (600, 400), styl
             print(f"❌ Файл изображения не найден: {image_path}")
             return ""
             
-        with Image.open(image_path) as img:
-            print(f"📸 Обрабатываем изображение: {image_path.name}")
-            
-            # Конвертируем в RGB если нужно
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Изменяем размер с сохранением пропорций
-            img.thumbnail(max_size, Image.Resampling.LANCZOS)
-            
-            # Применяем чистые стили для EPUB
-            if style == "clean":
-                # Минимальная обработка для четкости и читаемости
-                enhancer = ImageEnhance.Contrast(img)
-                img = enhancer.enhance(1.05)  # Легкое увеличение контраста
-                enhancer = ImageEnhance.Sharpness(img)
-                img = enhancer.enhance(1.1)   # Небольшое увеличение резкости
-                enhancer = ImageEnhance.Color(img)
-                img = enhancer.enhance(1.02)  # Очень легкое увеличение насыщенности
-                
-            # Конвертируем в base64
-            buffer = BytesIO()
-            img.save(buffer, format='JPEG', quality=90, optimize=True)
-            img_str = base64.b64encode(buffer.getvalue()).decode()
-            print(f"✅ Изображение {image_path.name} обработано для EPUB стиля")
-            return f"data:image/jpeg;base64,{img_str}"
+        print(f"📸 Обрабатываем изображение: {image_path.name}")
+        
+        # "clean" — минимальная обработка для четкости и читаемости (см. derivatives.STYLES)
+        derived = get_derivative(image_path, tuple(max_size), style if style == "clean" else "original",
+                                 quality=90, optimize=True)
+        print(f"✅ Изображение {image_path.name} обработано для EPUB стиля")
+        return to_data_uri(derived)
             
     except Exception as e:
         print(f"❌ Ошибка при обработке изображения {image_path}: {e}")
         return ""
 
-def create_literary_instagram_book_html(content: dict, analysis: dict, images: list[Path]) -> str:
-    """Создает HTML Instagram-книгу от первого лица в литературном стиле с эмоциями и метафорами"""
+def create_literary_instagram_book_html(content: dict, analysis: dict, images: list[Path], embed_images: bool = False) -> Iterator[str]:
+    """Создает HTML Instagram-книгу от первого лица в литературном стиле с эмоциями и метафорами (отдает кусками)"""
     
     # Фиксированные данные
     username = analysis.get('username', 'незнакомец')
@@ -1667,22 +1077,9 @@ def create_literary_instagram_book_html(content: dict, analysis: dict, images: l
     for i, img_path in enumerate(images[:5]):  # Максимум 5 изображений для 5 глав
         if img_path.exists():
             try:
-                with Image.open(img_path) as img:
-                    if img.mode != 'RGB':
-                        img = img.convert('RGB')
-                    
-                    # Оптимальный размер для чтения
-                    max_size = (700, 500)
-                    img.thumbnail(max_size, Image.Resampling.LANCZOS)
-                    
-                    # Легкая обработка
-                    enhancer = ImageEnhance.Contrast(img)
-                    img = enhancer.enhance(1.08)
-                    
-                    buffer = BytesIO()
-                    img.save(buffer, format='JPEG', quality=92)
-                    img_str = base64.b64encode(buffer.getvalue()).decode()
-                    processed_images.append(f"data:image/jpeg;base64,{img_str}")
+                # Оптимальный размер для чтения, легкая обработка
+                derived = get_derivative(img_path, *LITERARY_IMAGE_SPEC)
+                processed_images.append(image_src(derived, embed_images))
             except Exception as e:
                 print(f"❌ Ошибка обработки изображения {img_path}: {e}")
     
@@ -1707,566 +1104,37 @@ def create_literary_instagram_book_html(content: dict, analysis: dict, images: l
     ]
     epigraph = random.choice(epigraphs)
     
-    # HTML в литературном стиле
-    html = f"""<!DOCTYPE html>
-<html lang="ru">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{book_title}</title>
-    <link href="https://fonts.googleapis.com/css2?family=Crimson+Text:ital,wght@0,400;0,600;1,400;1,600&family=Playfair+Display:ital,wght@0,400;0,700;1,400;1,700&family=Libre+Baskerville:ital,wght@0,400;0,700;1,400&display=swap" rel="stylesheet">
-    
-    <style>
-    :root {{
-        --paper: #fefcf8;
-        --ink: #2c2a26;
-        --soft-ink: #5a5652;
-        --accent: #b85450;
-        --gold: #d4af8c;
-        --shadow: rgba(60, 50, 40, 0.15);
-    }}
-    
-    body {{
-        font-family: 'Crimson Text', serif;
-        background: var(--paper);
-        color: var(--ink);
-        line-height: 1.8;
-        font-size: 16px;
-        margin: 0;
-        padding: 0;
-        max-width: 800px;
-        margin: 0 auto;
-    }}
-    
-    .book-page {{
-        min-height: 100vh;
-        padding: 3cm 2.5cm;
-        background: white;
-        box-shadow: 0 8px 40px var(--shadow);
-        margin: 20px auto;
-        page-break-after: always;
-        position: relative;
-    }}
-    
-    .book-page:last-child {{
-        page-break-after: auto;
-    }}
-    
-    /* Обложка */
-    .cover {{
-        text-align: center;
-        padding: 4cm 2cm;
-        background: linear-gradient(135deg, var(--paper) 0%, #f7f4ed 100%);
-        border: 1px solid rgba(212, 175, 140, 0.3);
-    }}
-    
-    .cover-title {{
-        font-family: 'Playfair Display', serif;
-        font-size: 3rem;
-        font-weight: 700;
-        color: var(--ink);
-        margin-bottom: 1rem;
-        letter-spacing: -1px;
-    }}
-    
-    .cover-subtitle {{
-        font-family: 'Libre Baskerville', serif;
-        font-style: italic;
-        font-size: 1.2rem;
-        color: var(--soft-ink);
-        margin-bottom: 3rem;
-    }}
-    
-    .cover-author {{
-        font-size: 1.1rem;
-        color: var(--soft-ink);
-        margin-bottom: 4rem;
-    }}
-    
-    .cover-epigraph {{
-        font-style: italic;
-        color: var(--soft-ink);
-        border-top: 1px solid var(--gold);
-        border-bottom: 1px solid var(--gold);
-        padding: 2rem 0;
-        max-width: 400px;
-        margin: 0 auto;
-        position: relative;
-    }}
-    
-    .cover-epigraph::before {{
-        content: '«';
-        position: absolute;
-        left: -20px;
-        top: 1.5rem;
-        font-size: 2rem;
-        color: var(--accent);
-    }}
-    
-    .cover-epigraph::after {{
-        content: '»';
-        position: absolute;
-        right: -20px;
-        bottom: 1.5rem;
-        font-size: 2rem;
-        color: var(--accent);
-    }}
-    
-    /* Заголовки глав */
-    h1 {{
-        font-family: 'Playfair Display', serif;
-        font-size: 2.2rem;
-        font-weight: 700;
-        color: var(--ink);
-        margin: 3rem 0 1.5rem 0;
-        text-align: left;
-        border-bottom: 2px solid var(--gold);
-        padding-bottom: 0.5rem;
-    }}
-    
-    h2 {{
-        font-family: 'Playfair Display', serif;
-        font-size: 1.8rem;
-        color: var(--accent);
-        margin: 2.5rem 0 1.5rem 0;
-        text-align: center;
-    }}
-    
-    /* Эпиграфы к главам */
-    .chapter-epigraph {{
-        text-align: center;
-        font-style: italic;
-        color: var(--soft-ink);
-        border-left: 3px solid var(--gold);
-        padding-left: 2rem;
-        margin: 2rem 0;
-        background: #faf8f3;
-        padding: 1.5rem;
-        border-radius: 8px;
-    }}
-    
-    /* Параграфы */
-    p {{
-        text-align: justify;
-        text-indent: 2rem;
-        margin-bottom: 1.5rem;
-        line-height: 1.8;
-        font-size: 1.1rem;
-    }}
-    
-    .first-paragraph {{
-        text-indent: 0;
-        font-weight: 500;
-        font-size: 1.15rem;
-    }}
-    
-    /* Диалоги */
-    .dialogue {{
-        font-style: italic;
-        color: var(--soft-ink);
-        text-indent: 0;
-        margin: 1.5rem 0;
-        padding-left: 2rem;
-        border-left: 3px solid var(--accent);
-        position: relative;
-    }}
-    
-    .dialogue::before {{
-        content: '—';
-        position: absolute;
-        left: -10px;
-        color: var(--accent);
-        font-weight: bold;
-    }}
-    
-    /* Изображения */
-    .hero-img {{
-        margin: 3rem 0;
-        text-align: center;
-        page-break-inside: avoid;
-    }}
-    
-    .hero-img img {{
-        max-width: 100%;
-        max-height: 450px;
-        border-radius: 12px;
-        box-shadow: 0 12px 30px var(--shadow);
-        border: 3px solid white;
-    }}
-    
-    .hero-img figcaption {{
-        font-family: 'Libre Baskerville', serif;
-        font-style: italic;
-        font-size: 1rem;
-        color: var(--soft-ink);
-        margin-top: 1rem;
-        text-align: center;
-    }}
-    
-    .hero-img figcaption::before {{
-        content: '– ';
-        color: var(--accent);
-    }}
-    
-    /* Внутренние мысли */
-    .inner-thought {{
-        font-style: italic;
-        text-align: center;
-        color: var(--soft-ink);
-        margin: 2rem 0;
-        padding: 1.5rem;
-        background: #f9f7f4;
-        border-radius: 8px;
-        text-indent: 0;
-    }}
-    
-    /* Статистика внизу */
-    .stats-footer {{
-        margin-top: 4rem;
-        padding-top: 2rem;
-        border-top: 1px solid var(--gold);
-        font-size: 0.9rem;
-        color: var(--soft-ink);
-        text-align: center;
-        line-height: 1.5;
-    }}
-    
-    /* Адаптивность */
-    @media (max-width: 768px) {{
-        .book-page {{
-            padding: 2cm 1.5cm;
-            margin: 10px;
-        }}
-        
-        .cover-title {{
-            font-size: 2.2rem;
-        }}
-        
-        h1 {{
-            font-size: 1.8rem;
-        }}
-    }}
-    
-    @media print {{
-        body {{
-            background: white;
-            margin: 0;
-        }}
-        
-        .book-page {{
-            box-shadow: none;
-            margin: 0;
-        }}
-    }}
-    </style>
-</head>
-<body>
-
-<!-- ОБЛОЖКА -->
-<div class="book-page cover">
-    <h1 class="cover-title">{book_title}</h1>
-    <p class="cover-subtitle">Instagram-история от первого лица</p>
-    <p class="cover-author">Автор: {full_name}</p>
-    <div class="cover-epigraph">{epigraph}</div>
-</div>
-
-<!-- ПРОЛОГ -->
-<div class="book-page">
-    <h2>Пролог</h2>
-    
-    <p class="first-paragraph">
-        Я наткнулся на профиль @{username} совершенно случайно, как натыкаются на неожиданные повороты в лабиринте старого города. Было около {random.choice(['полуночи', 'полудня', 'вечера'])}, и я бесцельно листал бесконечную ленту, когда среди привычного потока селфи и рекламы вдруг появилось что-то другое.
-    </p>
-    
-    <p>
-        {f'«{real_captions[0]}»' if real_captions else 'Подпись к фотографии была простой'} — было написано под одним из снимков. Но что-то в этих словах зацепило меня. Может быть, тон, может быть, честность, а может быть, просто усталость от фальшивого позитива, которым пропитаны социальные сети.
-    </p>
-    
-    <p>
-        Мне стало любопытно. Не просто любопытно, а как-то тревожно-интересно, как бывает, когда находишь книгу без обложки и не знаешь, стоит ли её открывать. Я кликнул на профиль и почувствовал, как что-то внутри меня замирает. Здесь была не просто коллекция фотографий — здесь была чья-то жизнь, разложенная по квадратикам.
-    </p>
-</div>
-
-<!-- ГЛАВА 1 -->
-<div class="book-page">
-    <h1>Глава 1. Первое впечатление</h1>
-    
-    <div class="chapter-epigraph">
-        «Иногда одна фотография стоит тысячи встреч»
-    </div>
-    
-    <p class="first-paragraph">
-        {followers:,} подписчиков. Это первое, что бросилось мне в глаза. Не маленькая цифра, но и не астрономическая. Достаточно, чтобы понимать — здесь есть что-то интересное, но недостаточно, чтобы потерять человечность за стеной известности.
-    </p>
-    
-    <p>
-        Я начал листать фотографии сверху вниз, как читают книгу, и каждый новый кадр был как страница неизвестного мне романа. {f'В био было написано: «{bio}»' if bio else 'Био было лаконичным, почти пустым'} — и это тоже говорило о чём-то. О нежелании объяснять себя в двух словах, о понимании того, что настоящие истории рассказываются не в описаниях профиля.
-    </p>
-    
-    <p>
-        Стиль съёмки сразу выдавал человека, который не просто фотографирует еду и закаты. Здесь был взгляд. Здесь была попытка поймать не только изображение, но и настроение, атмосферу, тот неуловимый момент, когда обыденность вдруг становится искусством.
-    </p>
-    
-    {'<figure class="hero-img"><img src="' + processed_images[0] + '" alt="' + (real_captions[0][:50] if real_captions else 'Момент жизни') + '"><figcaption>' + (real_captions[0] if real_captions else 'Кадр, который остановил время') + '</figcaption></figure>' if processed_images else ''}
-    
-    <p>
-        Я понял, что передо мной не просто Instagram-аккаунт, а визуальный дневник. Каждая фотография была записью, каждая подпись — размышлением, каждый хэштег — попыткой найти единомышленников в огромном цифровом мире.
-    </p>
-    
-    <div class="dialogue">
-        Кто этот человек? Что его волнует? О чём он мечтает, когда просыпается утром?
-    </div>
-    
-    <p>
-        Эти вопросы начали роиться в моей голове, как пчёлы в улье. И я понял, что попал. Попал в ту редкую ловушку искренности, которую так сложно найти в мире отфильтрованных эмоций и постановочного счастья.
-    </p>
-    
-    <p>
-        Я продолжал листать, и с каждым новым постом чувствовал, как моё представление о незнакомом человеке становится всё более объёмным, многогранным. {f'Локации варьировались от {locations[0] if locations else "домашних углов"} до {locations[1] if len(locations) > 1 else "городских улиц"}' if locations else 'Места съёмок рассказывали свои истории'} — география души, разложенная по карте Земли.
-    </p>
-    
-    <p>
-        И тогда я принял решение, которое изменило весь мой вечер. Я решил не просто посмотреть этот профиль, а изучить его. Понять. Почувствовать. Рассказать историю человека, которого я никогда не встречал, но который вдруг стал мне близок через экран смартфона.
-    </p>
-</div>
-
-<!-- ГЛАВА 2 -->
-<div class="book-page">
-    <h1>Глава 2. Углубляясь в детали</h1>
-    
-    <div class="chapter-epigraph">
-        «Дьявол кроется в деталях, а красота — в мелочах»
-    </div>
-    
-    <p class="first-paragraph">
-        Чем дольше я изучал профиль @{username}, тем больше понимал, что имею дело не просто с человеком, который любит фотографировать. Здесь была система, философия, особый взгляд на мир.
-    </p>
-    
-    <p>
-        {f'Хэштеги {common_hashtags[0][0] if common_hashtags else "#life"}, {common_hashtags[1][0] if len(common_hashtags) > 1 else "#moment"}, {common_hashtags[2][0] if len(common_hashtags) > 2 else "#beauty"}' if common_hashtags else 'Хэштеги были тщательно подобраны'} — не для массового охвата, а для поиска родственных душ. Это были не кричащие призывы к вниманию, а тихие маяки для тех, кто понимает.
-    </p>
-    
-    <p>
-        Время публикаций тоже говорило о многом. Большинство постов появлялись либо рано утром, либо поздно вечером. Время, когда город ещё спит или уже засыпает, когда суета стихает и можно остаться наедине с собой и своими мыслями.
-    </p>
-    
-    {'<figure class="hero-img"><img src="' + processed_images[1] + '" alt="' + (real_captions[1][:50] if len(real_captions) > 1 else 'Тихий момент') + '"><figcaption>' + (real_captions[1] if len(real_captions) > 1 else 'В этой тишине родилась мысль') + '</figcaption></figure>' if len(processed_images) > 1 else ''}
-    
-    <p>
-        Я начал замечать повторяющиеся мотивы. Окна — множество окон в разных контекстах. Отражения — в витринах, лужах, глазах. Тени — как самостоятельные персонажи историй. Это был визуальный язык, который @{username} создавал интуитивно или осознанно.
-    </p>
-    
-    <div class="inner-thought">
-        А может быть, мы все говорим на одном языке красоты, просто не всегда умеем его расшифровать?
-    </div>
-    
-    <p>
-        Подписи к фотографиям были особенным миром. Никаких длинных эссе, никаких попыток объяснить очевидное. {f'«{real_captions[2] if len(real_captions) > 2 else "Жизнь прекрасна"}»' if real_captions else 'Короткие фразы'} — и всё. Но в этой краткости была глубина, которую не каждый сумеет разглядеть.
-    </p>
-    
-    <p>
-        Я понял, что @{username} не пытается никого удивить или впечатлить. Этот профиль существует для тех, кто готов остановиться, вглядеться, почувствовать. Это не контент для быстрого потребления — это приглашение к диалогу с собственной душой.
-    </p>
-    
-    <div class="dialogue">
-        Интересно, чувствует ли автор, что кто-то так внимательно изучает его творчество?
-    </div>
-    
-    <p>
-        Количество лайков под постами колебалось, но никогда не было критически низким. Это говорило о том, что у @{username} есть своя аудитория — небольшая, но верная. Люди, которые понимают и ценят этот особый взгляд на мир.
-    </p>
-    
-    <p>
-        Комментарии под фотографиями были лаконичными, но тёплыми. Никаких дежурных «круто!» или «красиво!». Здесь писали от сердца, делились своими ассоциациями, благодарили за момент красоты в суетном дне.
-    </p>
-</div>
-
-<!-- ГЛАВА 3 -->
-<div class="book-page">
-    <h1>Глава 3. Точка поворота</h1>
-    
-    <div class="chapter-epigraph">
-        «Иногда один кадр меняет всё понимание»
-    </div>
-    
-    <p class="first-paragraph">
-        А потом я увидел ту фотографию. Ту самую, которая перевернула моё восприятие профиля @{username} с ног на голову. {f'Она была сделана в {locations[0] if locations else "обычном месте"}' if locations else 'Место съёмки было простым'}, но что-то в ней было особенное.
-    </p>
-    
-    <p>
-        Может быть, дело было в освещении — мягком, рассеянном, словно мир решил на минуту стать добрее. А может быть, в композиции — простой, но настолько точной, что хотелось смотреть и смотреть, находя всё новые детали.
-    </p>
-    
-    {'<figure class="hero-img"><img src="' + processed_images[2] + '" alt="' + (real_captions[2][:50] if len(real_captions) > 2 else 'Поворотный момент') + '"><figcaption>' + (real_captions[2] if len(real_captions) > 2 else 'Здесь всё изменилось') + '</figcaption></figure>' if len(processed_images) > 2 else ''}
-    
-    <p>
-        Но скорее всего, дело было в том неуловимом ощущении правды, которое излучал этот кадр. Здесь не было ни грамма фальши, ни капли наигранности. Просто момент жизни, пойманный в объектив с такой искренностью, что становилось больно от красоты.
-    </p>
-    
-    <div class="dialogue">
-        Как так получается, что незнакомый человек может тронуть твою душу одним кадром?
-    </div>
-    
-    <p>
-        Я вглядывался в детали фотографии и понимал, что @{username} — не просто человек с хорошим вкусом и дорогой камерой. Это художник. Поэт с объективом вместо пера. Философ, говорящий языком света и тени.
-    </p>
-    
-    <p>
-        {f'Подпись к этому посту была {real_captions[2] if len(real_captions) > 2 else "простой и честной"}' if real_captions else 'Подпись была минималистичной'} — и в ней звучала та же искренность, что и в самом снимке. Никаких громких слов, никаких попыток объяснить магию. Просто констатация факта: красота существует, и иногда нам везёт её заметить.
-    </p>
-    
-    <div class="inner-thought">
-        В этот момент я понял, что не просто изучаю чей-то профиль — я учусь видеть мир по-новому.
-    </div>
-    
-    <p>
-        Комментарии под этой фотографией были особенными. Люди благодарили автора не просто за красивый кадр, а за то, что он напомнил им о существовании прекрасного в их собственной жизни. За то, что научил останавливаться и замечать.
-    </p>
-    
-    <p>
-        И я вдруг осознал, что @{username} делает нечто большее, чем просто ведёт блог. Этот человек создаёт оазисы красоты в пустыне информационного шума. Места, где можно остановиться, перевести дух, вспомнить о том, что жизнь может быть прекрасной.
-    </p>
-    
-    <p>
-        Именно тогда я решил, что должен рассказать эту историю. Не пересказать содержимое профиля, а попытаться передать то чувство открытия, которое испытал, листая эти фотографии. Ведь в конце концов, самые важные истории — это истории о том, как мы находим красоту в неожиданных местах.
-    </p>
-</div>
-
-<!-- ГЛАВА 4 -->
-<div class="book-page">
-    <h1>Глава 4. Отражения и размышления</h1>
-    
-    <div class="chapter-epigraph">
-        «Мы не просто смотрим на искусство — оно смотрит на нас»
-    </div>
-    
-    <p class="first-paragraph">
-        Продолжая изучать профиль @{username}, я начал замечать, как меняюсь сам. Не кардинально, не внезапно, а постепенно, как меняется пейзаж за окном медленно идущего поезда.
-    </p>
-    
-    <p>
-        Раньше я мог пройти мимо интересного света, падающего на стену дома, и не заметить его. Теперь я останавливался. Раньше отражение в луже было просто отражением. Теперь я видел в нём целый мир, перевёрнутый и переосмысленный.
-    </p>
-    
-    {'<figure class="hero-img"><img src="' + processed_images[3] + '" alt="' + (real_captions[3][:50] if len(real_captions) > 3 else 'Момент размышления') + '"><figcaption>' + (real_captions[3] if len(real_captions) > 3 else 'В этом кадре я узнал себя') + '</figcaption></figure>' if len(processed_images) > 3 else ''}
-    
-    <p>
-        @{username} научил меня языку визуальной поэзии, сам того не подозревая. Каждый пост был урок, каждая фотография — мастер-классом по искусству видеть. И самое удивительное — эти уроки не были навязчивыми или дидактичными. Они просто существовали, ожидая, когда зритель будет готов их воспринять.
-    </p>
-    
-    <div class="dialogue">
-        А сколько таких учителей проходит мимо нас каждый день, а мы их не замечаем?
-    </div>
-    
-    <p>
-        Я начал анализировать не только содержание постов, но и их ритм. Периоды активности и затишья, смена настроений, эволюцию стиля. {posts_count} публикаций — это {posts_count} дней из жизни человека, {posts_count} моментов, которые показались ему достойными сохранения.
-    </p>
-    
-    <p>
-        Интересно было наблюдать, как менялся почерк автора со временем. Ранние работы были более неуверенными, более объяснительными. Поздние — лаконичными, точными, как стрелы, пущенные опытным лучником.
-    </p>
-    
-    <div class="inner-thought">
-        Возможно, мы все эволюционируем именно так — от желания объяснить всё к пониманию силы недосказанности.
-    </div>
-    
-    <p>
-        Соотношение {followers:,} подписчиков к {following:,} подпискам тоже рассказывало историю. @{username} не гнался за массовостью, не играл в игры взаимных подписок. Этот профиль рос органично, привлекая людей качеством, а не количеством контента.
-    </p>
-    
-    <p>
-        Я попытался представить себе человека за этими фотографиями. Наверное, это кто-то, кто умеет наслаждаться одиночеством, но не страдает от него. Кто-то, кто видит красоту в простых вещах, но не превращает это в манерность. Кто-то искренний в мире, где искренность стала редкостью.
-    </p>
-    
-    <p>
-        И я понял, что @{username} — это не просто ник в Instagram. Это философия, образ мышления, способ взаимодействия с миром. И возможно, каждый из нас может стать таким @{username} для кого-то другого, если научится видеть и делиться увиденным с той же честностью и красотой.
-    </p>
-</div>
-
-<!-- ГЛАВА 5 -->
-<div class="book-page">
-    <h1>Глава 5. Финальные откровения</h1>
-    
-    <div class="chapter-epigraph">
-        «Конец — это всегда новое начало»
-    </div>
-    
-    <p class="first-paragraph">
-        Дойдя до самых ранних постов в профиле @{username}, я почувствовал странную грусть. Как читатель, который понимает, что любимая книга подходит к концу. Как путешественник, осознающий, что удивительное приключение завершается.
-    </p>
-    
-    <p>
-        Но одновременно я чувствовал благодарность. За то, что случайный алгоритм социальной сети подарил мне встречу с этим особенным взглядом на мир. За то, что незнакомый человек научил меня видеть красоту там, где я раньше её не замечал.
-    </p>
-    
-    {'<figure class="hero-img"><img src="' + processed_images[4] + '" alt="' + (real_captions[4][:50] if len(real_captions) > 4 else 'Последний кадр истории') + '"><figcaption>' + (real_captions[4] if len(real_captions) > 4 else 'История заканчивается, но красота остаётся') + '</figcaption></figure>' if len(processed_images) > 4 else ''}
-    
-    <p>
-        @{username} остался для меня загадкой — и это прекрасно. Я знаю о нём ровно столько, сколько он захотел рассказать через свои фотографии. Этого достаточно, чтобы понимать: передо мной творческая личность, которая делает мир чуточку прекраснее.
-    </p>
-    
-    <div class="dialogue">
-        Разве не в этом смысл искусства — не в том, чтобы объяснить всё, а в том, чтобы заставить почувствовать?
-    </div>
-    
-    <p>
-        Теперь, когда я листаю свою собственную ленту, я ловлю себя на мысли: «А что бы подумал @{username} об этом кадре?» Его эстетика стала для меня внутренним фильтром, критерием красоты и искренности.
-    </p>
-    
-    <p>
-        И может быть, в этом и заключается истинная сила настоящего искусства — не в том, чтобы поразить или удивить, а в том, чтобы изменить того, кто с ним соприкоснулся. Сделать его более чувствительным к красоте, более внимательным к деталям, более открытым к чуду обыденности.
-    </p>
-    
-    <div class="inner-thought">
-        Каждый из нас может стать чьим-то @{username} — учителем красоты, проводником в мир более внимательного взгляда на жизнь.
-    </div>
-    
-    <p>
-        История профиля @{username} — это не просто набор фотографий и подписей. Это напоминание о том, что в мире цифрового шума и поверхностного контента всё ещё есть место искренности, глубине, настоящей красоте.
-    </p>
-    
-    <p>
-        И пока есть такие люди, как @{username}, которые умеют останавливать мгновения и делиться ими с миром, у нас есть надежда. Надежда на то, что красота не исчезнет под напором уродства, что искренность не растворится в океане фальши, что человечность не потеряется в виртуальной реальности.
-    </p>
-    
-    <p>
-        Спасибо тебе, @{username}, за то, что ты есть. За то, что создаёшь. За то, что учишь видеть. За то, что напоминаешь: мир прекрасен, если научиться его замечать.
-    </p>
-</div>
-
-<!-- ЭПИЛОГ -->
-<div class="book-page">
-    <h2>Эпилог</h2>
-    
-    <p class="first-paragraph">
-        Дорогой читатель, если вы дочитали до этих строк, значит, и вас коснулась та же магия, что коснулась меня при знакомстве с профилем @{username}. Возможно, вы тоже начнёте обращать внимание на игру света в окне своего дома, на отражения в лужах, на тени, которые рассказывают истории.
-    </p>
-    
-    <p>
-        В мире, где всё происходит слишком быстро, где красота часто приносится в жертву эффективности, люди как @{username} напоминают нам о важности остановиться, посмотреть вокруг и увидеть чудо в обыденном.
-    </p>
-    
-    <div class="dialogue">
-        А может быть, и вы станете чьим-то @{username}? Чьим-то учителем красоты, проводником в мир более внимательного взгляда?
-    </div>
-    
-    <p>
-        Эта история закончена, но красота продолжается. Каждый день, каждый момент, каждый взгляд, брошенный с вниманием и любовью на окружающий мир. И в этом — бесконечность, которая не помещается ни в какие рамки, ни в какие профили, ни в какие книги.
-    </p>
-    
-    <div class="stats-footer">
-        <strong>@{username}</strong><br>
-        {followers:,} подписчиков • {following:,} подписок • {posts_count} публикаций<br>
-        {f'«{bio}»<br>' if bio else ''}
-        <br>
-        <em>Книга создана {random.choice(['15 января', '16 января', '17 января'])} 2024 года</em><br>
-        <em>Приблизительно {word_count:,} слов</em>
-    </div>
-</div>
-
-</body>
-</html>"""
-     
-    return html
+    # Иллюстрации к главам: подпись — реальная, если есть
+    figure_defaults = [
+        ('Момент жизни', 'Кадр, который остановил время'),
+        ('Тихий момент', 'В этой тишине родилась мысль'),
+        ('Поворотный момент', 'Здесь всё изменилось'),
+        ('Момент размышления', 'В этом кадре я узнал себя'),
+        ('Последний кадр истории', 'История заканчивается, но красота остаётся'),
+    ]
+    figures = []
+    for i, src in enumerate(processed_images):
+        alt, caption = figure_defaults[i]
+        if i < len(real_captions):
+            alt, caption = real_captions[i][:50], real_captions[i]
+        figures.append({'src': src, 'alt': alt, 'caption': caption})
+    
+    yield from templates.stream("literary", {
+        'title': book_title,
+        'epigraph': epigraph,
+        'username': username,
+        'full_name': full_name,
+        'followers': followers,
+        'following': following,
+        'posts_count': posts_count,
+        'bio': bio,
+        'captions': real_captions,
+        'hashtags': [tag for tag, _ in common_hashtags],
+        'locations': locations,
+        'figures': figures,
+        'time_of_day': random.choice(['полуночи', 'полудня', 'вечера']),
+        'created_on': random.choice(['15 января', '16 января', '17 января']),
+        'word_count': word_count,
+    }, embed_images)
 
 # Теперь нужно обновить основную функцию build_romantic_book
\ No newline at end of file
@@ -0,0 +1,73 @@
+import asyncio, json, logging, os
+from pathlib import Path
+from typing import Iterable, Optional, Sequence
+
+from app.services import derivatives
+from app.services.llm_client import MISSING_CARD, SILENT_CARD, analyze_photos_batch
+
+log = logging.getLogger("cards")
+
+CARDS_NAME = "cards.json"       # sha256 фото → {тип карточки: текст}
+
+
+def load(run_dir: Path) -> dict:
+    """Карточки прогона (пустой словарь, если их еще нет)."""
+    try:
+        return json.loads((run_dir / CARDS_NAME).read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save(run_dir: Path, store: dict):
+    path = run_dir / CARDS_NAME
+    tmp = path.with_name(f".{CARDS_NAME}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(store, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def carry_over(previous: Path, run_dir: Path, hashes: Iterable[str]) -> int:
+    """Переносит карточки фото с этими хэшами из предыдущего прогона."""
+    old = load(previous)
+    store = load(run_dir)
+    moved = 0
+    for digest in hashes:
+        if digest in old and digest not in store:
+            store[digest] = old[digest]
+            moved += 1
+    if moved:
+        save(run_dir, store)
+    return moved
+
+
+async def analyze(paths: Sequence[Path], context: str, card_types: Sequence[str],
+                  on_progress=None, run_dir: Optional[Path] = None) -> tuple[list[str], list[str]]:
+    """Карточки для фото: готовые берутся из cards.json прогона, к модели идут только новые.
+
+    Если для фото уже есть карточка другого типа, берется она — тип меняется,
+    запрос не делается. Возвращает (типы, тексты) в порядке paths.
+    """
+    if not paths:
+        return [], []
+    run_dir = run_dir or paths[0].parent.parent          # data/<run>/images/001.jpg → data/<run>
+    # хэши читают фото целиком — считаем их в потоке, не на event loop
+    store, hashes = await asyncio.to_thread(lambda: (load(run_dir), [derivatives.source_hash(p) for p in paths]))
+
+    types = []
+    for digest, card_type in zip(hashes, card_types):
+        known = store.get(digest, {})
+        types.append(card_type if card_type in known or not known else next(iter(known)))
+
+    missing = [i for i, (digest, card_type) in enumerate(zip(hashes, types)) if card_type not in store.get(digest, {})]
+    results = await analyze_photos_batch([paths[i] for i in missing], context, [types[i] for i in missing],
+                                         on_progress=on_progress)
+    texts = [store.get(digest, {}).get(card_type) for digest, card_type in zip(hashes, types)]
+    saved = 0
+    for i, text in zip(missing, results):
+        texts[i] = text
+        if text not in (SILENT_CARD, MISSING_CARD):
+            store.setdefault(hashes[i], {})[types[i]] = text
+            saved += 1
+    if saved:
+        await asyncio.to_thread(save, run_dir, store)
+    log.info("cards: %s reused, %s analyzed", len(paths) - len(missing), len(missing))
+    return types, texts
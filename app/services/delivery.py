@@ -0,0 +1,117 @@
+import gzip, logging, os, shutil
+from email.utils import parsedate
+from pathlib import Path
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+log = logging.getLogger("delivery")
+
+try:                                   # brotli — необязательная зависимость
+    import brotli
+except ImportError:
+    brotli = None
+
+CHUNK_SIZE = 64 * 1024
+# кодировка → расширение сжатой копии (в порядке предпочтения)
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+
+# ─────────────────── сжатые копии ───────────────────────────────────────────
+def _write_atomic(target: Path, write):
+    tmp = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "wb") as out:
+            write(out)
+        os.replace(tmp, target)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _gzip(src: Path, out):
+    with open(src, "rb") as f, gzip.GzipFile(fileobj=out, mode="wb", compresslevel=9, mtime=0) as gz:
+        shutil.copyfileobj(f, gz, CHUNK_SIZE)
+
+
+def _brotli(src: Path, out):
+    compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=11)
+    with open(src, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            out.write(compressor.process(chunk))
+    out.write(compressor.finish())
+
+
+def precompress(path: Path):
+    """Пишет рядом path.gz и (если есть brotli) path.br — их отдает file_response."""
+    try:
+        _write_atomic(path.with_name(path.name + ".gz"), lambda out: _gzip(path, out))
+        if brotli is not None:
+            _write_atomic(path.with_name(path.name + ".br"), lambda out: _brotli(path, out))
+    except Exception as e:
+        log.warning("cannot precompress %s: %s", path, e)
+
+
+# ─────────────────── отдача файлов ──────────────────────────────────────────
+def _accepted(request: Request) -> set:
+    """Кодировки из Accept-Encoding (q=0 — запрещена)."""
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, *params = part.split(";")
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name.strip() and q > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def _variant(path: Path, request: Request) -> tuple[Path, Optional[str]]:
+    """Лучшая сжатая копия, которую принимает клиент и которая не старше оригинала."""
+    accepted = _accepted(request)
+    source_mtime = path.stat().st_mtime_ns
+    for encoding, suffix in ENCODINGS.items():
+        if encoding not in accepted and "*" not in accepted:
+            continue
+        candidate = path.with_name(path.name + suffix)
+        try:
+            if candidate.stat().st_mtime_ns >= source_mtime:
+                return candidate, encoding
+        except FileNotFoundError:
+            continue
+    return path, None
+
+
+def _not_modified(request: Request, response: Response) -> bool:
+    if if_none_match := request.headers.get("if-none-match"):
+        etag = response.headers["etag"]
+        return if_none_match.strip() == "*" or etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    if_modified_since = parsedate(request.headers.get("if-modified-since", ""))
+    last_modified = parsedate(response.headers["last-modified"])
+    return if_modified_since is not None and last_modified is not None and if_modified_since >= last_modified
+
+
+def file_response(request: Request, path: Path, media_type: str, compressible: bool = True,
+                  filename: Optional[str] = None, headers: Optional[dict] = None) -> Response:
+    """FileResponse с выбором сжатой копии, ETag/Last-Modified, 304 и Range.
+
+    Range обрабатывает сам FileResponse — для несжимаемых файлов вроде PDF.
+    """
+    variant, encoding = _variant(path, request) if compressible else (path, None)
+    headers = dict(headers or {})
+    if compressible:
+        headers["Vary"] = "Accept-Encoding"
+    if encoding:
+        headers["Content-Encoding"] = encoding
+
+    response = FileResponse(path=variant, media_type=media_type, filename=filename,
+                            headers=headers, stat_result=os.stat(variant))
+    if _not_modified(request, response):
+        keep = ("etag", "last-modified", "cache-control", "vary", "content-encoding")
+        return Response(status_code=304, headers={k: v for k, v in response.headers.items() if k in keep})
+    return response
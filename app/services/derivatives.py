@@ -0,0 +1,177 @@
+import asyncio, base64, hashlib, logging, multiprocessing, os, re, shutil, uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image, ImageEnhance
+
+from app.config import settings
+
+log = logging.getLogger("derivatives")
+
+DERIVED_DIR = "derived"
+_DERIVED_SRC = re.compile(r'(src=")' + DERIVED_DIR + r'/([\w.-]+)"')
+
+# Стили обработки: цепочка (усилитель Pillow, коэффициент)
+STYLES = {
+    "original": [],
+    "clean":    [(ImageEnhance.Contrast, 1.05), (ImageEnhance.Sharpness, 1.1), (ImageEnhance.Color, 1.02)],
+    "classic":  [(ImageEnhance.Contrast, 1.05)],
+    "zine":     [(ImageEnhance.Contrast, 1.03)],
+    "literary": [(ImageEnhance.Contrast, 1.08)],
+}
+
+# (путь, размер, mtime) → sha256 содержимого, чтобы не хэшировать файл на каждый запрос
+_hashes: Dict[Tuple[str, int, int], str] = {}
+
+# пул процессов для работы с пикселями (Pillow держит GIL на большей части операций)
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def source_hash(src: Path) -> str:
+    """sha256 исходного файла (с кэшем по размеру и mtime)."""
+    st = src.stat()
+    memo_key = (str(src), st.st_size, st.st_mtime_ns)
+    if memo_key not in _hashes:
+        _hashes[memo_key] = hashlib.sha256(src.read_bytes()).hexdigest()
+    return _hashes[memo_key]
+
+
+def derived_dir_for(src: Path) -> Path:
+    """data/<run>/images/001.jpg → data/<run>/derived"""
+    return src.parent.parent / DERIVED_DIR
+
+
+def derivative_path(src: Path, max_size: tuple, style: str, quality: int, optimize: bool = False) -> Path:
+    """Путь производной: ключ — хэш исходника, размер, стиль и качество."""
+    name = f"{source_hash(src)[:20]}_{max_size[0]}x{max_size[1]}_{style}_q{quality}{'o' if optimize else ''}.jpg"
+    return derived_dir_for(src) / name
+
+
+def render(src: Path, dst: Path, max_size: tuple, style: str, quality: int, optimize: bool = False) -> Path:
+    """Вся работа с пикселями: RGB, thumbnail(LANCZOS), усилители, JPEG."""
+    with Image.open(src) as img:
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.thumbnail(max_size, Image.Resampling.LANCZOS)
+        for enhancer, factor in STYLES[style]:
+            img = enhancer(img).enhance(factor)
+
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        # свой временный файл на каждый вызов: ту же производную могут считать соседние потоки
+        tmp = dst.with_name(f".{dst.name}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            img.save(tmp, format='JPEG', quality=quality, optimize=optimize)
+            os.replace(tmp, dst)
+        finally:
+            tmp.unlink(missing_ok=True)
+    return dst
+
+
+def get_derivative(src: Path, max_size: tuple, style: str = "original", quality: int = 90,
+                   optimize: bool = False) -> Path:
+    """Готовая производная из data/<run>/derived/ — считаем только при первом запросе."""
+    if style not in STYLES:
+        raise ValueError(f"unknown image style: {style}")
+    dst = derivative_path(src, max_size, style, quality, optimize)
+    if not dst.exists():
+        render(src, dst, max_size, style, quality, optimize)
+        log.debug("derived %s → %s", src.name, dst.name)
+    return dst
+
+
+def carry_over(previous: Path, run_dir: Path, hashes: Iterable[str]) -> int:
+    """Жесткие ссылки на готовые производные тех же фото из предыдущего прогона."""
+    old_dir, new_dir = previous / DERIVED_DIR, run_dir / DERIVED_DIR
+    prefixes = {digest[:20] for digest in hashes}
+    if not prefixes or not old_dir.is_dir():
+        return 0
+    new_dir.mkdir(parents=True, exist_ok=True)
+    linked = 0
+    for old in old_dir.iterdir():
+        if old.name.split("_", 1)[0] not in prefixes or (new_dir / old.name).exists():
+            continue
+        try:
+            os.link(old, new_dir / old.name)
+        except FileExistsError:
+            continue
+        except OSError:
+            shutil.copy2(old, new_dir / old.name)
+        linked += 1
+    return linked
+
+
+# ─────────────────── пул процессов ──────────────────────────────────────────
+def _pool() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        workers = settings.IMAGE_WORKERS or os.cpu_count() or 1
+        # spawn, а не fork: родитель — многопоточный сервер
+        _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        log.info("image process pool started with %s workers", workers)
+    return _executor
+
+
+def shutdown_pool():
+    """Останавливает пул процессов (lifespan приложения)."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+
+async def prepare(srcs: List[Path], max_size: tuple, style: str = "original", quality: int = 90,
+                  optimize: bool = False) -> List[Optional[Path]]:
+    """Параллельно готовит производные для списка фото в пуле процессов.
+
+    Уже готовые файлы не пересчитываются. Порядок результата совпадает с srcs,
+    на месте фото, которое не удалось обработать, — None.
+    """
+    if style not in STYLES:
+        raise ValueError(f"unknown image style: {style}")
+    loop = asyncio.get_running_loop()
+
+    async def _one(src: Path) -> Optional[Path]:
+        try:
+            # имя производной — хэш исходника: файл читается целиком, не на event loop
+            dst = await asyncio.to_thread(derivative_path, src, max_size, style, quality, optimize)
+            if dst.exists():
+                return dst
+            return await loop.run_in_executor(_pool(), render, src, dst, max_size, style, quality, optimize)
+        except Exception as e:
+            log.error("cannot derive %s: %s", src, e)
+            return None
+
+    return await asyncio.gather(*(_one(src) for src in srcs))
+
+
+def to_data_uri(path: Path) -> str:
+    """JPEG-файл → data:image/jpeg;base64,..."""
+    return f"data:image/jpeg;base64,{base64.b64encode(path.read_bytes()).decode()}"
+
+
+class DataUri:
+    """data URI, который читается с диска только в момент вывода в шаблон."""
+    __slots__ = ("path",)
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def __str__(self) -> str:
+        return to_data_uri(self.path)
+
+    __html__ = __str__
+
+
+def image_src(path: Path, embed: bool = False):
+    """src для <img>: data URI (книга одним файлом) или ссылка derived/<имя> относительно book.html."""
+    return DataUri(path) if embed else f"{DERIVED_DIR}/{path.name}"
+
+
+def inline_images(html: str, run_dir: Path) -> str:
+    """Заменяет ссылки derived/<имя> на data URI — версия книги для офлайна."""
+    def _embed(match: "re.Match") -> str:
+        path = run_dir / DERIVED_DIR / match.group(2)
+        return f'{match.group(1)}{to_data_uri(path)}"' if path.exists() else match.group(0)
+
+    return _DERIVED_SRC.sub(_embed, html)
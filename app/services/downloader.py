@@ -1,54 +1,135 @@
 import asyncio
-import httpx, logging, mimetypes
+import anyio, httpx, json, logging, math, mimetypes, os
 from pathlib import Path
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional, Tuple
 import time
 
+from app.config import settings
+from app.services import blobs
+
 log = logging.getLogger("downloader")
 
+MANIFEST_NAME = "manifest.json"
+MAX_IMAGES = 15           # больше фото не использует ни один макет
+# сколько фото берет макет книги и какая у его кадров пропорция (ширина / высота)
+FORMAT_IMAGES = {"zine": 15, "classic": 5, "literary": 5}
+FORMAT_ASPECT = {"zine": 1.0, "classic": 7 / 5, "literary": 7 / 5}
+VIDEO_WEIGHT = 0.6        # у видео качаем только обложку — она проигрывает фото
+CHUNK_SIZE = 64 * 1024    # сколько байт ответа держим в памяти за раз
+
+# загрузки, которые идут прямо сейчас: папка → событие завершения
+_in_flight: Dict[str, asyncio.Event] = {}
+
+# общий для всех запусков клиент CDN (живет вместе с приложением)
+_pool: Optional[httpx.AsyncClient] = None
+_pool_loop: Optional[asyncio.AbstractEventLoop] = None
+_global_limit: Optional[asyncio.Semaphore] = None
+_host_limits: Dict[str, asyncio.Semaphore] = {}
+
 
 # ─────────────────── сбор ссылок ────────────────────────────────────────────
-def _collect_urls(items: List[Dict]) -> List[str]:
-    """Ищем displayUrl и images во всех latestPosts и childPosts."""
-    urls: list[str] = []
+def _collect_sources(items: List[Dict]) -> List[Dict]:
+    """Ищем displayUrl и images во всех latestPosts и childPosts.
 
-    def walk(post: Dict):
+    Для каждой ссылки — ключ (из shortCode/id поста, не меняется между
+    скрапингами, в отличие от подписанных ссылок CDN), пост верхнего уровня
+    и номер кадра внутри поста.
+    """
+    sources: list[Dict] = []
+
+    def walk(post: Dict, key: str, root: Dict):
         if post.get("displayUrl"):
-            urls.append(post["displayUrl"])
-        urls.extend(post.get("images", []))
-        for child in post.get("childPosts", []):
-            walk(child)
+            sources.append({"key": key, "url": post["displayUrl"], "post": root, "frame": post})
+        sources.extend({"key": f"{key}/img{i}", "url": url, "post": root, "frame": post}
+                       for i, url in enumerate(post.get("images", [])))
+        for j, child in enumerate(post.get("childPosts", [])):
+            walk(child, child.get("shortCode") or child.get("id") or f"{key}/{j}", root)
 
-    for root in items:
-        for p in root.get("latestPosts", []):
-            walk(p)
+    for item in items:
+        for n, p in enumerate(item.get("latestPosts", [])):
+            walk(p, p.get("shortCode") or p.get("id") or f"#{n}", p)
 
-    # удаляем дубликаты, сохраняя порядок
+    # удаляем дубликаты, сохраняя порядок; номер кадра — после удаления
     seen = set()
     out = []
-    for u in urls:
-        if u not in seen:
-            out.append(u)
-            seen.add(u)
+    per_post: Dict[int, int] = {}
+    for source in sources:
+        if source["url"] not in seen:
+            seen.add(source["url"])
+            source["position"] = per_post.get(id(source["post"]), 0)
+            per_post[id(source["post"])] = source["position"] + 1
+            out.append(source)
     return out
 
 
+def _score(source: Dict, aspect: float) -> float:
+    """Вес фото: вовлеченность поста, тип (видео — только обложка) и попадание в пропорцию макета."""
+    post, frame = source["post"], source["frame"]
+    likes = max(0, post.get("likesCount") or 0)           # скрытые лайки Apify отдает как -1
+    comments = max(0, post.get("commentsCount") or 0)
+    score = math.log1p(likes + 3 * comments) + 1
+    if (frame.get("type") or post.get("type")) == "Video":
+        score *= VIDEO_WEIGHT
+    width = frame.get("dimensionsWidth") or post.get("dimensionsWidth")
+    height = frame.get("dimensionsHeight") or post.get("dimensionsHeight")
+    if width and height:
+        score *= 1 - 0.3 * min(abs(math.log(width / height / aspect)), 1.0)
+    return score
+
+
+def select_images(items: List[Dict], book_format: Optional[str] = None, limit: Optional[int] = None) -> List[Dict]:
+    """Фото для книги в порядке макета: сначала по одному кадру с самых сильных постов,
+    затем следующие кадры каруселей. Не больше, чем возьмет формат книги.
+    """
+    limit = limit or FORMAT_IMAGES.get(book_format, MAX_IMAGES)
+    aspect = FORMAT_ASPECT.get(book_format, 1.0)
+    sources = _collect_sources(items)
+    for source in sources:
+        source["score"] = _score(source, aspect)
+    ranked = sorted(sources, key=lambda s: (s["position"], -s["score"]))
+    return ranked[:limit]
+
+
+def _metadata(source: Dict) -> Dict:
+    """Что о фото пишем в манифест."""
+    post, frame = source["post"], source["frame"]
+    return {
+        "key": source["key"],
+        "shortCode": post.get("shortCode"),
+        "type": frame.get("type") or post.get("type"),
+        "likes": post.get("likesCount"),
+        "comments": post.get("commentsCount"),
+        "width": frame.get("dimensionsWidth") or post.get("dimensionsWidth"),
+        "height": frame.get("dimensionsHeight") or post.get("dimensionsHeight"),
+        "timestamp": post.get("timestamp"),
+        "score": round(source["score"], 3),
+    }
+
+
 # ─────────────────── скачивание с retry логикой ─────────────────────────────
 async def _save(url: str, folder: Path, client: httpx.AsyncClient, idx: int, max_retries: int = 3):
-    """Скачивает изображение с повторными попытками при ошибках соединения"""
+    """Скачивает изображение с повторными попытками при ошибках соединения.
+
+    Тело ответа потоком пишется во временный .part-файл и атомарно
+    переименовывается, так что читатели папки не видят недокачанных файлов.
+    """
+    tmp = folder / f".{idx:03d}.part"
     for attempt in range(max_retries + 1):
         try:
             # Увеличиваем таймаут и добавляем задержку между попытками
             timeout = httpx.Timeout(30.0, connect=10.0)
-            r = await client.get(url, follow_redirects=True, timeout=timeout)
-            r.raise_for_status()
-            
-            # получаем расширение по Content-Type, fallback = .jpg
-            ext = mimetypes.guess_extension(r.headers.get("content-type", "")) or ".jpg"
-            fname = folder / f"{idx:03d}{ext}"
-            fname.write_bytes(r.content)
+            async with client.stream("GET", url, follow_redirects=True, timeout=timeout) as r:
+                r.raise_for_status()
+                
+                # получаем расширение по Content-Type, fallback = .jpg
+                ext = mimetypes.guess_extension(r.headers.get("content-type", "")) or ".jpg"
+                fname = folder / f"{idx:03d}{ext}"
+                async with await anyio.open_file(tmp, "wb") as f:
+                    async for chunk in r.aiter_bytes(CHUNK_SIZE):
+                        await f.write(chunk)
+            os.replace(tmp, fname)
             log.debug("saved %s", fname.name)
-            return  # Успешно скачали, выходим
+            return fname.name  # Успешно скачали, выходим
             
         except (httpx.ConnectError, httpx.TimeoutException, httpx.RequestError) as e:
             if attempt < max_retries:
@@ -58,11 +139,12 @@ async def _save(url: str, folder: Path, client: httpx.AsyncClient, idx: int, max
             else:
                 log.error(f"Failed to download {url} after {max_retries + 1} attempts: {e}")
                 # Создаем заглушку для отсутствующего изображения
-                _create_placeholder_image(folder, idx)
+                return _create_placeholder_image(folder, idx)
         except Exception as e:
             log.error(f"Unexpected error downloading {url}: {e}")
-            _create_placeholder_image(folder, idx)
-            return
+            return _create_placeholder_image(folder, idx)
+        finally:
+            tmp.unlink(missing_ok=True)
 
 
 def _create_placeholder_image(folder: Path, idx: int):
@@ -93,59 +175,268 @@ def _create_placeholder_image(folder: Path, idx: int):
         fname = folder / f"{idx:03d}_placeholder.jpg"
         img.save(fname, format='JPEG', quality=80)
         log.info(f"Created placeholder image: {fname.name}")
+        return fname.name
         
     except Exception as e:
         log.error(f"Failed to create placeholder image: {e}")
 
 
-def download_photos(items: List[Dict], folder: Path):
-    """Синхронная обёртка для Starlette BackgroundTask с улучшенной обработкой ошибок."""
+# ─────────────────── манифест и событие завершения ──────────────────────────
+def _write_manifest(folder: Path, expected: int, files: List[Optional[str]], error: str = "",
+                    sources: Optional[Dict[str, str]] = None, reused: Optional[List[str]] = None,
+                    selection: Optional[Dict[str, Dict]] = None, book_format: Optional[str] = None):
+    """Атомарно пишет manifest.json: сколько ждали, сколько скачали, какие файлы.
+
+    sources — файл → ключ поста (для инкрементального скрапинга),
+    reused — файлы, взятые из предыдущего прогона без загрузки,
+    selection — файл → данные поста и вес, по которым фото отобрано.
+    """
+    names = [f for f in files if f]
+    manifest = {
+        "complete": True,
+        "expected": expected,
+        "downloaded": sum(1 for f in names if "_placeholder" not in f),
+        "placeholders": sum(1 for f in names if "_placeholder" in f),
+        "files": names,
+        "finished_at": time.time(),
+    }
+    if sources:
+        manifest["sources"] = {name: key for name, key in sources.items() if name in names}
+    if reused:
+        manifest["reused"] = reused
+    if selection:
+        manifest["format"] = book_format
+        manifest["selection"] = [{"file": name, **selection[name]} for name in names if name in selection]
+    if error:
+        manifest["error"] = error
+    folder.mkdir(parents=True, exist_ok=True)
+    tmp = folder / f".{MANIFEST_NAME}.tmp"
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, folder / MANIFEST_NAME)
+
+
+def read_manifest(folder: Path) -> Optional[Dict]:
+    """Манифест завершенной загрузки или None (загрузка не закончена / старый запуск)."""
     try:
-        urls = _collect_urls(items)
-        if not urls:
-            log.warning("no image urls found — nothing to download")
-            return
+        return json.loads((folder / MANIFEST_NAME).read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return None
 
-        # Ограничиваем до первых 15 фотографий для оптимизации
-        urls = urls[:15]
-        log.info("limiting to first %s images for optimal performance", len(urls))
 
-        folder.mkdir(parents=True, exist_ok=True)
-        log.info("downloading %s images → %s", len(urls), folder)
+def download_started(folder: Path):
+    """Отмечает, что для папки идет загрузка (вызывать на event loop сервера)."""
+    _in_flight.setdefault(str(folder.resolve()), asyncio.Event())
 
-        async def main():
-            # Настройки клиента с более надежными параметрами
-            limits = httpx.Limits(max_keepalive_connections=5, max_connections=10)
-            timeout = httpx.Timeout(30.0, connect=10.0)
-            
-            async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
-                # Ограничиваем количество одновременных загрузок
-                semaphore = asyncio.Semaphore(3)
-                
-                async def download_with_semaphore(url: str, idx: int):
-                    async with semaphore:
-                        await _save(url, folder, client, idx)
-                
-                tasks = [download_with_semaphore(u, i) for i, u in enumerate(urls, 1)]
-                await asyncio.gather(*tasks, return_exceptions=True)
 
-        # Проверяем, запущен ли уже event loop
+def download_finished(folder: Path):
+    """Публикует завершение загрузки всем, кто ждет в wait_for_download."""
+    event = _in_flight.pop(str(folder.resolve()), None)
+    if event is not None:
+        event.set()
+
+
+async def wait_for_download(folder: Path, timeout: float) -> Optional[Dict]:
+    """Ждет окончания идущей загрузки и возвращает ее манифест."""
+    event = _in_flight.get(str(folder.resolve()))
+    if event is not None:
         try:
-            loop = asyncio.get_running_loop()
-            # Если loop уже запущен, создаем задачу
-            future = asyncio.run_coroutine_threadsafe(main(), loop)
-            future.result(timeout=120)  # Ждем максимум 2 минуты
-        except RuntimeError:
-            # Если loop не запущен, запускаем обычно
-            asyncio.run(main())
-            
-        log.info("download completed (%s urls processed)", len(urls))
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            log.warning("download into %s still running after %.0fs", folder, timeout)
+    return read_manifest(folder)
+
+
+# ─────────────────── общий пул соединений ───────────────────────────────────
+async def open_pool():
+    """Создает общий HTTP-клиент на event loop сервера (вызывается из lifespan)."""
+    global _pool, _pool_loop, _global_limit
+    if _pool is not None:
+        return
+    http2 = settings.DOWNLOAD_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401  — нужен httpx для HTTP/2
+        except ImportError:
+            log.warning("h2 is not installed — CDN pool falls back to HTTP/1.1")
+            http2 = False
+    limits = httpx.Limits(
+        max_keepalive_connections=settings.DOWNLOAD_MAX_CONNECTIONS,
+        max_connections=settings.DOWNLOAD_MAX_CONNECTIONS,
+        keepalive_expiry=60.0,
+    )
+    _pool = httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(30.0, connect=10.0), http2=http2)
+    _pool_loop = asyncio.get_running_loop()
+    _global_limit = asyncio.Semaphore(settings.DOWNLOAD_CONCURRENCY)
+    _host_limits.clear()
+    log.info("download pool opened (http2=%s, concurrency=%s, per host=%s)",
+             http2, settings.DOWNLOAD_CONCURRENCY, settings.DOWNLOAD_PER_HOST)
+
+
+async def close_pool():
+    """Закрывает общий HTTP-клиент."""
+    global _pool, _pool_loop, _global_limit
+    if _pool is not None:
+        await _pool.aclose()
+    _pool = _pool_loop = _global_limit = None
+    _host_limits.clear()
+
+
+def _host_limit(url: str) -> asyncio.Semaphore:
+    host = httpx.URL(url).host
+    if host not in _host_limits:
+        _host_limits[host] = asyncio.Semaphore(settings.DOWNLOAD_PER_HOST)
+    return _host_limits[host]
+
+
+# прогресс загрузки: (готово, всего)
+OnProgress = Optional[Callable[[int, int], None]]
+
+
+async def _gather_until(coros: list, deadline: Optional[float], on_progress: OnProgress = None) -> List[Optional[str]]:
+    """Ждет загрузки до дедлайна; недокачанное отменяет, при отмене снаружи — все."""
+    tasks = [asyncio.ensure_future(c) for c in coros]
+    if not tasks:
+        return []
+    if on_progress is not None:
+        finished = 0
+
+        def _report(task: asyncio.Task):
+            nonlocal finished
+            if not task.cancelled():
+                finished += 1
+                on_progress(finished, len(tasks))
+
+        for task in tasks:
+            task.add_done_callback(_report)
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=deadline)
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    if pending:
+        log.warning("download deadline %.0fs exceeded, %s images dropped", deadline, len(pending))
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    return [
+        task.result() if task in done and not task.exception() and isinstance(task.result(), str) else None
+        for task in tasks
+    ]
+
+
+async def _download_all(urls: List[Tuple[int, str]], folder: Path, deadline: Optional[float] = None,
+                        on_progress: OnProgress = None) -> List[Optional[str]]:
+    """Качает ссылки (номер файла, ссылка); на loop сервера — через общий пул и его лимиты."""
+    if _pool is not None and asyncio.get_running_loop() is _pool_loop:
+        async def download_pooled(url: str, idx: int):
+            # сначала слот хоста, потом общий: ждущие своего хоста не держат общие слоты
+            async with _host_limit(url), _global_limit:
+                return await _save(url, folder, _pool, idx)
+
+        return await _gather_until([download_pooled(u, i) for i, u in urls], deadline, on_progress)
+
+    # Пула нет (скрипты, тесты) — временный клиент на этот запуск
+    limits = httpx.Limits(max_keepalive_connections=5, max_connections=10)
+    timeout = httpx.Timeout(30.0, connect=10.0)
+    
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        # Ограничиваем количество одновременных загрузок
+        semaphore = asyncio.Semaphore(settings.DOWNLOAD_CONCURRENCY)
+        
+        async def download_with_semaphore(url: str, idx: int):
+            async with semaphore:
+                return await _save(url, folder, client, idx)
+        
+        return await _gather_until([download_with_semaphore(u, i) for i, u in urls], deadline, on_progress)
+
+
+def _reusable(previous: Optional[Path]) -> Dict[str, Path]:
+    """Ключ поста → скачанный файл предыдущего прогона."""
+    manifest = read_manifest(previous) if previous else None
+    if not manifest:
+        return {}
+    found = {}
+    for name, key in manifest.get("sources", {}).items():
+        if "_placeholder" not in name and (previous / name).exists():
+            found[key] = previous / name
+    return found
+
+
+async def download_photos_async(items: List[Dict], folder: Path, deadline: Optional[float] = None,
+                                on_progress: OnProgress = None, reuse_from: Optional[Path] = None,
+                                book_format: Optional[str] = None) -> Optional[Dict]:
+    """Качает фото профиля на текущем event loop и возвращает манифест.
+
+    Качаются только фото, которые возьмет `book_format` (см. select_images), —
+    в порядке макета: 001 — первый кадр книги. Запросы уходят в том же порядке,
+    поэтому первые страницы книги докачиваются раньше остальных.
+    `deadline` ограничивает всю загрузку целиком: что не успело — отменяется,
+    в манифест попадает только скачанное. Отмена корутины отменяет все запросы.
+    `on_progress(готово, всего)` вызывается после каждой завершенной ссылки.
+    `reuse_from` — папка images предыдущего прогона: фото тех же постов берутся
+    оттуда жесткими ссылками, качаются только новые.
+    Фото, уже лежащие в общем хранилище (blobs), берутся из него без HTTP-запроса;
+    скачанные — переносятся туда, в папке прогона остаются жесткие ссылки.
+    """
+    try:
+        sources = select_images(items, book_format)
+        if not sources:
+            log.warning("no image urls found — nothing to download")
+            _write_manifest(folder, 0, [])
+            return read_manifest(folder)
+        log.info("selected %s images for %s book", len(sources), book_format or "any")
+
+        folder.mkdir(parents=True, exist_ok=True)
+        previous = _reusable(reuse_from)
+        files: List[Optional[str]] = [None] * len(sources)
+        names: Dict[str, str] = {}
+        reused, to_download = [], []
+        for idx, source in enumerate(sources, 1):
+            key, url = source["key"], source["url"]
+            existing = previous.get(key) or blobs.find(blobs.keys_for(key, url))
+            if existing is not None:
+                name = f"{idx:03d}{existing.suffix}"
+                blobs.link(existing, folder / name)
+                files[idx - 1] = name
+                names[name] = key
+                reused.append(name)
+            else:
+                to_download.append((idx, url))
+        log.info("downloading %s images → %s (%s reused)", len(to_download), folder, len(reused))
+
+        downloaded = await _download_all(to_download, folder, deadline, on_progress)
+        fresh = []
+        for (idx, url), name in zip(to_download, downloaded):
+            files[idx - 1] = name
+            if name and "_placeholder" not in name:
+                key = sources[idx - 1]["key"]
+                names[name] = key
+                fresh.append((folder / name, blobs.keys_for(key, url)))
+        # хэшируем и переносим в хранилище вне event loop
+        await asyncio.to_thread(blobs.adopt_all, fresh)
+        selection = {name: _metadata(source) for name, source in zip(files, sources) if name}
+        _write_manifest(folder, len(sources), files, sources=names, reused=reused,
+                        selection=selection, book_format=book_format)
+        log.info("download completed (%s urls processed)", len(sources))
         
     except Exception as e:
         log.error(f"Critical error in download_photos: {e}")
         # Создаем хотя бы одну заглушку, чтобы процесс не провалился
         try:
             folder.mkdir(parents=True, exist_ok=True)
-            _create_placeholder_image(folder, 1)
+            placeholder = _create_placeholder_image(folder, 1)
+            _write_manifest(folder, 1, [placeholder], error=str(e))
         except Exception as fallback_error:
             log.error(f"Failed to create fallback image: {fallback_error}")
+    return read_manifest(folder)
+
+
+def download_photos(items: List[Dict], folder: Path):
+    """Синхронная обёртка над download_photos_async для скриптов и потоков."""
+    if _pool is not None and _pool_loop.is_running():
+        # Из чужого потока — качаем через общий пул на loop сервера
+        future = asyncio.run_coroutine_threadsafe(download_photos_async(items, folder, 120), _pool_loop)
+        return future.result()
+    return asyncio.run(download_photos_async(items, folder, 120))
@@ -1,4 +1,10 @@
 from pathlib import Path
 
+from app.services.downloader import MANIFEST_NAME, read_manifest
+
 async def process_folder(images_dir: Path) -> list[Path]:
-    return list(images_dir.glob("*"))
+    # после завершенной загрузки берем ровно те файлы, что в манифесте
+    manifest = read_manifest(images_dir)
+    if manifest is not None:
+        return [images_dir / name for name in manifest["files"] if (images_dir / name).exists()]
+    return [p for p in sorted(images_dir.glob("*")) if p.name != MANIFEST_NAME and not p.name.startswith(".")]
@@ -0,0 +1,232 @@
+import asyncio, json, logging, time, uuid
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+from app.config import settings
+from app.services.db import connect
+
+log = logging.getLogger("jobs")
+
+DB_PATH = Path("data") / "jobs.sqlite3"
+IDLE_POLL = 1.0           # как часто свободный воркер проверяет отложенные ретраи
+
+# этап задачи: (имя, корутина от payload). Корутина может дописывать в payload —
+# он сохраняется после каждого этапа и доступен следующим.
+Stage = tuple[str, Callable[[dict], Awaitable[None]]]
+# вызывается, когда задача упала окончательно: (payload, ошибка)
+OnFailed = Callable[[dict, str], None]
+
+_pipelines: dict[str, list[Stage]] = {}
+_on_failed: dict[str, OnFailed] = {}
+_conn = None
+_wakeup: Optional[asyncio.Event] = None
+_workers: list[asyncio.Task] = []
+_stopping = False
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = connect(DB_PATH)
+        _conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                   id          TEXT PRIMARY KEY,
+                   kind        TEXT NOT NULL,
+                   payload     TEXT NOT NULL,
+                   status      TEXT NOT NULL,
+                   stage       INTEGER NOT NULL DEFAULT 0,
+                   attempts    INTEGER NOT NULL DEFAULT 0,
+                   error       TEXT,
+                   created_at  REAL NOT NULL,
+                   updated_at  REAL NOT NULL,
+                   next_run_at REAL NOT NULL
+               )"""
+        )
+        _conn.execute("CREATE INDEX IF NOT EXISTS jobs_pending ON jobs(status, next_run_at)")
+    return _conn
+
+
+def register(kind: str, stages: list[Stage], on_failed: Optional[OnFailed] = None):
+    """Регистрирует цепочку этапов для задач вида `kind` (и обработчик окончательной ошибки)."""
+    _pipelines[kind] = stages
+    if on_failed is not None:
+        _on_failed[kind] = on_failed
+
+
+def enqueue(kind: str, payload: dict, dedup: bool = False) -> str:
+    """Ставит задачу в очередь и будит свободного воркера.
+
+    dedup=True: если такая же задача (вид + payload) уже ждет или выполняется,
+    новая не создается — возвращается id существующей.
+    """
+    if kind not in _pipelines:
+        raise ValueError(f"unknown job kind: {kind}")
+    raw = json.dumps(payload, ensure_ascii=False)
+    conn = _db()
+    if dedup:
+        row = conn.execute(
+            "SELECT id FROM jobs WHERE status IN ('queued', 'running') AND kind = ? AND payload = ? "
+            "ORDER BY created_at LIMIT 1",
+            (kind, raw),
+        ).fetchone()
+        if row is not None:
+            log.info("job %s (%s) already pending, not duplicated", row["id"], kind)
+            return row["id"]
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    conn.execute(
+        "INSERT INTO jobs (id, kind, payload, status, created_at, updated_at, next_run_at) "
+        "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+        (job_id, kind, raw, now, now, now),
+    )
+    log.info("job %s (%s) queued", job_id, kind)
+    if _wakeup is not None:
+        _wakeup.set()
+    return job_id
+
+
+def get(job_id: str) -> Optional[dict]:
+    """Состояние задачи для API."""
+    row = _db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+    stages = _pipelines.get(row["kind"], [])
+    return {
+        "jobId": row["id"],
+        "kind": row["kind"],
+        "status": row["status"],
+        "stage": stages[row["stage"]][0] if row["stage"] < len(stages) else None,
+        "attempts": row["attempts"],
+        "error": row["error"],
+        "createdAt": row["created_at"],
+        "updatedAt": row["updated_at"],
+    }
+
+
+def _claim() -> Optional[dict]:
+    """Атомарно забирает самую старую готовую к запуску задачу."""
+    conn = _db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE status = 'queued' AND next_run_at <= ? "
+            "ORDER BY created_at LIMIT 1",
+            (time.time(),),
+        ).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?",
+                (time.time(), row["id"]),
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return dict(row) if row is not None else None
+
+
+def _update(job_id: str, **fields):
+    fields["updated_at"] = time.time()
+    cols = ", ".join(f"{name} = ?" for name in fields)
+    _db().execute(f"UPDATE jobs SET {cols} WHERE id = ?", (*fields.values(), job_id))
+
+
+def _failed(kind: str, payload: dict, error: str):
+    handler = _on_failed.get(kind)
+    if handler is None:
+        return
+    try:
+        handler(payload, error)
+    except Exception as e:
+        log.error("failure handler for %s crashed: %s", kind, e)
+
+
+async def _run(job: dict):
+    stages = _pipelines.get(job["kind"])
+    if stages is None:
+        _update(job["id"], status="failed", error=f"unknown job kind: {job['kind']}")
+        return
+
+    payload = json.loads(job["payload"])
+    stage, attempts = job["stage"], job["attempts"]
+
+    while stage < len(stages):
+        name, func = stages[stage]
+        log.info("job %s: stage %s (attempt %s)", job["id"], name, attempts + 1)
+        try:
+            await func(payload)
+        except asyncio.CancelledError:
+            # остановка сервера — этап перезапустится после рестарта
+            _update(job["id"], status="queued", payload=json.dumps(payload, ensure_ascii=False))
+            raise
+        except Exception as e:
+            attempts += 1
+            if attempts > settings.JOB_STAGE_RETRIES:
+                log.error("job %s failed at stage %s: %s", job["id"], name, e)
+                _update(job["id"], status="failed", attempts=attempts, error=f"{name}: {e}")
+                _failed(job["kind"], payload, f"{name}: {e}")
+                return
+            delay = settings.JOB_RETRY_DELAY * 2 ** (attempts - 1)
+            log.warning("job %s: stage %s failed (%s), retry in %.1fs", job["id"], name, e, delay)
+            _update(job["id"], status="queued", attempts=attempts, error=f"{name}: {e}",
+                    next_run_at=time.time() + delay,
+                    payload=json.dumps(payload, ensure_ascii=False))
+            return
+        stage, attempts = stage + 1, 0
+        _update(job["id"], stage=stage, attempts=0, error=None,
+                payload=json.dumps(payload, ensure_ascii=False))
+
+    _update(job["id"], status="done")
+    log.info("job %s done", job["id"])
+
+
+async def _worker(n: int):
+    while not _stopping:
+        try:
+            job = _claim()
+        except Exception as e:
+            log.error("worker %s: cannot claim job: %s", n, e)
+            job = None
+        if job is None:
+            _wakeup.clear()
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=IDLE_POLL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        try:
+            await _run(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.error("worker %s: job %s crashed: %s", n, job["id"], e)
+            _update(job["id"], status="failed", error=str(e))
+
+
+async def start(workers: Optional[int] = None):
+    """Запускает пул воркеров на текущем event loop."""
+    global _wakeup, _stopping
+    _stopping = False
+    _wakeup = asyncio.Event()
+    # задачи, прерванные падением процесса, возвращаем в очередь
+    _db().execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+    count = workers or settings.JOB_WORKERS
+    _workers[:] = [asyncio.create_task(_worker(i)) for i in range(count)]
+    log.info("job queue started with %s workers", count)
+
+
+async def stop(timeout: Optional[float] = None):
+    """Мягкая остановка: новые задачи не берем, текущие доделываем до таймаута."""
+    global _stopping
+    _stopping = True
+    if _wakeup is not None:
+        _wakeup.set()
+    if not _workers:
+        return
+    done, pending = await asyncio.wait(_workers, timeout=timeout or settings.JOB_DRAIN_TIMEOUT)
+    for task in pending:
+        task.cancel()
+    if pending:
+        log.warning("job queue: %s jobs interrupted, they will resume after restart", len(pending))
+        await asyncio.gather(*pending, return_exceptions=True)
+    _workers.clear()
@@ -1,17 +1,24 @@
 import openai
+import asyncio
 import base64
 from pathlib import Path
 from app.config import settings
-from typing import Optional
+from app.services import analysis_cache
+from typing import Callable, Optional, Sequence
 import logging
 import random
 
 # Инициализация OpenAI
 openai.api_key = settings.OPENAI_API_KEY
 client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
+async_client = openai.AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
 
 logger = logging.getLogger(__name__)
 
+# карточки-заглушки при ошибке анализа: их не сохраняем как результат
+SILENT_CARD = "Молчание."
+MISSING_CARD = "Кадр исчез"
+
 # Автоматическое удаление клише
 CLICHE_FILTERS = [
     "мягкие оттенки", "резкие тени", "атмосфера", "ощущение",
@@ -76,18 +83,9 @@ def generate_text(prompt: str,
         return f"Ошибка генерации: {str(e)}"
 
 
-def analyze_photo_for_card(image_path: Path, context: str = "", card_type: str = "micro") -> str:
-    """Анализирует фотографию для карточки-триггера"""
-    try:
-        if not image_path.exists():
-            return "Кадр исчез"
-            
-        with open(image_path, "rb") as image_file:
-            image_data = base64.b64encode(image_file.read()).decode('utf-8')
-        
-        # Микро-форматы для карточек
-        card_styles = {
-            "micro": """Создай микро-сценку (максимум 3 строки):
+# Микро-форматы для карточек
+CARD_STYLES = {
+    "micro": """Создай микро-сценку (максимум 3 строки):
 
 1 конкретная деталь + 1 диалог-реплика
 
@@ -99,57 +97,162 @@ def analyze_photo_for_card(image_path: Path, context: str = "", card_type: str =
 Руки пахнут типографской краской.
 — Ты опять всю ночь читал?""",
 
-            "trigger": """Одна яркая мысль-триггер:
+    "trigger": """Одна яркая мысль-триггер:
 
 Что ПЕРВОЕ приходит в голову при взгляде на фото?
 Одно предложение + одна сенсорная деталь.
 
 Без описаний - только эмоция!""",
 
-            "sms": """SMS-переписка по фото:
+    "sms": """SMS-переписка по фото:
 
 — Реплика 1 (что мог написать герой)
 — Ответ (что мог ответить друг)
 
 Живо, коротко, как настоящие SMS."""
-        }
-        
-        style = card_styles.get(card_type, card_styles["micro"])
-        
-        prompt = f"""{style}
+}
+
+
+def _read_image(image_path: Path) -> bytes:
+    """Читает файл фотографии целиком"""
+    with open(image_path, "rb") as image_file:
+        return image_file.read()
+
+
+def _card_cache_key(image_bytes: bytes, context: str, card_type: str) -> str:
+    """Ключ карточки в кэше анализа"""
+    return analysis_cache.key_for(image_bytes, card_type, context, settings.OPENAI_VISION_MODEL)
+
+
+def _lookup_card(image_path: Path, context: str, card_type: str) -> tuple[bytes, str, Optional[str]]:
+    """Фото, его ключ в кэше и готовая карточка (None, если ее нет) — для вызова в потоке"""
+    image_bytes = _read_image(image_path)
+    cache_key = _card_cache_key(image_bytes, context, card_type)
+    return image_bytes, cache_key, analysis_cache.get(cache_key)
+
+
+def _card_messages(image_data: str, context: str, card_type: str) -> list:
+    """Собирает сообщения для vision-запроса по карточке"""
+    style = CARD_STYLES.get(card_type, CARD_STYLES["micro"])
+
+    prompt = f"""{style}
 
 Контекст: {context}
 
 НЕ используй клише! Будь конкретным и живым.
 Максимум 50 слов."""
 
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
                 {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_data}",
-                                "detail": "high"
-                            }
-                        }
-                    ]
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{image_data}",
+                        "detail": "high"
+                    }
                 }
-            ],
+            ]
+        }
+    ]
+
+
+def analyze_photo_for_card(image_path: Path, context: str = "", card_type: str = "micro") -> str:
+    """Анализирует фотографию для карточки-триггера"""
+    try:
+        if not image_path.exists():
+            return MISSING_CARD
+
+        image_bytes = _read_image(image_path)
+        cache_key = _card_cache_key(image_bytes, context, card_type)
+        cached = analysis_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        image_data = base64.b64encode(image_bytes).decode('utf-8')
+
+        response = client.chat.completions.create(
+            model=settings.OPENAI_VISION_MODEL,
+            messages=_card_messages(image_data, context, card_type),
             max_tokens=100,
             temperature=0.8
         )
         
-        result = response.choices[0].message.content.strip()
-        return strip_cliches(result)
+        result = strip_cliches(response.choices[0].message.content.strip())
+        analysis_cache.put(cache_key, result)
+        return result
         
     except Exception as e:
         logger.error(f"Ошибка анализа фото {image_path}: {e}")
-        return f"Молчание."
+        return SILENT_CARD
+
+
+async def analyze_photo_for_card_async(image_path: Path, context: str = "", card_type: str = "micro",
+                                       timeout: Optional[float] = None) -> str:
+    """Асинхронная версия analyze_photo_for_card с таймаутом на вызов"""
+    try:
+        if not image_path.exists():
+            return MISSING_CARD
+
+        # чтение, хэш и SQLite блокируют — уводим их с event loop
+        image_bytes, cache_key, cached = await asyncio.to_thread(_lookup_card, image_path, context, card_type)
+        if cached is not None:
+            return cached
+
+        image_data = base64.b64encode(image_bytes).decode('utf-8')
+
+        response = await asyncio.wait_for(
+            async_client.chat.completions.create(
+                model=settings.OPENAI_VISION_MODEL,
+                messages=_card_messages(image_data, context, card_type),
+                max_tokens=100,
+                temperature=0.8
+            ),
+            timeout=timeout or settings.LLM_TIMEOUT,
+        )
+
+        result = strip_cliches(response.choices[0].message.content.strip())
+        await asyncio.to_thread(analysis_cache.put, cache_key, result)
+        return result
+
+    except asyncio.TimeoutError:
+        logger.error(f"Таймаут анализа фото {image_path}")
+        return SILENT_CARD
+    except Exception as e:
+        logger.error(f"Ошибка анализа фото {image_path}: {e}")
+        return SILENT_CARD
+
+
+async def analyze_photos_batch(paths: Sequence[Path], context: str = "",
+                               card_types: Sequence[str] = ("micro", "trigger", "sms"),
+                               concurrency: Optional[int] = None,
+                               timeout: Optional[float] = None,
+                               on_progress: Optional[Callable[[int, int], None]] = None) -> list[str]:
+    """Параллельно анализирует фотографии для карточек.
+
+    Не больше `concurrency` запросов одновременно, у каждого свой таймаут.
+    Результаты возвращаются в порядке `paths`; типы карточек берутся
+    из `card_types` по кругу. `on_progress(готово, всего)` — после каждой карточки.
+    """
+    if not paths:
+        return []
+
+    semaphore = asyncio.Semaphore(concurrency or settings.LLM_CONCURRENCY)
+    finished = 0
+
+    async def _one(i: int, path: Path) -> str:
+        nonlocal finished
+        async with semaphore:
+            card_type = card_types[i % len(card_types)]
+            card = await analyze_photo_for_card_async(path, context, card_type, timeout=timeout)
+        finished += 1
+        if on_progress is not None:
+            on_progress(finished, len(paths))
+        return card
+
+    return await asyncio.gather(*(_one(i, p) for i, p in enumerate(paths)))
 
 
 def generate_scene_chapter(scene_type: str, data: dict, all_images: list) -> str:
@@ -0,0 +1,137 @@
+import asyncio, logging, time, weakref
+from pathlib import Path
+from typing import Optional
+
+from app.config import settings
+from app.services import cards, derivatives, downloader, posts, progress, registry, run_status, singleflight
+from app.services.apify_client import fetch_run, iter_items
+from app.services.image_processor import process_folder
+from app.services.text_collector import collect_texts
+from app.services.book_builder import build_romantic_book
+
+log = logging.getLogger("pipeline")
+
+# прогон → замок его images/: сборка может докачать фото под свой формат и переставить
+# 001…, поэтому сборки одного прогона (в любых форматах) читают папку по очереди
+_image_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+# ─────────────────── этапы задач очереди ────────────────────────────────────
+async def fetch_posts(job: dict):
+    """Скачиваем датасет Apify страницами и дописываем их в posts.jsonl."""
+    run_id = job["run_id"]
+    dataset_id = job.get("dataset_id")
+    if not dataset_id:
+        run = await fetch_run(run_id)
+        dataset_id = run.get("defaultDatasetId")          # fallback
+    if not dataset_id:
+        raise RuntimeError("datasetId unresolved")
+    job["dataset_id"] = dataset_id
+
+    started = time.monotonic()
+    run_dir = Path("data") / run_id
+    writer = posts.Writer(run_dir)
+    try:
+        async for page in iter_items(dataset_id):
+            writer.write(page)
+            progress.publish(run_id, "posts", {"items": writer.count})
+        writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+    run_status.update(run_dir, stages={"data_collected": True}, timings={"fetch": round(time.monotonic() - started, 2)},
+                      profile=run_status.profile_summary(writer.first))
+    registry.fetched(run_id, dataset_id)
+
+
+async def download_images(job: dict):
+    """Качаем картинки из сохраненных постов (при повторном скрапинге — только новые)."""
+    run_dir = Path("data") / job["run_id"]
+    items = posts.load_posts(run_dir)
+    images_dir = run_dir / "images"
+    previous = _previous_run(run_dir, items) if settings.INCREMENTAL_SCRAPE else None
+    started = time.monotonic()
+    downloader.download_started(images_dir)
+    try:
+        manifest = await downloader.download_photos_async(
+            items, images_dir, deadline=settings.DOWNLOAD_DEADLINE,
+            on_progress=lambda done, total: progress.publish(run_dir.name, "download", {"done": done, "total": total}),
+            reuse_from=previous / "images" if previous else None,
+            book_format=job.get("format", "classic"))
+    finally:
+        downloader.download_finished(images_dir)
+    if previous and manifest and manifest.get("reused"):
+        await asyncio.to_thread(_carry_over, previous, run_dir, manifest["reused"])
+    files = manifest["files"] if manifest else []
+    run_status.update(run_dir, stages={"images_downloaded": bool(files)}, files={"images": len(files)},
+                      timings={"download": round(time.monotonic() - started, 2)})
+
+
+def _previous_run(run_dir: Path, items: list) -> Optional[Path]:
+    """Прошлый прогон того же профиля, из которого можно взять фото, производные и карточки."""
+    username = (items[0] if items else {}).get("username")
+    run_id = registry.previous(username, run_dir.name) if username else None
+    if run_id is None or not (run_dir.parent / run_id).is_dir():
+        return None
+    log.info("incremental scrape of @%s: reusing run %s", username, run_id)
+    return run_dir.parent / run_id
+
+
+def _carry_over(previous: Path, run_dir: Path, reused: list):
+    """Переносит производные и карточки переиспользованных фото (хэширует файлы — звать в потоке)."""
+    hashes = [derivatives.source_hash(run_dir / "images" / name) for name in reused]
+    linked = derivatives.carry_over(previous, run_dir, hashes)
+    moved = cards.carry_over(previous, run_dir, hashes)
+    log.info("reused %s images, %s derivatives, %s cards from %s", len(reused), linked, moved, previous.name)
+
+
+async def build_book(job: dict):
+    """Строим романтическую книгу (html); одинаковые сборки одного прогона не дублируются."""
+    book_format = job.get("format", "classic")
+    embed_images = job.get("embed_images")
+    if embed_images is None:
+        embed_images = settings.BOOK_EMBED_IMAGES
+    # книга пересобирается (ретрай, другой формат) — до конца сборки она не готова
+    await asyncio.to_thread(run_status.update, Path("data") / job["run_id"], stages={"book_generated": False})
+    key = ("build", job["run_id"], book_format, embed_images)
+    await singleflight.do(key, lambda: _build(job["run_id"], book_format, embed_images))
+
+
+async def _build(run_id: str, book_format: str, embed_images: bool):
+    lock = _image_locks.get(run_id)
+    if lock is None:
+        lock = _image_locks[run_id] = asyncio.Lock()
+    async with lock:
+        await _build_locked(run_id, book_format, embed_images)
+
+
+async def _build_locked(run_id: str, book_format: str, embed_images: bool):
+    run_dir = Path("data") / run_id
+    images_dir = run_dir / "images"
+
+    # Ждем события завершения загрузки (если она еще идет) вместо опроса папки
+    manifest = await downloader.wait_for_download(images_dir, timeout=settings.DOWNLOAD_WAIT_TIMEOUT)
+    if manifest:
+        print(f"📸 Загрузка завершена: {manifest['downloaded']} из {manifest['expected']} изображений")
+
+    # фото отбирались под формат с меньшим числом кадров — докачиваем недостающие (скачанные берутся из blobs)
+    selected_for = manifest.get("format") if manifest else None
+    if selected_for and downloader.FORMAT_IMAGES.get(selected_for, 0) < downloader.FORMAT_IMAGES.get(book_format, 0):
+        await download_images({"run_id": run_id, "format": book_format})
+
+    imgs      = await process_folder(images_dir)
+    comments  = collect_texts(posts.iter_posts(run_dir))
+    await build_romantic_book(run_id, imgs, comments, book_format, embed_images)
+
+
+def job_failed(job: dict, error: str):
+    """Задача упала окончательно — пишем ошибку в status.json и закрываем поток событий."""
+    run_id = job["run_id"]
+    run_status.update(Path("data") / run_id, error=error)
+    progress.publish(run_id, "failed", {"error": error})
+
+
+# webhook Apify: датасет → картинки → книга
+SCRAPE_STAGES = [("fetch", fetch_posts), ("download", download_images), ("build", build_book)]
+# /create-book: книга по уже собранным данным
+BOOK_STAGES = [("build", build_book)]
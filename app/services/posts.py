@@ -0,0 +1,77 @@
+import json, logging, os
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+log = logging.getLogger("posts")
+
+POSTS_NAME = "posts.jsonl"        # один элемент датасета на строку, пишется постранично
+LEGACY_NAME = "posts.json"        # старые прогоны: весь датасет одним JSON-массивом
+
+
+def path(run_dir: Path) -> Optional[Path]:
+    """Файл с постами прогона (новый или старого формата) или None."""
+    for name in (POSTS_NAME, LEGACY_NAME):
+        if (run_dir / name).exists():
+            return run_dir / name
+    return None
+
+
+def exists(run_dir: Path) -> bool:
+    return path(run_dir) is not None
+
+
+class Writer:
+    """Пишет страницы датасета в posts.jsonl по мере получения.
+
+    Пишем во временный файл и подменяем posts.jsonl только в commit(),
+    поэтому читатели никогда не видят половину датасета.
+    """
+
+    def __init__(self, run_dir: Path):
+        run_dir.mkdir(parents=True, exist_ok=True)
+        self.target = run_dir / POSTS_NAME
+        self.tmp = run_dir / f".{POSTS_NAME}.{os.getpid()}.tmp"
+        self.count = 0
+        self.first: Optional[dict] = None
+        self._file = open(self.tmp, "w", encoding="utf-8")
+
+    def write(self, items: Iterable[dict]):
+        for item in items:
+            if self.first is None:
+                self.first = item
+            self._file.write(json.dumps(item, ensure_ascii=False))
+            self._file.write("\n")
+            self.count += 1
+        self._file.flush()
+
+    def commit(self):
+        self._file.close()
+        os.replace(self.tmp, self.target)
+
+    def abort(self):
+        self._file.close()
+        self.tmp.unlink(missing_ok=True)
+
+
+def iter_posts(run_dir: Path) -> Iterator[dict]:
+    """Элементы датасета по одному; posts.jsonl читается построчно, не целиком."""
+    source = path(run_dir)
+    if source is None:
+        return
+    if source.name == LEGACY_NAME:
+        yield from json.loads(source.read_text(encoding="utf-8"))
+        return
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def load_posts(run_dir: Path) -> list[dict]:
+    """Весь датасет списком (пустой, если постов нет)."""
+    return list(iter_posts(run_dir))
+
+
+def first(run_dir: Path) -> Optional[dict]:
+    """Первый элемент датасета — профиль; остальное не читается."""
+    return next(iter_posts(run_dir), None)
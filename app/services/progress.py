@@ -0,0 +1,103 @@
+import asyncio, json, logging, threading
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Optional
+
+log = logging.getLogger("progress")
+
+HISTORY = 200          # событий на прогон — для переподключения с Last-Event-ID
+MAX_RUNS = 500         # сколько прогонов держим в памяти
+HEARTBEAT = 15.0       # комментарий-пинг, чтобы прокси не рвали тихое соединение
+FINAL_EVENTS = ("book", "failed")
+
+
+class _Channel:
+    """События одного прогона и ждущие их подписчики."""
+    __slots__ = ("events", "next_id", "waiters")
+
+    def __init__(self):
+        self.events: deque = deque(maxlen=HISTORY)   # (id, событие, данные)
+        self.next_id = 1
+        self.waiters: set = set()                    # (loop, asyncio.Event)
+
+
+_channels: "OrderedDict[str, _Channel]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def _channel(run_id: str) -> _Channel:
+    """Канал прогона; старые каналы без подписчиков вытесняются."""
+    channel = _channels.get(run_id)
+    if channel is None:
+        channel = _channels[run_id] = _Channel()
+        for old_id in list(_channels):
+            if len(_channels) <= MAX_RUNS:
+                break
+            if old_id != run_id and not _channels[old_id].waiters:
+                del _channels[old_id]
+    _channels.move_to_end(run_id)
+    return channel
+
+
+def publish(run_id: str, event: str, data: dict):
+    """Отправляет событие всем подписчикам прогона (можно звать из любого потока)."""
+    with _lock:
+        channel = _channel(run_id)
+        channel.events.append((channel.next_id, event, data))
+        channel.next_id += 1
+        waiters = list(channel.waiters)
+    for loop, wakeup in waiters:
+        try:
+            loop.call_soon_threadsafe(wakeup.set)
+        except RuntimeError:                      # loop подписчика уже закрыт
+            pass
+
+
+def _format(event_id: int, event: str, data: dict) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def stream(run_id: str, last_event_id: Optional[str] = None,
+                 snapshot: Optional[dict] = None) -> AsyncIterator[str]:
+    """Поток Server-Sent Events прогона.
+
+    С Last-Event-ID досылает пропущенные события из истории; если их там уже нет
+    (или это первое подключение) — начинает со снимка status.json.
+    Поток закрывается после финального события (book / failed).
+    """
+    wakeup = asyncio.Event()
+    waiter = (asyncio.get_running_loop(), wakeup)
+    with _lock:
+        channel = _channel(run_id)
+        channel.waiters.add(waiter)
+        oldest = channel.events[0][0] if channel.events else channel.next_id
+        cursor = channel.next_id - 1
+        try:
+            resume = int(last_event_id) if last_event_id else None
+        except ValueError:
+            resume = None
+        replay = resume is not None and oldest - 1 <= resume <= cursor
+        if replay:
+            cursor = resume
+    try:
+        yield "retry: 3000\n\n"
+        if not replay and snapshot is not None:
+            yield _format(cursor, "status", snapshot)
+
+        while True:
+            wakeup.clear()
+            with _lock:
+                pending = [e for e in channel.events if e[0] > cursor]
+            for event_id, event, data in pending:
+                yield _format(event_id, event, data)
+                cursor = event_id
+                if event in FINAL_EVENTS:
+                    return
+            if pending:
+                continue
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+    finally:
+        with _lock:
+            channel.waiters.discard(waiter)
@@ -0,0 +1,316 @@
+import logging, threading, time
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlparse
+
+from app.services.db import connect
+
+log = logging.getLogger("registry")
+
+DATA_DIR = Path("data")
+DB_PATH = DATA_DIR / "registry.sqlite3"
+STAGES = ("data_collected", "images_downloaded", "book_generated")
+# артефакты прогона: имя → путь внутри data/<run>
+ARTIFACTS = {
+    "posts": "posts.jsonl",
+    "posts_legacy": "posts.json",
+    "images": "images",
+    "html": "book.html",
+    "offline": "book.offline.html",
+    "pdf": "book.pdf",
+}
+RESERVED = {"cache", "blobs"}  # служебные папки data/, не прогоны
+
+_conn = None
+_lock = threading.Lock()
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        _conn = connect(DB_PATH)
+        _conn.execute(
+            """CREATE TABLE IF NOT EXISTS runs (
+                   run_id            TEXT PRIMARY KEY,
+                   username          TEXT,
+                   url               TEXT,
+                   data_collected    INTEGER NOT NULL DEFAULT 0,
+                   images_downloaded INTEGER NOT NULL DEFAULT 0,
+                   book_generated    INTEGER NOT NULL DEFAULT 0,
+                   error             TEXT,
+                   size              INTEGER NOT NULL DEFAULT 0,
+                   created_at        REAL NOT NULL,
+                   updated_at        REAL NOT NULL
+               )"""
+        )
+        _conn.execute(
+            """CREATE TABLE IF NOT EXISTS artifacts (
+                   run_id  TEXT NOT NULL,
+                   name    TEXT NOT NULL,
+                   path    TEXT NOT NULL,
+                   size    INTEGER NOT NULL,
+                   mtime   REAL NOT NULL,
+                   PRIMARY KEY (run_id, name)
+               )"""
+        )
+        # кэш скрапинга: нормализованный URL профиля → последний прогон по нему
+        _conn.execute(
+            """CREATE TABLE IF NOT EXISTS scrapes (
+                   url         TEXT PRIMARY KEY,
+                   run_id      TEXT NOT NULL,
+                   dataset_id  TEXT,
+                   started_at  REAL NOT NULL,
+                   fetched_at  REAL
+               )"""
+        )
+        _conn.execute("CREATE INDEX IF NOT EXISTS scrapes_run ON scrapes(run_id)")
+        _conn.execute("CREATE INDEX IF NOT EXISTS runs_username ON runs(username, created_at)")
+        _conn.execute("CREATE INDEX IF NOT EXISTS runs_created ON runs(created_at)")
+    return _conn
+
+
+def username_from_url(url: str) -> Optional[str]:
+    """instagram.com/<username>/ → username."""
+    parts = [p for p in urlparse(url).path.split("/") if p]
+    return parts[0].lower() if parts else None
+
+
+def is_run_id(name: str) -> bool:
+    """Имя папки прогона: не служебная папка data/, не «.»/«..» и без разделителей пути."""
+    return bool(name) and not name.startswith(".") and name not in RESERVED and not {"/", "\\"} & set(name)
+
+
+def normalize_url(url: str) -> str:
+    """Ключ профиля: без схемы, www, query, регистра и хвостового «/»."""
+    parsed = urlparse(url if "//" in url else f"//{url}")
+    host = parsed.netloc.lower().removeprefix("www.")
+    path = "/".join(p for p in parsed.path.lower().split("/") if p)
+    return f"{host}/{path}" if path else host
+
+
+def _size(path: Path) -> int:
+    """Размер файла или суммарный размер файлов папки (без вложенных)."""
+    if path.is_dir():
+        return sum(entry.stat().st_size for entry in path.iterdir() if entry.is_file())
+    return path.stat().st_size
+
+
+def _artifacts(run_dir: Path) -> list[tuple]:
+    found = []
+    for name, rel in ARTIFACTS.items():
+        path = run_dir / rel
+        try:
+            found.append((name, str(path), _size(path), path.stat().st_mtime))
+        except FileNotFoundError:
+            continue
+    return found
+
+
+def _created(run_dir: Path) -> float:
+    """Время создания прогона: посты появляются первыми."""
+    for path in (run_dir / "posts.jsonl", run_dir / "posts.json", run_dir):
+        try:
+            return path.stat().st_mtime
+        except FileNotFoundError:
+            continue
+    return time.time()
+
+
+def started(run_id: str, url: str):
+    """Запоминает прогон сразу после запуска скрапинга — до появления папки."""
+    now = time.time()
+    try:
+        with _lock:
+            conn = _db()
+            conn.execute(
+                "INSERT INTO runs (run_id, username, url, created_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(run_id) DO UPDATE SET url = excluded.url, "
+                "username = COALESCE(runs.username, excluded.username)",
+                (run_id, username_from_url(url), url, now, now),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO scrapes (url, run_id, started_at) VALUES (?, ?, ?)",
+                (normalize_url(url), run_id, now),
+            )
+    except Exception as e:
+        log.warning("cannot register run %s: %s", run_id, e)
+
+
+def fetched(run_id: str, dataset_id: str):
+    """Датасет прогона сохранен — с этого момента URL отдается из кэша."""
+    try:
+        with _lock:
+            _db().execute("UPDATE scrapes SET dataset_id = ?, fetched_at = ? WHERE run_id = ?",
+                          (dataset_id, time.time(), run_id))
+    except Exception as e:
+        log.warning("cannot mark run %s fetched: %s", run_id, e)
+
+
+def scrape_failed(run_id: str):
+    """Запуск актора не удался — профиль больше не считается собираемым."""
+    try:
+        with _lock:
+            _db().execute("DELETE FROM scrapes WHERE run_id = ? AND fetched_at IS NULL", (run_id,))
+    except Exception as e:
+        log.warning("cannot drop failed scrape %s: %s", run_id, e)
+
+
+def cached_scrape(url: str, ttl: float, inflight: float = 0) -> Optional[dict]:
+    """Свежий (моложе ttl секунд) скрапинг профиля: runId, datasetId, fetchedAt.
+
+    inflight > 0 — вернуть и скрапинг, запущенный не раньше inflight секунд назад
+    и еще не собранный (fetchedAt = None).
+    """
+    now = time.time()
+    with _lock:
+        row = _db().execute(
+            "SELECT run_id, dataset_id, fetched_at FROM scrapes WHERE url = ? "
+            "AND (fetched_at >= ? OR (fetched_at IS NULL AND started_at >= ?))",
+            (normalize_url(url), now - ttl, now - inflight),
+        ).fetchone()
+    if row is None:
+        return None
+    return {"runId": row["run_id"], "datasetId": row["dataset_id"], "fetchedAt": row["fetched_at"]}
+
+
+def record(run_dir: Path, status: dict):
+    """Сохраняет состояние прогона по его status.json и файлам на диске."""
+    run_id = run_dir.name
+    stages = status.get("stages", {})
+    username = (status.get("profile") or {}).get("username")
+    artifacts = _artifacts(run_dir)
+    now = time.time()
+    try:
+        with _lock:
+            conn = _db()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    """INSERT INTO runs (run_id, username, data_collected, images_downloaded, book_generated,
+                                         error, size, created_at, updated_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                       ON CONFLICT(run_id) DO UPDATE SET
+                           username = COALESCE(excluded.username, runs.username),
+                           data_collected = excluded.data_collected,
+                           images_downloaded = excluded.images_downloaded,
+                           book_generated = excluded.book_generated,
+                           error = excluded.error,
+                           size = excluded.size,
+                           updated_at = excluded.updated_at""",
+                    (run_id, username and username.lower(), *(int(bool(stages.get(s))) for s in STAGES),
+                     status.get("error"), sum(a[2] for a in artifacts), _created(run_dir), now),
+                )
+                conn.execute("DELETE FROM artifacts WHERE run_id = ?", (run_id,))
+                conn.executemany(
+                    "INSERT INTO artifacts (run_id, name, path, size, mtime) VALUES (?, ?, ?, ?, ?)",
+                    [(run_id, *artifact) for artifact in artifacts],
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+    except Exception as e:
+        log.warning("cannot record run %s: %s", run_id, e)
+
+
+def _run(row, artifacts: list) -> dict:
+    return {
+        "runId": row["run_id"],
+        "username": row["username"],
+        "url": row["url"],
+        "stages": {s: bool(row[s]) for s in STAGES},
+        "error": row["error"],
+        "size": row["size"],
+        "createdAt": row["created_at"],
+        "updatedAt": row["updated_at"],
+        "artifacts": {a["name"]: {"path": a["path"], "size": a["size"]} for a in artifacts},
+    }
+
+
+def get(run_id: str) -> Optional[dict]:
+    """Прогон с артефактами или None."""
+    with _lock:
+        conn = _db()
+        row = conn.execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None:
+            return None
+        artifacts = conn.execute("SELECT * FROM artifacts WHERE run_id = ?", (run_id,)).fetchall()
+    return _run(row, artifacts)
+
+
+def list_runs(username: Optional[str] = None, before: Optional[float] = None, limit: int = 50) -> list[dict]:
+    """Прогоны от новых к старым (по индексу created_at); before — курсор для следующей страницы."""
+    where, args = [], []
+    if username:
+        where.append("username = ?")
+        args.append(username.lower())
+    if before is not None:
+        where.append("created_at < ?")
+        args.append(before)
+    sql = "SELECT * FROM runs" + (" WHERE " + " AND ".join(where) if where else "")
+    sql += " ORDER BY created_at DESC LIMIT ?"
+    with _lock:
+        conn = _db()
+        rows = conn.execute(sql, (*args, limit)).fetchall()
+        artifacts: dict = {}
+        if rows:
+            marks = ",".join("?" * len(rows))
+            for a in conn.execute(f"SELECT * FROM artifacts WHERE run_id IN ({marks})",
+                                  [r["run_id"] for r in rows]):
+                artifacts.setdefault(a["run_id"], []).append(a)
+    return [_run(row, artifacts.get(row["run_id"], [])) for row in rows]
+
+
+def previous(username: str, run_id: str) -> Optional[str]:
+    """Последний другой прогон профиля со скачанными фото — база для инкрементального скрапинга."""
+    with _lock:
+        row = _db().execute(
+            "SELECT run_id FROM runs WHERE username = ? AND run_id != ? AND images_downloaded = 1 "
+            "ORDER BY created_at DESC LIMIT 1",
+            (username.lower(), run_id),
+        ).fetchone()
+    return row["run_id"] if row else None
+
+
+def forget(run_id: str):
+    """Убирает прогон из реестра (после удаления его папки)."""
+    with _lock:
+        conn = _db()
+        conn.execute("DELETE FROM artifacts WHERE run_id = ?", (run_id,))
+        conn.execute("DELETE FROM scrapes WHERE run_id = ?", (run_id,))
+        conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+
+
+def rebuild():
+    """Сверяет реестр с data/ на старте: добавляет новые и измененные прогоны, убирает пропавшие.
+
+    Прогон перечитывается, только если его status.json новее записи в реестре.
+    """
+    from app.services import run_status       # run_status импортирует реестр сам
+
+    started_at = time.perf_counter()
+    with _lock:
+        known = {row["run_id"]: row["updated_at"]
+                 for row in _db().execute("SELECT run_id, updated_at FROM runs")}
+    seen, changed = set(), 0
+    for run_dir in DATA_DIR.iterdir() if DATA_DIR.is_dir() else ():
+        if not run_dir.is_dir() or not is_run_id(run_dir.name):
+            continue
+        seen.add(run_dir.name)
+        status_file = run_dir / run_status.STATUS_NAME
+        if run_dir.name in known and status_file.exists() and status_file.stat().st_mtime <= known[run_dir.name]:
+            continue
+        status = run_status.read(run_dir)
+        if status is None:
+            run_status.rebuild(run_dir)         # создаст status.json и запишет прогон в реестр
+        else:
+            record(run_dir, status)
+        changed += 1
+    # прогоны без папки, но с записью — только те, что уже что-то скачали (не только что запущенные)
+    with _lock:
+        conn = _db()
+        gone = [row["run_id"] for row in conn.execute("SELECT run_id FROM runs WHERE data_collected = 1")
+                if row["run_id"] not in seen]
+    for run_id in gone:
+        forget(run_id)
+    log.info("registry: %s runs updated, %s removed in %.2fs", changed, len(gone), time.perf_counter() - started_at)
@@ -0,0 +1,113 @@
+import json, logging, os, threading, time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from app.services import posts, progress, registry
+
+log = logging.getLogger("run_status")
+
+STATUS_NAME = "status.json"
+
+# путь → ((mtime_ns, size), содержимое): /status читает файл только после его изменения
+_cache: Dict[str, Tuple[Tuple[int, int], dict]] = {}
+_lock = threading.Lock()
+
+
+def read(run_dir: Path) -> Optional[dict]:
+    """status.json прогона (из памяти, если файл не менялся)."""
+    path = run_dir / STATUS_NAME
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    version = (st.st_mtime_ns, st.st_size)
+    cached = _cache.get(str(path))
+    if cached and cached[0] == version:
+        return cached[1]
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        log.warning("cannot read %s: %s", path, e)
+        return None
+    _cache[str(path)] = (version, data)
+    return data
+
+
+def update(run_dir: Path, stages: Optional[dict] = None, files: Optional[dict] = None,
+           timings: Optional[dict] = None, **fields) -> dict:
+    """Дописывает изменения в status.json и атомарно сохраняет его."""
+    with _lock:
+        data = read(run_dir) or _from_disk(run_dir)
+        data = {**data, **fields}
+        for key, changes in (("stages", stages), ("files", files), ("timings", timings)):
+            if changes:
+                data[key] = {**data.get(key, {}), **changes}
+        data["updatedAt"] = time.time()
+
+        run_dir.mkdir(parents=True, exist_ok=True)
+        path = run_dir / STATUS_NAME
+        tmp = path.with_name(f".{STATUS_NAME}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, path)
+        st = path.stat()
+        _cache[str(path)] = ((st.st_mtime_ns, st.st_size), data)
+        registry.record(run_dir, data)
+    progress.publish(data["runId"], "status", data)
+    return data
+
+
+def profile_summary(profile: Optional[dict]) -> Optional[dict]:
+    """Короткая сводка профиля для /status (первый элемент датасета)."""
+    if not profile:
+        return None
+    return {
+        "username": profile.get("username"),
+        "fullName": profile.get("fullName"),
+        "followers": profile.get("followersCount"),
+        "posts": len(profile.get("latestPosts", [])),
+    }
+
+
+def book_files(run_id: str, run_dir: Path) -> dict:
+    """Ссылки на готовые файлы книги."""
+    files = {}
+    if (run_dir / "book.pdf").exists():
+        files["pdf"] = f"/download/{run_id}/book.pdf"
+    if (run_dir / "book.html").exists():
+        files["html"] = f"/view/{run_id}/book.html"
+        files["offline"] = f"/export/{run_id}/book.html"
+    return files
+
+
+def looks_like_run(run_dir: Path) -> bool:
+    """В папке есть данные прогона — посты или фото."""
+    return posts.exists(run_dir) or (run_dir / "images").is_dir()
+
+
+def _from_disk(run_dir: Path) -> dict:
+    """Состояние прогона по его файлам — для прогонов без status.json."""
+    run_id = run_dir.name
+    has_posts = posts.exists(run_dir)
+    images_dir = run_dir / "images"
+    files = book_files(run_id, run_dir)
+    data = {
+        "runId": run_id,
+        "stages": {
+            "data_collected": has_posts,
+            "images_downloaded": images_dir.exists() and any(images_dir.glob("*")),
+            "book_generated": "html" in files or "pdf" in files,
+        },
+        "files": files,
+        "timings": {},
+    }
+    if has_posts:
+        try:
+            data["profile"] = profile_summary(posts.first(run_dir))
+        except (OSError, ValueError):
+            pass
+    return data
+
+
+def rebuild(run_dir: Path) -> dict:
+    """Создает status.json по файлам прогона — один раз для старых прогонов."""
+    return update(run_dir)
@@ -0,0 +1,37 @@
+import asyncio, logging
+from typing import Any, Awaitable, Callable, Hashable
+
+log = logging.getLogger("singleflight")
+
+# ключ → общая задача; живет, пока работа не закончилась
+_inflight: dict[Hashable, asyncio.Task] = {}
+
+
+def _done(key: Hashable, task: asyncio.Task):
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    # лидер мог уйти раньше (его отменили) — ошибку забираем, чтобы asyncio не ругался
+    if not task.cancelled():
+        task.exception()
+
+
+async def do(key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+    """Выполняет func один раз на ключ: одновременные вызовы ждут результат лидера.
+
+    Работа идет отдельной задачей: отмена любого из ждущих — и лидера тоже —
+    прерывает только его ожидание. Если отменена сама работа (остановка loop),
+    для ведомых это обычная ошибка, чтобы их задачи ушли в ретрай.
+    """
+    task = _inflight.get(key)
+    if task is None:
+        task = _inflight[key] = asyncio.ensure_future(func())
+        task.add_done_callback(lambda t: _done(key, t))
+        return await asyncio.shield(task)
+
+    log.info("joining in-flight %s", key)
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        if task.cancelled() and not asyncio.current_task().cancelling():
+            raise RuntimeError(f"{key}: leader was cancelled")
+        raise
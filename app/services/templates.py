@@ -0,0 +1,87 @@
+import hashlib, logging, os, re, time
+from pathlib import Path
+from typing import Dict, Iterator, Tuple
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from markupsafe import Markup
+
+log = logging.getLogger("templates")
+
+TEMPLATES_DIR = Path(__file__).resolve().parent.parent / "templates"
+ASSETS_DIR = "assets"
+LAYOUTS = ("classic", "zine", "literary")   # templates/<макет>.html + templates/css/<макет>.css
+_ASSET_LINK = re.compile(r'<link rel="stylesheet" href="' + ASSETS_DIR + r'/([\w.-]+)">')
+
+# Шаблоны компилируются один раз: auto_reload выключен, кэш Environment держит их все
+env = Environment(
+    loader=FileSystemLoader(TEMPLATES_DIR),
+    autoescape=select_autoescape(["html"]),
+    auto_reload=False,
+    trim_blocks=True,
+    lstrip_blocks=True,
+)
+env.filters["thousands"] = lambda value: f"{value:,}"
+
+# макет → (CSS, имя файла с хэшем содержимого)
+_stylesheets: Dict[str, Tuple[str, str]] = {}
+
+
+def stylesheet(layout: str) -> Tuple[str, str]:
+    """CSS макета и его имя для ссылки (читается с диска один раз)."""
+    if layout not in _stylesheets:
+        css = (TEMPLATES_DIR / "css" / f"{layout}.css").read_text(encoding="utf-8")
+        digest = hashlib.sha256(css.encode()).hexdigest()[:12]
+        _stylesheets[layout] = (css, f"{layout}.{digest}.css")
+    return _stylesheets[layout]
+
+
+def warm():
+    """Компилирует все макеты и загружает CSS — вызывается на старте приложения."""
+    started = time.perf_counter()
+    for layout in LAYOUTS:
+        env.get_template(f"{layout}.html")
+        stylesheet(layout)
+    log.info("templates compiled in %.1f ms", (time.perf_counter() - started) * 1000)
+
+
+def publish_assets(run_dir: Path):
+    """Кладет CSS всех макетов в data/<run>/assets/, чтобы ссылки из book.html работали."""
+    assets = run_dir / ASSETS_DIR
+    assets.mkdir(parents=True, exist_ok=True)
+    for layout in LAYOUTS:
+        css, name = stylesheet(layout)
+        target = assets / name
+        if not target.exists():
+            tmp = target.with_name(f".{name}.{os.getpid()}.tmp")
+            tmp.write_text(css, encoding="utf-8")
+            os.replace(tmp, target)
+
+
+def stream(layout: str, context: dict, embed: bool = False) -> Iterator[str]:
+    """Рендерит макет из словаря context кусками — по мере прохода по шаблону.
+
+    embed=True — CSS встраивается в <style>, иначе ссылка на assets/<имя>.css
+    (файлы кладет publish_assets).
+    """
+    started = time.perf_counter()
+    css, name = stylesheet(layout)
+    if embed:
+        context = {**context, "inline_css": Markup(css)}
+    else:
+        context = {**context, "css_href": f"{ASSETS_DIR}/{name}"}
+    yield from env.get_template(f"{layout}.html").generate(context)
+    log.info("rendered %s in %.1f ms", layout, (time.perf_counter() - started) * 1000)
+
+
+def render(layout: str, context: dict, embed: bool = False) -> str:
+    """Макет целиком одной строкой."""
+    return "".join(stream(layout, context, embed))
+
+
+def inline_stylesheets(html: str, run_dir: Path) -> str:
+    """Заменяет ссылки assets/<имя>.css на <style> — версия книги для офлайна."""
+    def _embed(match: "re.Match") -> str:
+        path = run_dir / ASSETS_DIR / match.group(1)
+        return f"<style>\n{path.read_text(encoding='utf-8')}</style>" if path.exists() else match.group(0)
+
+    return _ASSET_LINK.sub(_embed, html)
@@ -1,10 +1,8 @@
-import json
-from pathlib import Path
+from typing import Iterable
 
-def collect_texts(json_path: Path) -> str:
-    data = json.loads(json_path.read_text(encoding="utf-8"))
+def collect_texts(items: Iterable[dict]) -> str:
     texts = []
-    for item in data:
+    for item in items:
         for post in item.get("latestPosts", []):
             if cap := post.get("caption"):
                 texts.append(cap)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк Dream-Pastel: прежняя реализация на PIL против векторной на NumPy
+"""
+
+import sys
+import time
+from pathlib import Path
+import numpy as np
+from PIL import Image, ImageFilter, ImageEnhance
+from app.services.book_builder import apply_dream_pastel_effect
+
+ROUNDS = 3
+
+def legacy_dream_pastel_effect(img: Image.Image) -> Image.Image:
+    """Копия прежней apply_dream_pastel_effect (для сравнения)"""
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img = img.filter(ImageFilter.GaussianBlur(1.2))
+    img = ImageEnhance.Color(img).enhance(1.15)
+    overlay = Image.new('RGBA', img.size, (255, 220, 210, 25))
+    img = Image.alpha_composite(img.convert('RGBA'), overlay)
+    noise = np.random.randint(0, 15, (img.size[1], img.size[0], 3), dtype=np.uint8)
+    noise_img = Image.fromarray(noise, 'RGB').convert('RGBA')
+    noise_overlay = Image.new('RGBA', img.size, (0, 0, 0, 0))
+    noise_overlay.paste(noise_img, (0, 0))
+    img = Image.alpha_composite(img, noise_overlay)
+    img = ImageEnhance.Brightness(img).enhance(1.05)
+    return img.convert('RGB')
+
+def bench(effect, images: list) -> float:
+    """Лучшее время из ROUNDS прогонов по всем фото, в секундах"""
+    best = float('inf')
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        for img in images:
+            effect(img)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def main():
+    paths = sorted(Path('data').glob('*/images/*.jpg'))
+    if not paths:
+        print("❌ В data/*/images нет фото для бенчмарка")
+        return 1
+
+    images = []
+    for path in paths:
+        with Image.open(path) as img:
+            images.append(img.convert('RGB'))
+    pixels = sum(img.size[0] * img.size[1] for img in images)
+    print(f"📸 {len(images)} фото, {pixels / 1e6:.1f} Мпикс")
+
+    legacy = bench(legacy_dream_pastel_effect, images)
+    fused = bench(apply_dream_pastel_effect, images)
+    # размытие у обеих версий одно и то же (Pillow) — показываем его отдельно
+    blur = bench(lambda img: img.filter(ImageFilter.GaussianBlur(1.2)), images)
+    print(f"🐢 PIL (прежняя):  {legacy * 1000:8.1f} мс  ({legacy / len(images) * 1000:.1f} мс/фото)")
+    print(f"🚀 NumPy (новая):  {fused * 1000:8.1f} мс  ({fused / len(images) * 1000:.1f} мс/фото)")
+    print(f"🌫  из них размытие: {blur * 1000:8.1f} мс")
+    print(f"⚡ Ускорение: x{legacy / fused:.2f}, без учета размытия: x{(legacy - blur) / (fused - blur):.2f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,6 +5,7 @@
 
 from pathlib import Path
 import json
+import asyncio
 from app.services.book_builder import build_romantic_book
 
 def create_test_zine():
@@ -68,7 +69,7 @@ def create_test_zine():
     
     # Создаем зин (без реальных изображений для теста)
     try:
-        build_romantic_book(test_run_id, [], '')
+        asyncio.run(build_romantic_book(test_run_id, [], ''))
         
         # Проверяем результат
         html_file = test_dir / 'book.html'
@@ -0,0 +1,22 @@
+import os
+
+import pytest
+
+# app.config требует эти переменные; тестам реальные ключи не нужны
+for _name in ("APIFY_TOKEN", "ACTOR_ID", "OPENAI_API_KEY", "GOOGLE_API_KEY"):
+    os.environ.setdefault(_name, "test")
+os.environ.setdefault("BACKEND_BASE", "http://testserver")
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Пустая рабочая папка: сервисы пишут в относительный data/."""
+    from app.services import analysis_cache, blobs, job_queue, registry
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(registry, "_conn", None)
+    monkeypatch.setattr(analysis_cache, "_conn", None)
+    monkeypatch.setattr(blobs, "_conn", None)
+    monkeypatch.setattr(job_queue, "_conn", None)
+    (tmp_path / "data").mkdir()
+    return tmp_path
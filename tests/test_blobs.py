@@ -0,0 +1,56 @@
+from app.services import blobs
+
+
+def test_keys_for_post_and_unsigned_url():
+    url = "https://scontent.cdninstagram.com/v/t51/abc.jpg?stp=dst&oh=signature"
+    assert blobs.keys_for("C0de", url) == ["post:C0de", "url:scontent.cdninstagram.com/v/t51/abc.jpg"]
+    # без shortCode/id ключ поста — номер в выдаче, он нестабилен
+    assert blobs.keys_for("#3", url) == ["url:scontent.cdninstagram.com/v/t51/abc.jpg"]
+
+
+def test_adopt_then_find_and_link(workdir):
+    downloaded = workdir / "data" / "run1" / "images" / "001.jpg"
+    downloaded.parent.mkdir(parents=True)
+    downloaded.write_bytes(b"jpeg bytes")
+
+    blob = blobs.adopt(downloaded, ["post:a"])
+    assert blob.parent.parent == blobs.BLOBS_DIR
+    assert blob.stat().st_ino == downloaded.stat().st_ino
+    assert blobs.find(["url:other", "post:a"]) == blob
+    assert blobs.find(["post:missing"]) is None
+    assert blobs.find([]) is None
+
+    target = workdir / "data" / "run2" / "images" / "004.jpg"
+    target.parent.mkdir(parents=True)
+    blobs.link(blob, target)
+    assert target.stat().st_ino == blob.stat().st_ino
+    assert not list(target.parent.glob(".*.part"))
+
+
+def test_same_content_stored_once(workdir):
+    first = workdir / "data" / "run1" / "001.jpg"
+    second = workdir / "data" / "run2" / "001.jpg"
+    for path in (first, second):
+        path.parent.mkdir(parents=True)
+        path.write_bytes(b"same photo")
+
+    assert blobs.adopt(first, ["post:a"]) == blobs.adopt(second, ["post:b"])
+    assert first.stat().st_ino == second.stat().st_ino
+    assert len(list((workdir / blobs.BLOBS_DIR).glob("*/*.jpg"))) == 1
+
+
+def test_blob_removed_from_disk_is_a_miss(workdir):
+    path = workdir / "data" / "run" / "001.jpg"
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b"photo")
+    blob = blobs.adopt(path, ["post:a"])
+    blob.unlink()
+    assert blobs.find(["post:a"]) is None
+
+
+def test_adopt_all_skips_broken_files(workdir):
+    good = workdir / "data" / "run" / "001.jpg"
+    good.parent.mkdir(parents=True)
+    good.write_bytes(b"photo")
+    assert blobs.adopt_all([(good, ["post:a"]), (good.with_name("404.jpg"), ["post:b"])]) == 1
+    assert blobs.find(["post:a"]) is not None
@@ -0,0 +1,46 @@
+import asyncio, json
+
+import pytest
+
+from app.services import book_builder, progress, run_status
+
+
+def _events(run_id):
+    return [event for _, event, _ in progress._channel(run_id).events]
+
+
+def _run(workdir, run_id):
+    run_dir = workdir / "data" / run_id
+    run_dir.mkdir()
+    profile = {"username": "someone", "fullName": "Someone", "followersCount": 10, "latestPosts": []}
+    (run_dir / "posts.jsonl").write_text(json.dumps(profile) + "\n", encoding="utf-8")
+    return run_dir
+
+
+def test_built_book_marked_generated(workdir):
+    run_dir = _run(workdir, "ok-run")
+    asyncio.run(book_builder.build_romantic_book("ok-run", [], "", "literary", embed_images=False))
+
+    status = run_status.read(run_dir)
+    assert status["stages"]["book_generated"] is True
+    assert status["files"]["html"] == "/view/ok-run/book.html"
+    assert _events("ok-run")[-1] == "book"
+
+
+def test_failed_build_not_marked_generated(workdir, monkeypatch):
+    run_dir = _run(workdir, "bad-run")
+    (run_dir / "book.html").write_text("<html>old book</html>", encoding="utf-8")
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("layout exploded")
+
+    monkeypatch.setattr(book_builder, "create_literary_instagram_book_html", broken)
+    with pytest.raises(RuntimeError):
+        asyncio.run(book_builder.build_romantic_book("bad-run", [], "", "literary", embed_images=False))
+
+    status = run_status.read(run_dir)
+    assert status["stages"]["book_generated"] is False
+    assert "layout exploded" in status["error"]
+    # failed отправляет очередь после последней попытки, сборка — только status
+    assert "book" not in _events("bad-run")
+    assert "failed" not in _events("bad-run")
@@ -0,0 +1,66 @@
+import asyncio, json, threading
+
+from PIL import Image
+
+from app.services import cards, derivatives, pipeline
+from app.services.llm_client import SILENT_CARD
+
+
+def _photo(run_dir, name, color):
+    path = run_dir / "images" / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new("RGB", (64, 64), color).save(path, format="JPEG")
+    return path
+
+
+def test_analyze_sends_only_new_photos(workdir, monkeypatch):
+    run_dir = workdir / "data" / "run"
+    known = _photo(run_dir, "001.jpg", (255, 0, 0))
+    fresh = _photo(run_dir, "002.jpg", (0, 255, 0))
+    silent = _photo(run_dir, "003.jpg", (0, 0, 255))
+    cards.save(run_dir, {derivatives.source_hash(known): {"sms": "старая карточка"}})
+    sent, threads = [], []
+
+    async def batch(paths, context, card_types, on_progress=None):
+        sent.extend((path.name, card_type) for path, card_type in zip(paths, card_types))
+        return ["новая карточка" if path == fresh else SILENT_CARD for path in paths]
+
+    original = derivatives.source_hash
+
+    def traced(src):
+        threads.append(threading.current_thread())
+        return original(src)
+
+    monkeypatch.setattr(cards, "analyze_photos_batch", batch)
+    monkeypatch.setattr(derivatives, "source_hash", traced)
+    types, texts = asyncio.run(cards.analyze([known, fresh, silent], "ctx", ["micro", "micro", "trigger"]))
+
+    # у известного фото другой тип карточки — берется готовая, запроса нет
+    assert types == ["sms", "micro", "trigger"]
+    assert texts == ["старая карточка", "новая карточка", SILENT_CARD]
+    assert sent == [("002.jpg", "micro"), ("003.jpg", "trigger")]
+    assert threading.main_thread() not in threads
+    store = cards.load(run_dir)
+    assert store[original(fresh)] == {"micro": "новая карточка"}
+    assert original(silent) not in store
+
+
+def test_carry_over_links_derivatives_and_cards(workdir):
+    previous, run_dir = workdir / "data" / "old", workdir / "data" / "new"
+    kept = _photo(previous, "001.jpg", (10, 20, 30))
+    gone = _photo(previous, "002.jpg", (200, 20, 30))
+    kept_derivative = derivatives.get_derivative(kept, (32, 32), "zine", 90)
+    derivatives.get_derivative(gone, (32, 32), "zine", 90)
+    cards.save(previous, {derivatives.source_hash(kept): {"micro": "карточка"},
+                          derivatives.source_hash(gone): {"micro": "чужая"}})
+
+    new_dir = run_dir / "images"
+    new_dir.mkdir(parents=True)
+    (new_dir / "003.jpg").write_bytes(kept.read_bytes())
+    pipeline._carry_over(previous, run_dir, ["003.jpg"])
+
+    linked = run_dir / derivatives.DERIVED_DIR / kept_derivative.name
+    assert [p.name for p in (run_dir / derivatives.DERIVED_DIR).iterdir()] == [kept_derivative.name]
+    assert linked.stat().st_ino == kept_derivative.stat().st_ino
+    assert json.loads((run_dir / cards.CARDS_NAME).read_text(encoding="utf-8")) == \
+        {derivatives.source_hash(kept): {"micro": "карточка"}}
@@ -0,0 +1,84 @@
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services import delivery
+
+client = TestClient(app)
+BOOK = ("<html><body>" + "Я листаю ленту в поиске дикого цветка. " * 200 + "</body></html>").encode()
+
+
+@pytest.fixture
+def book(workdir):
+    run_dir = workdir / "data" / "run"
+    run_dir.mkdir()
+    path = run_dir / "book.html"
+    path.write_bytes(BOOK)
+    return path
+
+
+def test_precompressed_copy_served(book):
+    delivery.precompress(book)
+    response = client.get("/view/run/book.html", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) == (book.parent / "book.html.gz").stat().st_size
+    assert response.content == BOOK
+
+
+def test_identity_without_accept_encoding(book):
+    delivery.precompress(book)
+    response = client.get("/view/run/book.html", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.content == BOOK
+
+
+def test_stale_copy_ignored(book):
+    delivery.precompress(book)
+    gz = book.with_name("book.html.gz")
+    older = book.stat().st_mtime_ns - 10**9
+    os.utime(gz, ns=(older, older))
+    response = client.get("/view/run/book.html", headers={"Accept-Encoding": "gzip;q=1, br;q=0"})
+    assert "content-encoding" not in response.headers
+
+
+def test_refused_encoding_not_used(book):
+    delivery.precompress(book)
+    response = client.get("/view/run/book.html", headers={"Accept-Encoding": "gzip;q=0"})
+    assert "content-encoding" not in response.headers
+
+
+def test_etag_revalidation(book):
+    first = client.get("/view/run/book.html", headers={"Accept-Encoding": "identity"})
+    etag = first.headers["etag"]
+    again = client.get("/view/run/book.html", headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["etag"] == etag and not again.content
+
+    book.write_bytes(BOOK + b"<!-- v2 -->")
+    changed = client.get("/view/run/book.html", headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+    assert changed.status_code == 200
+
+
+def test_if_modified_since(book):
+    first = client.get("/view/run/book.html", headers={"Accept-Encoding": "identity"})
+    again = client.get("/view/run/book.html", headers={"Accept-Encoding": "identity",
+                                                       "If-Modified-Since": first.headers["last-modified"]})
+    assert again.status_code == 304
+
+
+def test_pdf_range_request(workdir):
+    run_dir = workdir / "data" / "run"
+    run_dir.mkdir()
+    (run_dir / "book.pdf").write_bytes(bytes(range(256)) * 4)
+    response = client.get("/download/run/book.pdf", headers={"Range": "bytes=10-19", "Accept-Encoding": "gzip"})
+    assert response.status_code == 206
+    assert response.content == bytes(range(10, 20))
+    assert "content-encoding" not in response.headers
+
+
+def test_missing_book(workdir):
+    assert client.get("/view/nope/book.html").status_code == 404
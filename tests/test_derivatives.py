@@ -0,0 +1,71 @@
+import asyncio, threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from app.services import derivatives
+
+
+def _photo(run_dir, name="001.jpg", size=(800, 600), color=(200, 120, 90)):
+    path = run_dir / "images" / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new("RGB", size, color).save(path, format="JPEG")
+    return path
+
+
+def test_derivative_rendered_once(workdir):
+    src = _photo(workdir / "data" / "run")
+    dst = derivatives.get_derivative(src, (400, 400), "classic", 85)
+    assert dst.parent == workdir / "data" / "run" / derivatives.DERIVED_DIR
+    with Image.open(dst) as img:
+        assert max(img.size) == 400
+    mtime = dst.stat().st_mtime_ns
+    assert derivatives.get_derivative(src, (400, 400), "classic", 85) == dst
+    assert dst.stat().st_mtime_ns == mtime
+
+
+def test_same_derivative_from_parallel_threads(workdir):
+    src = _photo(workdir / "data" / "run", size=(2000, 1500))
+    dst = derivatives.derivative_path(src, (600, 600), "zine", 90)
+
+    def derive(_):
+        return derivatives.render(src, dst, (600, 600), "zine", 90)
+
+    with ThreadPoolExecutor(8) as pool:
+        assert set(pool.map(derive, range(16))) == {dst}
+    with Image.open(dst) as img:
+        img.verify()
+    assert not list(dst.parent.glob("*.tmp"))
+
+
+def test_derivative_name_follows_content(workdir):
+    run_dir = workdir / "data" / "run"
+    first = _photo(run_dir, "001.jpg")
+    same = _photo(run_dir, "002.jpg")
+    other = _photo(run_dir, "003.jpg", color=(10, 10, 10))
+    assert derivatives.source_hash(first) == derivatives.source_hash(same) != derivatives.source_hash(other)
+    assert derivatives.derivative_path(first, (100, 100), "original", 90) == \
+        derivatives.derivative_path(same, (100, 100), "original", 90)
+
+
+def test_prepare_hashes_off_the_event_loop(workdir, monkeypatch):
+    run_dir = workdir / "data" / "run"
+    srcs = [_photo(run_dir, f"00{i}.jpg", color=(i * 40, 0, 0)) for i in range(1, 4)]
+    broken = run_dir / "images" / "004.jpg"
+    broken.write_bytes(b"not an image")
+    threads = []
+    original = derivatives.source_hash
+
+    def traced(src):
+        threads.append(threading.current_thread())
+        return original(src)
+
+    monkeypatch.setattr(derivatives, "source_hash", traced)
+    try:
+        result = asyncio.run(derivatives.prepare([*srcs, broken], (200, 200), "literary", 80))
+    finally:
+        derivatives.shutdown_pool()
+
+    assert [path.exists() for path in result[:3]] == [True] * 3
+    assert result[3] is None
+    assert threads and threading.main_thread() not in threads
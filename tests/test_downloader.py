@@ -0,0 +1,71 @@
+import asyncio
+
+from app.services import downloader
+
+
+def _items(*codes):
+    return [{"latestPosts": [{"shortCode": code, "likesCount": 10 - i,
+                              "displayUrl": f"https://cdn.example/{code}.jpg?sig={i}"}
+                             for i, code in enumerate(codes)]}]
+
+
+def _fake_http(monkeypatch, requested):
+    async def download_all(urls, folder, deadline=None, on_progress=None):
+        names = []
+        for idx, url in urls:
+            requested.append(url.split("?")[0].rsplit("/", 1)[-1])
+            (folder / f"{idx:03d}.jpg").write_bytes(url.split("?")[0].encode())
+            names.append(f"{idx:03d}.jpg")
+        return names
+
+    monkeypatch.setattr(downloader, "_download_all", download_all)
+
+
+def test_rescrape_downloads_only_new_posts(workdir, monkeypatch):
+    requested = []
+    _fake_http(monkeypatch, requested)
+    old_dir = workdir / "data" / "old" / "images"
+    first = asyncio.run(downloader.download_photos_async(_items("a", "b"), old_dir, book_format="classic"))
+    assert requested == ["a.jpg", "b.jpg"]
+    assert first["sources"] == {"001.jpg": "a", "002.jpg": "b"}
+
+    # новый пост сверху: старые фото меняют номера, но берутся по shortCode
+    requested.clear()
+    monkeypatch.setattr(downloader.blobs, "find", lambda keys: None)
+    new_dir = workdir / "data" / "new" / "images"
+    manifest = asyncio.run(downloader.download_photos_async(_items("c", "a", "b"), new_dir,
+                                                            reuse_from=old_dir, book_format="classic"))
+    assert requested == ["c.jpg"]
+    assert manifest["sources"] == {"001.jpg": "c", "002.jpg": "a", "003.jpg": "b"}
+    assert sorted(manifest["reused"]) == ["002.jpg", "003.jpg"]
+    assert (new_dir / "002.jpg").stat().st_ino == (old_dir / "001.jpg").stat().st_ino
+    assert manifest["format"] == "classic"
+    assert [entry["shortCode"] for entry in manifest["selection"]] == ["c", "a", "b"]
+
+
+def test_busy_host_does_not_starve_others(workdir, monkeypatch):
+    monkeypatch.setattr(downloader.settings, "DOWNLOAD_PER_HOST", 1)
+    monkeypatch.setattr(downloader, "_host_limits", {})
+    started = []
+
+    async def run():
+        other_host = asyncio.Event()
+
+        async def save(url, folder, client, idx, max_retries=3):
+            started.append(url)
+            if "other" in url:
+                other_host.set()
+            else:
+                # первый кадр занятого хоста держит слот, пока не начнется загрузка с другого хоста
+                await asyncio.wait_for(other_host.wait(), timeout=1.0)
+            return f"{idx:03d}.jpg"
+
+        monkeypatch.setattr(downloader, "_save", save)
+        monkeypatch.setattr(downloader, "_pool", object())
+        monkeypatch.setattr(downloader, "_pool_loop", asyncio.get_running_loop())
+        monkeypatch.setattr(downloader, "_global_limit", asyncio.Semaphore(2))
+        urls = [(i, f"https://busy.example/{i}.jpg") for i in range(1, 4)] + [(4, "https://other.example/4.jpg")]
+        return await downloader._download_all(urls, workdir)
+
+    assert asyncio.run(run()) == ["001.jpg", "002.jpg", "003.jpg", "004.jpg"]
+    assert started.index("https://other.example/4.jpg") == 1
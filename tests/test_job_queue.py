@@ -0,0 +1,114 @@
+import asyncio, json
+
+import pytest
+
+from app.config import settings
+from app.services import book_builder, job_queue, run_status
+
+
+@pytest.fixture
+def queue(workdir, monkeypatch):
+    monkeypatch.setattr(settings, "JOB_STAGE_RETRIES", 1)
+    monkeypatch.setattr(settings, "JOB_RETRY_DELAY", 0.0)
+    monkeypatch.setattr(job_queue, "_pipelines", {})
+    monkeypatch.setattr(job_queue, "_on_failed", {})
+    return job_queue
+
+
+def _drain(queue):
+    """Прогоняет задачи, пока очередь не опустеет (ретраи без задержки)."""
+    async def run():
+        while (job := queue._claim()) is not None:
+            await queue._run(job)
+    asyncio.run(run())
+
+
+def test_stages_share_payload(queue):
+    seen = []
+
+    async def first(payload):
+        payload["token"] = "abc"
+
+    async def second(payload):
+        seen.append(payload["token"])
+
+    queue.register("demo", [("first", first), ("second", second)])
+    job_id = queue.enqueue("demo", {"run_id": "r"})
+    _drain(queue)
+
+    assert seen == ["abc"]
+    assert queue.get(job_id)["status"] == "done"
+
+
+def test_failed_stage_is_retried(queue):
+    calls = []
+
+    async def flaky(payload):
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+
+    queue.register("demo", [("flaky", flaky)])
+    job_id = queue.enqueue("demo", {})
+    _drain(queue)
+
+    assert len(calls) == 2
+    job = queue.get(job_id)
+    assert job["status"] == "done" and job["error"] is None
+
+
+def test_final_failure_calls_handler(queue):
+    failures = []
+
+    async def broken(payload):
+        raise RuntimeError("boom")
+
+    queue.register("demo", [("broken", broken)], on_failed=lambda payload, error: failures.append((payload, error)))
+    job_id = queue.enqueue("demo", {"run_id": "r"})
+    _drain(queue)
+
+    job = queue.get(job_id)
+    assert job["status"] == "failed" and job["attempts"] == 2
+    assert failures == [({"run_id": "r"}, "broken: boom")]
+
+
+def test_dedup_returns_pending_job(queue):
+    async def noop(payload):
+        pass
+
+    queue.register("demo", [("noop", noop)])
+    first = queue.enqueue("demo", {"run_id": "r"}, dedup=True)
+    assert queue.enqueue("demo", {"run_id": "r"}, dedup=True) == first
+    assert queue.enqueue("demo", {"run_id": "other"}, dedup=True) != first
+    assert queue.enqueue("demo", {"run_id": "r"}) != first
+
+
+def test_unknown_kind_rejected(queue):
+    with pytest.raises(ValueError):
+        queue.enqueue("nope", {})
+
+
+def test_book_stage_failure_reaches_retry(queue, workdir, monkeypatch):
+    run_dir = workdir / "data" / "run"
+    run_dir.mkdir()
+    (run_dir / "posts.jsonl").write_text(json.dumps({"username": "someone"}) + "\n", encoding="utf-8")
+    calls = []
+
+    def broken(*args, **kwargs):
+        calls.append(1)
+        raise RuntimeError("layout exploded")
+
+    monkeypatch.setattr(book_builder, "create_literary_instagram_book_html", broken)
+
+    async def build(payload):
+        await book_builder.build_romantic_book(payload["run_id"], [], "", "literary", embed_images=False)
+
+    queue.register("book", [("build", build)])
+    job_id = queue.enqueue("book", {"run_id": "run"})
+    _drain(queue)
+
+    assert len(calls) == 2
+    assert queue.get(job_id)["status"] == "failed"
+    assert run_status.read(run_dir)["stages"]["book_generated"] is False
+    # пользователю остается страница с ошибкой
+    assert "layout exploded" in (run_dir / "book.html").read_text(encoding="utf-8")
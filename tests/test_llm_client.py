@@ -0,0 +1,45 @@
+import asyncio, threading
+from types import SimpleNamespace
+
+from app.services import analysis_cache, llm_client
+
+
+class _FakeCompletions:
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        message = SimpleNamespace(content="Свет в окне")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def test_card_cached_off_the_event_loop(workdir, monkeypatch):
+    completions = _FakeCompletions()
+    monkeypatch.setattr(llm_client, "async_client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    threads = []
+    for name in ("get", "put"):
+        original = getattr(analysis_cache, name)
+
+        def traced(*args, _original=original):
+            threads.append(threading.current_thread())
+            return _original(*args)
+
+        monkeypatch.setattr(analysis_cache, name, traced)
+
+    photo = workdir / "photo.jpg"
+    photo.write_bytes(b"\xff\xd8 not really a jpeg")
+
+    async def run():
+        first = await llm_client.analyze_photo_for_card_async(photo, "ctx", "micro")
+        second = await llm_client.analyze_photo_for_card_async(photo, "ctx", "micro")
+        return first, second
+
+    assert asyncio.run(run()) == ("Свет в окне", "Свет в окне")
+    assert completions.calls == 1
+    assert len(threads) == 3 and threading.main_thread() not in threads
+
+
+def test_missing_photo(workdir):
+    result = asyncio.run(llm_client.analyze_photo_for_card_async(workdir / "nope.jpg"))
+    assert result == llm_client.MISSING_CARD
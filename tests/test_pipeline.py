@@ -0,0 +1,53 @@
+import asyncio
+
+from app.services import pipeline
+
+
+def test_builds_of_one_run_do_not_overlap(workdir, monkeypatch):
+    log = []
+    manifest = {"format": "classic", "downloaded": 5, "expected": 5}
+
+    async def wait_for_download(folder, timeout):
+        return manifest
+
+    async def download_images(job):
+        log.append(("topup", job["format"]))
+        await asyncio.sleep(0.02)
+        manifest["format"] = job["format"]
+
+    async def process_folder(folder):
+        return []
+
+    async def build_romantic_book(run_id, imgs, comments, book_format, embed_images):
+        log.append(("start", book_format))
+        await asyncio.sleep(0.02)
+        log.append(("end", book_format))
+
+    monkeypatch.setattr(pipeline.downloader, "wait_for_download", wait_for_download)
+    monkeypatch.setattr(pipeline, "download_images", download_images)
+    monkeypatch.setattr(pipeline, "process_folder", process_folder)
+    monkeypatch.setattr(pipeline, "build_romantic_book", build_romantic_book)
+
+    async def run():
+        await asyncio.gather(
+            pipeline.build_book({"run_id": "run", "format": "zine", "embed_images": False}),
+            pipeline.build_book({"run_id": "run", "format": "classic", "embed_images": False}),
+        )
+
+    asyncio.run(run())
+    assert log == [("topup", "zine"), ("start", "zine"), ("end", "zine"), ("start", "classic"), ("end", "classic")]
+
+
+def test_build_stage_resets_book_generated(workdir, monkeypatch):
+    from app.services import run_status
+
+    run_dir = workdir / "data" / "run"
+    run_status.update(run_dir, stages={"book_generated": True})
+    seen = []
+
+    async def build(run_id, book_format, embed_images):
+        seen.append(run_status.read(run_dir)["stages"]["book_generated"])
+
+    monkeypatch.setattr(pipeline, "_build", build)
+    asyncio.run(pipeline.build_book({"run_id": "run", "format": "zine"}))
+    assert seen == [False]
@@ -0,0 +1,99 @@
+import json, time
+
+import pytest
+
+from app.services import registry, run_status
+
+
+def _run(workdir, run_id, username, book=False, images=False):
+    run_dir = workdir / "data" / run_id
+    run_dir.mkdir()
+    (run_dir / "posts.jsonl").write_text(json.dumps({"username": username, "latestPosts": []}) + "\n",
+                                         encoding="utf-8")
+    if images:
+        (run_dir / "images").mkdir()
+        (run_dir / "images" / "001.jpg").write_bytes(b"x" * 10)
+    if book:
+        (run_dir / "book.html").write_text("<html></html>", encoding="utf-8")
+    return run_dir
+
+
+@pytest.mark.parametrize("url", [
+    "https://www.instagram.com/Someone/",
+    "http://instagram.com/someone",
+    "instagram.com/someone/?igsh=abc",
+])
+def test_normalize_url(url):
+    assert registry.normalize_url(url) == "instagram.com/someone"
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("j48JCncldO4Rbjj65", True), ("cache", False), ("blobs", False),
+    (".", False), ("..", False), (".tmp", False), ("a/b", False), ("", False),
+])
+def test_is_run_id(name, expected):
+    assert registry.is_run_id(name) is expected
+
+
+def test_status_update_records_run(workdir):
+    run_dir = _run(workdir, "r1", "Someone", book=True, images=True)
+    run_status.update(run_dir, stages={"book_generated": True}, profile={"username": "Someone"})
+
+    run = registry.get("r1")
+    assert run["username"] == "someone"
+    assert run["stages"] == {"data_collected": True, "images_downloaded": True, "book_generated": True}
+    assert set(run["artifacts"]) == {"posts", "images", "html"}
+    assert run["artifacts"]["images"]["size"] == 10
+
+
+def test_list_runs_newest_first_with_cursor(workdir):
+    for n in range(5):
+        run_status.update(_run(workdir, f"r{n}", "someone" if n % 2 else "other"))
+        time.sleep(0.01)
+
+    page = registry.list_runs(limit=2)
+    assert [r["runId"] for r in page] == ["r4", "r3"]
+    page = registry.list_runs(before=page[-1]["createdAt"], limit=2)
+    assert [r["runId"] for r in page] == ["r2", "r1"]
+    assert [r["runId"] for r in registry.list_runs(username="SOMEONE")] == ["r3", "r1"]
+
+
+def test_previous_run_needs_images(workdir):
+    run_status.update(_run(workdir, "old", "someone", images=True))
+    time.sleep(0.01)
+    run_status.update(_run(workdir, "empty", "someone"))
+    assert registry.previous("someone", "new") == "old"
+    assert registry.previous("someone", "old") is None
+
+
+def test_cached_scrape_ttl_and_inflight(workdir):
+    url = "https://www.instagram.com/someone/"
+    registry.started("r1", url)
+    assert registry.cached_scrape(url, ttl=3600) is None
+    assert registry.cached_scrape("instagram.com/someone", ttl=3600, inflight=60)["runId"] == "r1"
+
+    registry.fetched("r1", "dataset")
+    hit = registry.cached_scrape(url, ttl=3600)
+    assert hit["runId"] == "r1" and hit["datasetId"] == "dataset"
+    assert registry.cached_scrape(url, ttl=-1) is None
+
+
+def test_rebuild_syncs_with_disk(workdir):
+    _run(workdir, "legacy", "someone", book=True)
+    (workdir / "data" / "blobs").mkdir()
+    (workdir / "data" / "cache").mkdir()
+    registry.started("gone", "instagram.com/gone")
+    run_status.update(_run(workdir, "deleted", "gone"))
+    for path in sorted((workdir / "data" / "deleted").iterdir(), reverse=True):
+        path.unlink()
+    (workdir / "data" / "deleted").rmdir()
+
+    registry.rebuild()
+
+    assert registry.get("legacy")["stages"]["book_generated"] is True
+    assert (workdir / "data" / "legacy" / "status.json").exists()
+    assert registry.get("deleted") is None
+    # только что запущенный прогон без папки остается
+    assert registry.get("gone") is not None
+    assert registry.get("blobs") is None and registry.get("cache") is None
+    assert not (workdir / "data" / "blobs" / "status.json").exists()
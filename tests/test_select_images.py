@@ -0,0 +1,72 @@
+import pytest
+
+from app.services import downloader
+
+
+def _post(code, likes=0, comments=0, kind="Image", size=(1080, 1080), frames=0):
+    post = {
+        "shortCode": code,
+        "type": kind,
+        "likesCount": likes,
+        "commentsCount": comments,
+        "displayUrl": f"https://cdn.example/{code}.jpg",
+        "dimensionsWidth": size[0],
+        "dimensionsHeight": size[1],
+    }
+    if frames:
+        post["childPosts"] = [
+            {"shortCode": f"{code}-{i}", "displayUrl": f"https://cdn.example/{code}-{i}.jpg"}
+            for i in range(1, frames + 1)
+        ]
+    return post
+
+
+def _keys(selected):
+    return [source["key"] for source in selected]
+
+
+def test_hidden_counts_score_as_zero():
+    items = [{"latestPosts": [_post("hidden", likes=-1, comments=-1), _post("zero"), _post("liked", likes=10)]}]
+    selected = downloader.select_images(items, "zine")
+    scores = {source["key"]: source["score"] for source in selected}
+    assert scores["hidden"] == scores["zero"] > 0
+    assert _keys(selected)[0] == "liked"
+
+
+def test_video_cover_ranks_below_photo():
+    items = [{"latestPosts": [_post("clip", likes=50, kind="Video"), _post("photo", likes=50)]}]
+    selected = downloader.select_images(items, "zine")
+    assert _keys(selected) == ["photo", "clip"]
+    assert selected[1]["score"] == pytest.approx(selected[0]["score"] * downloader.VIDEO_WEIGHT)
+
+
+def test_aspect_fit_depends_on_format():
+    items = [{"latestPosts": [_post("square", size=(1000, 1000)), _post("wide", size=(1400, 1000))]}]
+    assert _keys(downloader.select_images(items, "zine")) == ["square", "wide"]
+    assert _keys(downloader.select_images(items, "classic")) == ["wide", "square"]
+
+
+def test_first_frames_before_carousel_tails():
+    items = [{"latestPosts": [_post("weak", likes=1, frames=2), _post("strong", likes=100, frames=1)]}]
+    keys = _keys(downloader.select_images(items, "zine"))
+    # по кадру с каждого поста, потом следующие кадры; внутри поста порядок сохраняется
+    assert keys[:2] == ["strong", "weak"]
+    assert keys.index("weak-1") < keys.index("weak-2")
+    assert set(keys[2:]) == {"strong-1", "weak-1", "weak-2"}
+
+
+def test_duplicate_urls_collected_once():
+    post = _post("dup")
+    post["childPosts"] = [{"shortCode": "dup-1", "displayUrl": post["displayUrl"]}]
+    assert _keys(downloader.select_images([{"latestPosts": [post]}], "zine")) == ["dup"]
+
+
+@pytest.mark.parametrize("book_format, expected", [("zine", 15), ("classic", 5), ("literary", 5), (None, 15)])
+def test_limit_per_format(book_format, expected):
+    items = [{"latestPosts": [_post(f"p{i}", likes=i) for i in range(20)]}]
+    assert len(downloader.select_images(items, book_format)) == expected
+
+
+def test_explicit_limit():
+    items = [{"latestPosts": [_post(f"p{i}") for i in range(10)]}]
+    assert len(downloader.select_images(items, "zine", limit=3)) == 3
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from app.services import singleflight
+
+
+def test_concurrent_calls_share_one_run():
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def run():
+        return await asyncio.gather(*(singleflight.do("key", work) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["result"] * 5
+    assert len(calls) == 1
+    assert "key" not in singleflight._inflight
+
+
+def test_error_reaches_every_caller():
+    async def work():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def run():
+        return await asyncio.gather(*(singleflight.do("err", work) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_next_call_after_completion_runs_again():
+    calls = []
+
+    async def work():
+        calls.append(1)
+
+    async def run():
+        await singleflight.do("again", work)
+        await singleflight.do("again", work)
+
+    asyncio.run(run())
+    assert len(calls) == 2
+
+
+def test_cancelled_leader_does_not_cancel_work():
+    finished = []
+
+    async def work():
+        await asyncio.sleep(0.05)
+        finished.append(1)
+        return "done"
+
+    async def run():
+        leader = asyncio.create_task(singleflight.do("lead", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(singleflight.do("lead", work))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == "done"
+    assert finished == [1]
+
+
+def test_cancelled_follower_does_not_cancel_leader():
+    async def work():
+        await asyncio.sleep(0.03)
+        return "done"
+
+    async def run():
+        leader = asyncio.create_task(singleflight.do("follow", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(singleflight.do("follow", work))
+        await asyncio.sleep(0.01)
+        follower.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+        return await leader
+
+    assert asyncio.run(run()) == "done"
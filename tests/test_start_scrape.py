@@ -0,0 +1,61 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.services import progress, registry, run_status
+
+client = TestClient(main.app)
+URL = "https://www.instagram.com/someone/"
+
+
+@pytest.fixture
+def apify(workdir, monkeypatch):
+    state = {"launched": [], "status": "RUNNING"}
+
+    async def run_actor(run_input, webhooks=None):
+        run = {"id": f"run{len(state['launched']) + 1}"}
+        state["launched"].append((run_input, webhooks))
+        return run
+
+    async def fetch_run(run_id):
+        return {"id": run_id, "status": state["status"]}
+
+    monkeypatch.setattr(main, "run_actor", run_actor)
+    monkeypatch.setattr(main, "fetch_run", fetch_run)
+    return state
+
+
+def _events(run_id):
+    return [event for _, event, _ in progress._channel(run_id).events]
+
+
+def test_running_scrape_is_joined(apify):
+    assert client.get("/start-scrape", params={"url": URL}).json()["runId"] == "run1"
+    body = client.get("/start-scrape", params={"url": URL}).json()
+    assert body["runId"] == "run1" and body["inflight"] is True
+    assert len(apify["launched"]) == 1
+
+
+@pytest.mark.parametrize("status", ["FAILED", "ABORTED", "TIMED-OUT"])
+def test_dead_inflight_scrape_relaunched(apify, status):
+    client.get("/start-scrape", params={"url": URL})
+    apify["status"] = status
+    body = client.get("/start-scrape", params={"url": URL}).json()
+    assert body["runId"] == "run2" and body["cached"] is False
+    assert "failed" in _events("run1")
+
+
+def test_webhook_subscribes_to_failures(apify):
+    client.get("/start-scrape", params={"url": URL})
+    _, webhooks = apify["launched"][0]
+    assert set(main.ACTOR_FAILED_EVENTS) < set(webhooks[0]["eventTypes"])
+    assert "{{eventType}}" in webhooks[0]["payloadTemplate"]
+
+
+def test_failure_webhook_clears_inflight_scrape(apify, workdir):
+    client.get("/start-scrape", params={"url": URL})
+    response = client.post("/webhook/apify", json={"runId": "run1", "eventType": "ACTOR.RUN.ABORTED"})
+    assert response.json()["status"] == "failed"
+    assert registry.cached_scrape(URL, ttl=3600, inflight=3600) is None
+    assert "ACTOR.RUN.ABORTED" in run_status.read(workdir / "data" / "run1")["error"]
+    assert _events("run1")[-1] == "failed"
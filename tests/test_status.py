@@ -0,0 +1,57 @@
+import json
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from app.main import app, status
+
+client = TestClient(app)
+
+
+@pytest.mark.parametrize("run_id", ["cache", "blobs", ".", "..", ".hidden"])
+def test_reserved_names_rejected(workdir, run_id):
+    (workdir / "data" / "cache").mkdir()
+    # «..» клиент схлопнул бы в URL — зовем обработчик напрямую
+    with pytest.raises(HTTPException) as error:
+        status(run_id)
+    assert error.value.status_code == 404
+    assert not list(workdir.rglob("status.json"))
+
+
+def test_reserved_name_over_http(workdir):
+    assert client.get("/status/cache").status_code == 404
+
+
+def test_plain_directory_not_rebuilt(workdir):
+    (workdir / "data" / "scratch").mkdir()
+    body = client.get("/status/scratch").json()
+    assert body["stages"]["book_generated"] is False
+    assert not (workdir / "data" / "scratch" / "status.json").exists()
+
+
+def test_legacy_run_rebuilt_once(workdir):
+    run_dir = workdir / "data" / "old-run"
+    run_dir.mkdir()
+    (run_dir / "posts.json").write_text(json.dumps([{"username": "someone", "latestPosts": []}]), encoding="utf-8")
+    (run_dir / "book.html").write_text("<html></html>", encoding="utf-8")
+
+    body = client.get("/status/old-run").json()
+    assert body["stages"]["data_collected"] and body["stages"]["book_generated"]
+    assert body["profile"]["username"] == "someone"
+    assert (run_dir / "status.json").exists()
+
+
+def test_requested_rebuild_hides_previous_book(workdir, monkeypatch):
+    from app.services import job_queue, pipeline, run_status
+
+    monkeypatch.setattr(job_queue, "_pipelines", {"book": pipeline.BOOK_STAGES})
+    run_dir = workdir / "data" / "run"
+    run_dir.mkdir()
+    (run_dir / "posts.jsonl").write_text(json.dumps({"username": "someone"}) + "\n", encoding="utf-8")
+    (run_dir / "book.html").write_text("<html>classic</html>", encoding="utf-8")
+    run_status.update(run_dir, stages={"book_generated": True})
+
+    response = client.post("/create-book", json={"runId": "run", "format": "zine"})
+    assert response.json()["jobId"]
+    assert client.get("/status/run").json()["stages"]["book_generated"] is False
@@ -0,0 +1,39 @@
+import pytest
+
+from app.services import templates
+
+CONTEXT = {
+    "title": "Книга",
+    "username": "someone",
+    "full_name": "Someone",
+    "followers": 1200,
+    "following": 300,
+    "posts_count": 42,
+    "word_count": 5000,
+    "chapters": {},
+    "figures": [None] * 5,
+}
+
+FONTS = {
+    "classic": "family=Libre+Baskerville",
+    "zine": "family=JetBrains+Mono",
+    "literary": "family=Libre+Baskerville",
+}
+
+
+@pytest.mark.parametrize("layout", templates.LAYOUTS)
+def test_layout_links_its_fonts(layout):
+    html = templates.render(layout, CONTEXT)
+    assert '<link href="https://fonts.googleapis.com/css2?' in html
+    assert FONTS[layout] in html
+    assert 'href=""' not in html
+
+
+@pytest.mark.parametrize("embed", [False, True])
+def test_stylesheet_linked_or_inlined(embed):
+    css, name = templates.stylesheet("zine")
+    html = templates.render("zine", CONTEXT, embed=embed)
+    if embed:
+        assert "<style>" in html and f"{templates.ASSETS_DIR}/{name}" not in html
+    else:
+        assert f'<link rel="stylesheet" href="{templates.ASSETS_DIR}/{name}">' in html